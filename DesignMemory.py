@@ -5,15 +5,19 @@ class design_memory:
     def __init__(self):
         self.buffer = []
 
-    def add_design(self, parameters, performance):
+    def add_design(self, parameters, performance, refined=False, conversation_round=None):
         """
         Adds a new design and its performance metrics to the memory buffer.
         :param parameters: Dictionary containing design parameters.
         :param performance: Dictionary containing performance metrics like gain margin, phase margin, etc.
+        :param refined: Whether the design came from numeric refinement rather than directly from the LLM.
+        :param conversation_round: Round the design was reported in, if already known.
         """
         entry = {
             'parameters': parameters,
-            'performance': performance
+            'performance': performance,
+            'refined': refined,
+            'conversation_round': conversation_round
         }
         self.buffer.append(entry)
 
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from api.task import CompleteTaskResp, complete_task
+from model.control_task import TaskSpecs
+
+BATCH_RUNNING = "running"
+BATCH_COMPLETED = "completed"
+BATCH_CANCELLED = "cancelled"
+
+
+class BatchTaskResult(BaseModel):
+    index: int = Field(..., description="position of the task in the submitted list")
+    task_id: Optional[int] = Field(None, description="id of the submitted TaskSpecs")
+    result: CompleteTaskResp
+
+
+class BatchSubmitResp(BaseModel):
+    batch_id: str = Field(..., description="batch id for the polling and streaming endpoints")
+    total: int = Field(..., description="number of tasks in the batch")
+
+
+class BatchStatus(BaseModel):
+    batch_id: str = Field(..., description="batch id")
+    status: str = Field(..., description="running, completed or cancelled")
+    total: int = Field(..., description="number of tasks in the batch")
+    completed: int = Field(..., description="number of finished tasks")
+    succeeded: int = Field(..., description="number of finished tasks that met their specs")
+    results: List[BatchTaskResult] = Field(..., description="results in completion order")
+
+
+class Batch:
+    def __init__(self, batch_id: str, specs: List[TaskSpecs]):
+        self.batch_id = batch_id
+        self.specs = specs
+        self.status = BATCH_RUNNING
+        # results in completion order
+        self.results: List[BatchTaskResult] = []
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self):
+        return self.status != BATCH_RUNNING
+
+    async def add_result(self, result: BatchTaskResult):
+        async with self.changed:
+            self.results.append(result)
+            self.changed.notify_all()
+
+    async def finish(self, status: str):
+        async with self.changed:
+            self.status = status
+            self.changed.notify_all()
+
+    def snapshot(self, since: int = 0) -> BatchStatus:
+        return BatchStatus(
+            batch_id=self.batch_id,
+            status=self.status,
+            total=len(self.specs),
+            completed=len(self.results),
+            succeeded=sum(result.result.is_success for result in self.results),
+            results=self.results[since:],
+        )
+
+
+class BatchManager:
+    """
+    Runs submitted batches of design tasks in the background, at most `concurrency` tasks at a time per batch.
+    All tasks go through the same LLM layer, so they share the process-wide rate limiter with interactive
+    requests. Finished batches are kept for polling until `max_batches` newer ones push them out.
+    """
+
+    def __init__(self, concurrency: int = None, max_tasks: int = None, max_batches: int = 100):
+        self.concurrency = concurrency or int(os.getenv("BATCH_CONCURRENCY", "8"))
+        self.max_tasks = max_tasks or int(os.getenv("BATCH_MAX_TASKS", "1000"))
+        self.max_batches = max_batches
+        self.batches = OrderedDict()
+
+    def submit(self, specs: List[TaskSpecs]) -> Batch:
+        if not specs:
+            raise ValueError("A batch needs at least one task")
+        if len(specs) > self.max_tasks:
+            raise ValueError("A batch holds at most {} tasks, got {}".format(self.max_tasks, len(specs)))
+        batch = Batch(uuid.uuid4().hex, specs)
+        self.batches[batch.batch_id] = batch
+        self._evict()
+        batch.task = asyncio.create_task(self._run(batch))
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        return self.batches.get(batch_id)
+
+    def cancel(self, batch_id: str) -> Optional[Batch]:
+        batch = self.batches.get(batch_id)
+        if batch is not None and batch.task is not None:
+            batch.task.cancel()
+        return batch
+
+    def shutdown(self):
+        for batch in self.batches.values():
+            if batch.task is not None:
+                batch.task.cancel()
+
+    async def stream(self, batch: Batch):
+        """
+        Yields every task result of the batch as one JSON line, as soon as the task finishes.
+        """
+        sent = 0
+        while True:
+            async with batch.changed:
+                await batch.changed.wait_for(lambda: len(batch.results) > sent or batch.done)
+                new, done = batch.results[sent:], batch.done
+            for result in new:
+                yield result.model_dump_json() + "\n"
+            sent += len(new)
+            if done and sent == len(batch.results):
+                yield json.dumps({'batch_id': batch.batch_id, 'status': batch.status}) + "\n"
+                return
+
+    async def _run(self, batch: Batch):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(index, specs):
+            async with slots:
+                try:
+                    response = await complete_task(specs)
+                except Exception as e:
+                    response = CompleteTaskResp(is_success=False, msg="Task failed: {}".format(e), final_result=None)
+            await batch.add_result(BatchTaskResult(index=index, task_id=specs.id, result=response))
+
+        try:
+            await asyncio.gather(*(run_one(index, specs) for index, specs in enumerate(batch.specs)))
+        except asyncio.CancelledError:
+            await batch.finish(BATCH_CANCELLED)
+            raise
+        await batch.finish(BATCH_COMPLETED)
+
+    def _evict(self):
+        # drop the oldest finished batches beyond max_batches; running ones are always kept
+        excess = len(self.batches) - self.max_batches
+        for batch_id in [batch_id for batch_id, batch in self.batches.items() if batch.done][:max(excess, 0)]:
+            del self.batches[batch_id]
+
+
+_batch_manager = None
+
+
+def get_batch_manager() -> BatchManager:
+    global _batch_manager
+    if _batch_manager is None:
+        _batch_manager = BatchManager()
+    return _batch_manager
@@ -0,0 +1,280 @@
+import asyncio
+import copy
+import os
+import traceback
+import uuid
+from typing import Dict, Optional, Set
+
+from pydantic import BaseModel, Field
+
+from api.progress import ProgressChannel, is_final
+from api.task import CompleteTaskResp
+from central_agent import AgentNotFoundError, CentralAgentLLM
+from job_store import ACTIVE_STATES, JOB_CANCELLED, JOB_FAILED, JOB_SUCCEEDED, JobStore
+from model.control_task import TaskDesignResult, TaskSpecs
+from subagents.base import subagents_classes
+
+
+class JobStatus(BaseModel):
+    job_id: str = Field(..., description="job id, used to reattach")
+    status: str = Field(..., description="queued, running, succeeded, failed or cancelled")
+    used_agent: Optional[str] = Field(None, description="sub-agent chosen by the central agent")
+    rounds: int = Field(..., description="number of published design rounds")
+    result: Optional[CompleteTaskResp] = Field(None, description="final result of a finished job")
+
+
+class _JobRun:
+    # live state of a job running in this worker
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers: Set[ProgressChannel] = set()
+        # rounds stored so far; subscribers get every later round live
+        self.published = 0
+
+
+class _JobInactive(Exception):
+    # the job was cancelled or finished elsewhere; its stored state is final
+    pass
+
+
+class _CheckpointQueue(asyncio.Queue):
+    # snapshots the sub-agent as each round is published, since the design loop moves on without waiting
+    def __init__(self, agent):
+        super().__init__()
+        self.agent = agent
+
+    def put_nowait(self, item):
+        checkpoint = None
+        if isinstance(item, TaskDesignResult) and not is_final(item):
+            checkpoint = copy.deepcopy(self.agent.checkpoint())
+        super().put_nowait((item, checkpoint))
+
+
+class JobManager:
+    """
+    Runs design sessions as durable jobs. Every round result is stored together with a checkpoint of the
+    sub-agent before the next round starts, so a session interrupted by a restart, a deploy or a crashed worker
+    resumes from its last round on whichever worker picks up its expired lease. Clients follow a job through
+    subscribe(), which replays the stored rounds and then forwards live ones; a client disconnecting does not
+    stop the job. A job running on another worker is followed by polling the store every `poll_interval`
+    seconds, which carries the round results but not the streamed text.
+    A job stops as soon as its row is no longer active, e.g. when another worker cancelled it.
+    Routing runs once per job; durable jobs run the routed sub-agent alone, without speculation or racing.
+    """
+
+    def __init__(self, store: JobStore, worker_id: str = None, lease: float = 30.0, poll_interval: float = 1.0):
+        self.store = store
+        self.worker_id = worker_id or uuid.uuid4().hex
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.runs: Dict[str, _JobRun] = {}
+        self._maintenance = None
+        self._closing = False
+
+    async def submit(self, specs: TaskSpecs) -> str:
+        job_id = await asyncio.to_thread(self.store.create, specs.model_dump(mode="json"), self.worker_id,
+                                         self.lease)
+        self._start(job_id)
+        return job_id
+
+    async def status(self, job_id: str) -> Optional[JobStatus]:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None:
+            return None
+        rounds = await asyncio.to_thread(self.store.rounds, job_id)
+        return JobStatus(
+            job_id=job_id,
+            status=job['status'],
+            used_agent=job['agent_name'],
+            rounds=len(rounds),
+            result=CompleteTaskResp.model_validate(job['final']) if job['final'] is not None else None,
+        )
+
+    async def cancel(self, job_id: str) -> bool:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None:
+            return False
+        # stop the local run first so it stores no further round; a run on another worker stops at its next one
+        run = self.runs.get(job_id)
+        if run is not None and run.task is not None:
+            run.task.cancel()
+        await asyncio.to_thread(self.store.finish, job_id, JOB_CANCELLED)
+        return True
+
+    async def subscribe(self, job_id: str, since: int = 0):
+        """
+        Yields the stored round results of the job from `since` on, then the live rounds and streamed text
+        until the job finishes. Jobs that are not running in this worker are followed through the store.
+        Yields nothing for unknown jobs.
+        """
+        run = self.runs.get(job_id)
+        if run is None:
+            async for item in self._poll(job_id, since):
+                yield item
+            return
+        live = ProgressChannel()
+        run.subscribers.add(live)
+        live_from = run.published
+        try:
+            for seq, result in await asyncio.to_thread(self.store.rounds, job_id, since):
+                if seq >= live_from:
+                    break
+                yield TaskDesignResult.model_validate(result)
+            seq = live_from
+            async for item in live:
+                if isinstance(item, TaskDesignResult) and not is_final(item):
+                    seq += 1
+                    # rounds before `since` were already seen by the client
+                    if seq <= since:
+                        continue
+                yield item
+        finally:
+            run.subscribers.discard(live)
+        if not self._closing:
+            # the run ended without this worker shutting down, e.g. it was cancelled: the store has the outcome
+            async for item in self._poll(job_id, max(run.published, since)):
+                yield item
+
+    async def _poll(self, job_id: str, since: int):
+        # stored rounds of a job owned by another worker (or not yet resumed), until it reaches a final status
+        while True:
+            # read the status first, so the rounds stored before the job finished are all yielded
+            job = await asyncio.to_thread(self.store.get, job_id)
+            for seq, result in await asyncio.to_thread(self.store.rounds, job_id, since):
+                since = seq + 1
+                yield TaskDesignResult.model_validate(result)
+            if job is None or job['status'] not in ACTIVE_STATES:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    def start_maintenance(self, interval: float = None):
+        """
+        Renews the leases of the jobs of this worker and resumes expired jobs, including those interrupted by
+        the previous run of this worker.
+        """
+        if self._maintenance is None:
+            self._maintenance = asyncio.create_task(self._maintain(interval or self.lease / 3))
+
+    def shutdown(self):
+        # running jobs keep their state and are resumed once their lease expires
+        self._closing = True
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+        for run in self.runs.values():
+            if run.task is not None:
+                run.task.cancel()
+
+    async def _maintain(self, interval):
+        while True:
+            await asyncio.to_thread(self.store.renew, self.worker_id, self.lease)
+            for job_id, run in list(self.runs.items()):
+                job = await asyncio.to_thread(self.store.get, job_id)
+                if job is not None and job['status'] not in ACTIVE_STATES and run.task is not None:
+                    # cancelled by another worker while between rounds
+                    run.task.cancel()
+            for job_id in await asyncio.to_thread(self.store.expired):
+                if job_id not in self.runs and await asyncio.to_thread(self.store.claim, job_id, self.worker_id,
+                                                                       self.lease):
+                    print("Resuming design job", job_id)
+                    self._start(job_id)
+            await asyncio.sleep(interval)
+
+    def _start(self, job_id):
+        run = self.runs[job_id] = _JobRun()
+        run.task = asyncio.create_task(self._run(job_id, run))
+        run.task.add_done_callback(lambda _: self.runs.pop(job_id, None))
+
+    def _publish(self, run: _JobRun, item):
+        for subscriber in run.subscribers:
+            subscriber.put_nowait(item)
+
+    async def _run(self, job_id: str, run: _JobRun):
+        try:
+            try:
+                result = await self._design(job_id, run)
+                response = CompleteTaskResp(is_success=result.is_success, msg="Successfully completed task",
+                                            final_result=result)
+                status = JOB_SUCCEEDED if result.is_success else JOB_FAILED
+            except _JobInactive:
+                return None
+            except AgentNotFoundError as e:
+                response = CompleteTaskResp(is_success=False, msg=str(e), final_result=None)
+                status = JOB_FAILED
+            except Exception as e:
+                traceback.print_exc()
+                response = CompleteTaskResp(is_success=False, msg="Task failed: {}".format(e), final_result=None)
+                status = JOB_FAILED
+            await asyncio.to_thread(self.store.finish, job_id, status, response.model_dump(mode="json"))
+            return response
+        finally:
+            # also on cancellation; an interrupted job is resumed by some worker and can be reattached
+            for subscriber in run.subscribers:
+                subscriber.close()
+
+    async def _design(self, job_id: str, run: _JobRun):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job['status'] not in ACTIVE_STATES:
+            raise _JobInactive()
+        specs = TaskSpecs.model_validate(job['specs'])
+        run.published = len(await asyncio.to_thread(self.store.rounds, job_id))
+        if job['agent_number'] is None:
+            central_agent = CentralAgentLLM()
+            agent_number, agent_name, task_requirement = await central_agent.choose_subagent(specs)
+            if agent_number not in subagents_classes:
+                raise AgentNotFoundError()
+            if not await asyncio.to_thread(self.store.set_routing, job_id, agent_number, agent_name,
+                                           task_requirement):
+                raise _JobInactive()
+        else:
+            agent_number, task_requirement = job['agent_number'], job['task_requirement']
+        agent = CentralAgentLLM._create_agent(agent_number, specs, task_requirement)
+        if job['checkpoint'] is not None:
+            agent.restore(job['checkpoint'])
+        if agent.is_success:
+            return agent.construct_final_result()
+
+        rounds = _CheckpointQueue(agent)
+        pump = asyncio.create_task(self._pump(job_id, run, rounds))
+        try:
+            result = await agent.handle_task(rounds)
+            # a failed pump would never drain the queue
+            drained = asyncio.ensure_future(rounds.join())
+            await asyncio.wait([drained, pump], return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+            if pump.done():
+                pump.result()
+            return result
+        finally:
+            pump.cancel()
+
+    async def _pump(self, job_id: str, run: _JobRun, rounds: _CheckpointQueue):
+        # persists every round with the checkpoint taken right after it, then forwards it to the subscribers
+        while True:
+            item, checkpoint = await rounds.get()
+            if checkpoint is not None:
+                if not await asyncio.to_thread(self.store.save_round, job_id, run.published,
+                                               item.model_dump(mode="json"), checkpoint):
+                    # cancelled or finished elsewhere, the design loop must not go on
+                    run.task.cancel()
+                    return
+                run.published += 1
+            self._publish(run, item)
+            rounds.task_done()
+
+
+_job_manager = None
+
+
+def get_job_manager() -> Optional[JobManager]:
+    """
+    Process-wide job manager backed by the sqlite file JOB_STORE_PATH; None when durable jobs are disabled.
+    JOB_LEASE sets the lease in seconds, JOB_POLL_INTERVAL how often jobs of other workers are polled.
+    """
+    global _job_manager
+    path = os.getenv("JOB_STORE_PATH")
+    if not path:
+        return None
+    if _job_manager is None:
+        _job_manager = JobManager(JobStore(path), lease=float(os.getenv("JOB_LEASE", "30")),
+                                  poll_interval=float(os.getenv("JOB_POLL_INTERVAL", "1")))
+    return _job_manager
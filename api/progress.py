@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+from model.control_task import DesignTextDelta, ProgressHeartbeat, TaskDesignResult
+
+COALESCE = "coalesce"
+DROP = "drop"
+OVERFLOW_POLICIES = (COALESCE, DROP)
+
+
+def is_final(item):
+    return isinstance(item, TaskDesignResult) and item.conversation_round == -1
+
+
+class ProgressChannel:
+    """
+    Bounded per-connection buffer between a design session and a client. Publishing never waits, so a slow
+    client cannot slow the design loop down. When the buffer is full the overflow policy makes room:
+    - coalesce: streamed text is appended to the buffered text of the same round and agent, and a round
+      result replaces the buffered result of the same agent; failing that, the oldest message is dropped.
+    - drop: the oldest message is dropped.
+    The final marker (conversation round -1) is never dropped. Iterating the channel yields the messages and a
+    ProgressHeartbeat whenever nothing was published for `heartbeat` seconds, until the channel is closed.
+    """
+
+    def __init__(self, maxsize: int = None, overflow: str = None, heartbeat: float = None):
+        """
+        :param maxsize: Buffered messages, PROGRESS_BUFFER by default (32).
+        :param overflow: coalesce or drop, PROGRESS_OVERFLOW by default (coalesce).
+        :param heartbeat: Idle seconds between heartbeats, PROGRESS_HEARTBEAT by default (15), 0 to disable.
+        """
+        self.maxsize = maxsize or int(os.getenv("PROGRESS_BUFFER", "32"))
+        self.overflow = overflow or os.getenv("PROGRESS_OVERFLOW", COALESCE)
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {}, expected one of {}".format(self.overflow,
+                                                                                   OVERFLOW_POLICIES))
+        self.heartbeat = heartbeat if heartbeat is not None else float(os.getenv("PROGRESS_HEARTBEAT", "15"))
+        self.dropped = 0
+        self.closed = False
+        self._buffer = deque()
+        self._ready = asyncio.Event()
+
+    def put_nowait(self, item):
+        if self.closed:
+            return
+        if len(self._buffer) >= self.maxsize and not is_final(item):
+            if self.overflow == COALESCE and self._coalesce(item):
+                return
+            self._drop_oldest()
+        self._buffer.append(item)
+        self._ready.set()
+
+    async def put(self, item):
+        # same as put_nowait, for code written against asyncio.Queue
+        self.put_nowait(item)
+
+    def close(self):
+        # ends the iteration once the buffered messages are consumed
+        self.closed = True
+        self._ready.set()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            while self._buffer:
+                yield self._buffer.popleft()
+            if self.closed:
+                return
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.heartbeat or None)
+            except asyncio.TimeoutError:
+                yield ProgressHeartbeat(dropped=self.dropped)
+
+    def _coalesce(self, item):
+        for index in range(len(self._buffer) - 1, -1, -1):
+            buffered = self._buffer[index]
+            if isinstance(item, DesignTextDelta):
+                if (isinstance(buffered, DesignTextDelta) and buffered.agent == item.agent
+                        and buffered.conversation_round == item.conversation_round):
+                    self._buffer[index] = buffered.model_copy(update={'text': buffered.text + item.text})
+                    return True
+            elif isinstance(item, TaskDesignResult):
+                if isinstance(buffered, TaskDesignResult) and not is_final(buffered) and buffered.agent == item.agent:
+                    # the client gets the latest round, earlier ones are in the final design history
+                    del self._buffer[index]
+                    self._buffer.append(item)
+                    self.dropped += 1
+                    return True
+        return False
+
+    def _drop_oldest(self):
+        for index, buffered in enumerate(self._buffer):
+            if not is_final(buffered):
+                del self._buffer[index]
+                if self.dropped == 0:
+                    logging.warning("Progress client is falling behind, dropping intermediate messages")
+                self.dropped += 1
+                return
@@ -1,4 +1,5 @@
 import asyncio
+from typing import Optional
 
 from central_agent import CentralAgentLLM, AgentNotFoundError
 from model.control_task import FinalTaskDesignResult
@@ -9,7 +10,7 @@ from pydantic import BaseModel, Field
 class CompleteTaskResp(BaseModel):
     is_success: bool = Field(..., description="task completed successfully or not")
     msg: str = Field(..., description="execution message")
-    final_result: FinalTaskDesignResult
+    final_result: Optional[FinalTaskDesignResult]
 
 
 async def complete_task(specs: TaskSpecs, _async: bool = False, result_queue: asyncio.Queue = None) -> CompleteTaskResp:
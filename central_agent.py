@@ -1,12 +1,19 @@
 import asyncio
 import json
+import os
 
 import control as ctrl
 
 from instruction import response_instruct
 from llm.base import LLM
+from llm.cache import with_cache
 from llm.gpt4 import GPT4
+from llm.hedge import with_hedging
+from llm.limit import ConcurrencyLimitedLLM
+from llm.rate_limit import ROUTING_PRIORITY, priority
+from llm.tiering import ROUTING, stage, with_tiering
 from model.control_task import TaskSpecs
+from plant_classifier import classify_plant, describe_task
 from subagents.base import subagents_names, subagents_classes
 
 central_agent_prompt = """
@@ -34,11 +41,58 @@ class AgentNotFoundError(Exception):
 
 class CentralAgentLLM:
 
-    def __init__(self, llm: LLM = GPT4(engine='gpt-4o-2024-08-06', temperature=0.0, max_tokens=1024)):
-        self.llm = llm
-        # Define the available sub-agents
+    def __init__(self, llm: LLM = with_cache(GPT4(engine='gpt-4o-2024-08-06', temperature=0.0, max_tokens=1024)),
+                 rule_based_routing: bool = None, speculative: bool = None, race_size: int = None,
+                 max_llm_calls: int = None, report_race: bool = None):
+        self.llm = with_hedging(with_tiering(llm))
+        # route plants whose class is obvious without asking the LLM
+        self.rule_based_routing = (rule_based_routing if rule_based_routing is not None
+                                   else os.getenv("RULE_BASED_ROUTING", "1") == "1")
+        # start the likely sub-agent's first design round while the LLM is still routing
+        self.speculative = speculative if speculative is not None else os.getenv("SPECULATIVE_ROUTING", "1") == "1"
+        # number of sub-agents racing on one task, 1 runs the routed sub-agent alone
+        self.race_size = race_size or int(os.getenv("RACE_SUBAGENTS", "1"))
+        # cap on the concurrent LLM calls of all racing sub-agents of one request
+        self.max_llm_calls = max_llm_calls or int(os.getenv("RACE_MAX_LLM_CALLS", "2"))
+        # attach the partial histories of the losers to the final result
+        self.report_race = report_race if report_race is not None else os.getenv("RACE_REPORT", "0") == "1"
+
+    def route_locally(self, task_specs: TaskSpecs):
+        """
+        Deterministic routing from the plant class.
+        :return: (agent number, agent name, task requirement), or None if the plant is ambiguous or no sub-agent
+                 handles its class.
+        """
+        plant_class = classify_plant(task_specs.num, task_specs.den, task_specs.tau)
+        if plant_class is None:
+            return None
+        for agent_number, agent_cls in subagents_classes.items():
+            if agent_cls.plant_class == plant_class:
+                return agent_number, subagents_names[agent_number], describe_task(task_specs, plant_class)
+        return None
+
+    def guess_subagent(self, task_specs: TaskSpecs):
+        """
+        Most likely routing for plants the classifier cannot route with confidence, used for speculation only.
+        :return: (agent number, task requirement), or None if there is no likely sub-agent.
+        """
+        plant_class = classify_plant(task_specs.num, task_specs.den, task_specs.tau, strict=False)
+        if plant_class is None:
+            return None
+        for agent_number, agent_cls in subagents_classes.items():
+            if agent_cls.plant_class == plant_class:
+                return agent_number, describe_task(task_specs, plant_class)
+        # with a single sub-agent the LLM has nothing else to choose
+        if len(subagents_classes) == 1:
+            return next(iter(subagents_classes)), describe_task(task_specs, plant_class)
+        return None
+
+    async def choose_subagent(self, task_specs: TaskSpecs):
+        if self.rule_based_routing:
+            route = self.route_locally(task_specs)
+            if route is not None:
+                return route
 
-    def choose_subagent(self, task_specs: TaskSpecs):
         requirement_summary = """
                     \nDesign the controller to meet the following specifications:
                     Phase margin greater or equal {phase_margin_min} degrees,
@@ -54,9 +108,14 @@ class CentralAgentLLM:
             user_request += " with time delay {tau} sec".format(tau=task_specs.tau)
         user_request += requirement_summary
 
-        prompt = "".join([central_agent_prompt, user_request, response_instruct])
+        # the static agent list and response format form a stable prefix, the plant and specs follow
+        messages = [
+            {"role": "system", "content": central_agent_prompt + response_instruct},
+            {"role": "user", "content": user_request},
+        ]
         # Parse the LLM response, which follows a strict JSON format.
-        response = self.llm.complete(prompt)
+        with priority(ROUTING_PRIORITY), stage(ROUTING):
+            response = await self.llm.acomplete_messages(messages)
 
         parsed_response = json.loads(response)
         agent_number = int(parsed_response.get("Agent Number"))
@@ -67,11 +126,112 @@ class CentralAgentLLM:
             return INVALID_AGENT_NUMBER, "", ""
 
     async def complete_task(self, task_specs: TaskSpecs, _async: bool = False, result_queue: asyncio.Queue = None):
-        agent_number, agent_name, task_requirement = self.choose_subagent(task_specs)
-        if agent_number in subagents_classes:
-            agent = subagents_classes[agent_number](task_specs, task_specs.construct_thresholds(),
-                                                    task_requirement, task_specs.scenario)
-            result = await agent.handle_task(result_queue)
+        route = self.route_locally(task_specs) if self.rule_based_routing else None
+        guess, speculative_agent = None, None
+        if route is None and self.speculative:
+            guess = self.guess_subagent(task_specs)
+            if guess is not None:
+                speculative_agent = self._create_agent(guess[0], task_specs, guess[1])
+                speculative_agent.speculate()
+
+        try:
+            agent_number, agent_name, task_requirement = (route if route is not None
+                                                          else await self.choose_subagent(task_specs))
+        except BaseException:
+            if speculative_agent is not None:
+                speculative_agent.cancel_speculation()
+            raise
+
+        if speculative_agent is not None:
+            if agent_number == guess[0]:
+                # routing agreed, keep the round already in flight and its local task requirement
+                agent = speculative_agent
+            else:
+                print("Speculative routing to agent {} discarded, routed to {}".format(guess[0], agent_number))
+                speculative_agent.cancel_speculation()
+                speculative_agent = None
+        if speculative_agent is None:
+            if agent_number not in subagents_classes:
+                raise AgentNotFoundError()
+            agent = self._create_agent(agent_number, task_specs, task_requirement)
+
+        contenders = self.rank_subagents(task_specs, agent_number)[:self.race_size]
+        if len(contenders) > 1:
+            agents = [agent] + [self._create_agent(n, task_specs, task_requirement) for n in contenders[1:]]
+            return await self.race(agents, result_queue)
+        result = await agent.handle_task(result_queue)
+        return result
+
+    def rank_subagents(self, task_specs: TaskSpecs, agent_number):
+        # the routed sub-agent, then the classifier's guess, then the remaining ones in registry order
+        ranked = [agent_number]
+        guess = self.guess_subagent(task_specs)
+        if guess is not None and guess[0] not in ranked:
+            ranked.append(guess[0])
+        ranked += [n for n in subagents_classes if n not in ranked]
+        return ranked
+
+    async def race(self, agents, result_queue: asyncio.Queue = None):
+        """
+        Runs several sub-agents on the same task; the first one to meet the thresholds wins and the others are
+        cancelled. Without a winner the result of the first agent (the routed one) is returned.
+        :param agents: Sub-agents in rank order.
+        """
+        llm_slots = asyncio.Semaphore(self.max_llm_calls)
+        for agent in agents:
+            if hasattr(agent, "llm"):
+                agent.llm = ConcurrencyLimitedLLM(agent.llm, llm_slots)
+        runs = {asyncio.create_task(self._run_contender(agent, result_queue)): agent for agent in agents}
+        results, errors = {}, []
+        pending = set(runs)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for run in done:
+                    if run.exception() is not None:
+                        print("Sub-agent {} failed: {}".format(runs[run].agent_name, run.exception()))
+                        errors.append(run.exception())
+                    else:
+                        results[runs[run]] = run.result()
+                if any(result.is_success for result in results.values()):
+                    break
+        finally:
+            for run in pending:
+                run.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if not results:
+            raise errors[0]
+        finished = [agent for agent in agents if agent in results]
+        winner = next((agent for agent in finished if results[agent].is_success), finished[0])
+        final = results[winner]
+        if self.report_race:
+            final.other_agents = [results[agent] if agent in results else agent.construct_final_result()
+                                  for agent in agents if agent is not winner]
+        return final
+
+    @staticmethod
+    async def _run_contender(agent, result_queue: asyncio.Queue = None):
+        if result_queue is None:
+            return await agent.handle_task()
+        # rounds go through a private queue and are tagged with the sub-agent before reaching the client
+        rounds = asyncio.Queue()
+
+        async def relay():
+            while True:
+                cur_result = await rounds.get()
+                result_queue.put_nowait(cur_result.model_copy(update={'agent': agent.agent_name}))
+                rounds.task_done()
+
+        relay_task = asyncio.create_task(relay())
+        try:
+            result = await agent.handle_task(rounds)
+            await rounds.join()
             return result
-        else:
-            raise AgentNotFoundError()
+        finally:
+            relay_task.cancel()
+
+    @staticmethod
+    def _create_agent(agent_number, task_specs: TaskSpecs, task_requirement):
+        return subagents_classes[agent_number](task_specs, task_specs.construct_thresholds(),
+                                               task_requirement, task_specs.scenario)
@@ -0,0 +1,70 @@
+import numpy as np
+
+from evaluation.margins import margins_batch
+from evaluation.stability import characteristic_polynomial, routh_hurwitz_batch
+from evaluation.step_response import step_metrics_batch
+
+CHUNK_SIZE = 64
+
+
+def loop_shaping_batch(omega_L, beta_b, num, den):
+    """
+    Evaluates many PI loop-shaping candidates (same controller as util.loop_shaping) for one plant at once.
+    :param omega_L: Array of loop bandwidths.
+    :param beta_b: Array of integral boost parameters, broadcast against omega_L.
+    :param num: Plant numerator coefficients.
+    :param den: Plant denominator coefficients.
+    :return: Dictionary of arrays 'is_stable', 'gain_margin', 'phase_margin', 'rise_time', 'settling_time',
+             'overshoot' and 'steadystate_error'. Time-domain metrics are NaN for unstable candidates.
+    """
+    omega_L, beta_b = np.broadcast_arrays(np.atleast_1d(np.asarray(omega_L, dtype=float)),
+                                          np.atleast_1d(np.asarray(beta_b, dtype=float)))
+    omega_L, beta_b = omega_L.ravel(), beta_b.ravel()
+    num = np.atleast_1d(np.asarray(num, dtype=float))
+    den = np.atleast_1d(np.asarray(den, dtype=float))
+
+    num_L, den_L = pi_loop_coefficients(omega_L, beta_b, num, den)
+    char = characteristic_polynomial(num_L, den_L)
+    is_stable = routh_hurwitz_batch(char)
+
+    n = len(omega_L)
+    loop_margins = margins_batch(num_L, den_L, omega_hint=omega_L)
+    result = {
+        'is_stable': is_stable,
+        'gain_margin': loop_margins['gain_margin'],
+        'phase_margin': loop_margins['phase_margin'],
+        'rise_time': np.full(n, np.nan),
+        'settling_time': np.full(n, np.nan),
+        'overshoot': np.full(n, np.nan),
+        'steadystate_error': steady_state_error_batch(num_L, den_L),
+    }
+
+    stable_idx = np.flatnonzero(is_stable)
+    for start in range(0, len(stable_idx), CHUNK_SIZE):
+        idx = stable_idx[start:start + CHUNK_SIZE]
+        rise, settling, overshoot = step_metrics_batch(num_L[idx], char[idx])
+        result['rise_time'][idx] = rise
+        result['settling_time'][idx] = settling
+        result['overshoot'][idx] = overshoot
+    return result
+
+
+def pi_loop_coefficients(omega_L, beta_b, num, den):
+    """
+    Builds L(s) = G(s) K_p (beta_b s + omega_L) / (s sqrt(beta_b^2 + 1)) for each candidate.
+    :return: (num_L, den_L) where num_L has one row per candidate and den_L is shared.
+    """
+    s = 1j * omega_L
+    K_p = 1 / np.abs(np.polyval(num, s) / np.polyval(den, s))
+    gain = K_p / np.sqrt(beta_b * beta_b + 1)
+    # num(s) * (beta_b s + omega_L)
+    num_L = gain[:, None] * (beta_b[:, None] * np.append(num, 0.0) + omega_L[:, None] * np.insert(num, 0, 0.0))
+    den_L = np.append(den, 0.0)
+    return num_L, den_L
+
+
+def steady_state_error_batch(num_L, den_L):
+    # 1 / (1 + |L(0)|) for a unit step, with the integrator sending L(0) to infinity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dc = np.abs(num_L[:, -1] / den_L[-1])
+    return np.where(np.isinf(dc), 0.0, 1 / (1 + dc))
@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from evaluation.evaluator import DesignEvaluation
+
+
+def _round_sig(x, digits):
+    return float(f"{float(x):.{digits}g}")
+
+
+def plant_key(num, den, tau=None, digits=10):
+    """
+    Canonical form of a plant: leading zeros stripped, monic denominator, coefficients rounded.
+    """
+    num = [float(c) for c in num]
+    den = [float(c) for c in den]
+    while len(num) > 1 and num[0] == 0:
+        num.pop(0)
+    while len(den) > 1 and den[0] == 0:
+        den.pop(0)
+    lead = den[0]
+    return (tuple(_round_sig(c / lead, digits) for c in num),
+            tuple(_round_sig(c / lead, digits) for c in den),
+            _round_sig(tau, digits) if tau else None)
+
+
+class EvaluationCache:
+    """
+    Bounded LRU memo of design evaluations keyed by canonical plant, controller structure and rounded parameters.
+    """
+
+    def __init__(self, max_entries: int = 4096, digits: int = 6):
+        self.max_entries = max_entries
+        self.digits = digits
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, evaluator, omega_L, beta_b, beta_l="NA"):
+        params = tuple(p if p == "NA" else _round_sig(p, self.digits) for p in (omega_L, beta_b, beta_l))
+        return plant_key(evaluator.num, evaluator.den, evaluator.tau), evaluator.lead, params
+
+    def get(self, key) -> Optional[DesignEvaluation]:
+        with self._lock:
+            evaluation = self._entries.get(key)
+            if evaluation is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return evaluation
+
+    def put(self, key, evaluation: DesignEvaluation):
+        with self._lock:
+            self._entries[key] = evaluation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+        }
+
+
+_shared_cache = None
+
+
+def get_evaluation_cache() -> Optional[EvaluationCache]:
+    """
+    Process-wide cache sized by EVAL_CACHE_SIZE (0 disables it) with parameters rounded to
+    EVAL_CACHE_DIGITS significant digits.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        max_entries = int(os.getenv("EVAL_CACHE_SIZE", "4096"))
+        if max_entries <= 0:
+            return None
+        _shared_cache = EvaluationCache(max_entries=max_entries, digits=int(os.getenv("EVAL_CACHE_DIGITS", "6")))
+    return _shared_cache
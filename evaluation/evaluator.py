@@ -0,0 +1,176 @@
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+
+import control as ctrl
+import numpy as np
+
+from evaluation.batch import loop_shaping_batch
+from evaluation.first_order import is_first_order, FirstOrderPILoop
+from evaluation.margins import margins
+from evaluation.stability import is_stable
+from evaluation.step_response import delayed_step_metrics, step_metrics
+
+PADE_ORDER = 5
+
+
+@dataclass(frozen=True)
+class DesignEvaluation:
+    is_stable: bool
+    gain_margin: float = math.nan
+    phase_margin: float = math.nan
+    rise_time: float = math.nan
+    settling_time: float = math.nan
+    overshoot: float = math.nan
+    steadystate_error: float = math.nan
+
+    def performance(self):
+        # performance entry in the layout the sub-agents store in design_memory
+        return {'phase_margin': self.phase_margin, 'settling_time_min': self.settling_time,
+                'settling_time_max': self.settling_time, 'steadystate_error': self.steadystate_error}
+
+
+@lru_cache(maxsize=128)
+def pade_factors(tau, order=PADE_ORDER):
+    """
+    Pade approximation of exp(-tau s) as (numerator, denominator) coefficient arrays, computed once per delay.
+    """
+    pade_num, pade_den = ctrl.pade(tau, order)
+    return np.asarray(pade_num, dtype=float), np.asarray(pade_den, dtype=float)
+
+
+def loop_coefficients(num, den, omega_L, beta_b, beta_l="NA"):
+    """
+    Polynomial form of L = G K_p K_i (K_l), the loop built by util.loop_shaping and util.loop_shaping_pid.
+    :return: (num_L, den_L) coefficient arrays.
+    """
+    K_p = 1 / abs(np.polyval(num, 1j * omega_L) / np.polyval(den, 1j * omega_L))
+    num_L = K_p * np.polymul(num, [beta_b, omega_L])
+    den_L = np.polymul(den, [math.sqrt(beta_b * beta_b + 1), 0])
+    if beta_l != "NA":
+        num_L = np.polymul(num_L, [beta_l, omega_L])
+        den_L = np.polymul(den_L, [1, beta_l * omega_L])
+    return num_L, den_L
+
+
+class LoopShapingEvaluator:
+    """
+    Evaluates loop-shaping designs K = K_p * K_i (* K_l) for one plant.
+    The plant model (including the Pade factors of a delay) is built once and reused across rounds, and each
+    design builds its loop a single time for the stability gate and all metrics.
+    """
+
+    def __init__(self, num, den, tau=None, lead=False):
+        self.num = list(num)
+        self.den = list(den)
+        self.tau = tau
+        self.lead = lead
+        self.G = ctrl.TransferFunction(self.num, self.den)
+        if tau:
+            self.G = self.G * ctrl.TransferFunction(*pade_factors(float(tau)))
+
+    def gain(self, omega_L):
+        # K_p = 1/|G(j omega_L)|
+        mag_c, _, _ = ctrl.frequency_response(self.G, omega_L)
+        return 1 / np.abs(mag_c)[0]
+
+    def controller(self, omega_L, beta_b, beta_l="NA"):
+        Ki = ctrl.TransferFunction([beta_b, omega_L], [math.sqrt(beta_b * beta_b + 1), 0])
+        K = self.gain(omega_L) * Ki
+        if self.lead and beta_l != "NA":
+            K = K * ctrl.TransferFunction([beta_l, omega_L], [1, beta_l * omega_L])
+        return K
+
+    def evaluate(self, omega_L, beta_b, beta_l="NA") -> DesignEvaluation:
+        L = self.G * self.controller(omega_L, beta_b, beta_l)
+        # stability gate on the characteristic polynomial before any closed-loop system is built
+        char = np.polyadd(L.den[0][0], L.num[0][0])
+        if not is_stable(char):
+            return DesignEvaluation(is_stable=False)
+
+        # closed loop L/(1+L) = num_L/char, simulated over a horizon chosen from its poles
+        rise_time, settling_time, overshoot = step_metrics(L.num[0][0], char)
+        gm, pm, _, _ = margins(L.num[0][0], L.den[0][0], omega_hint=omega_L)
+        ess = 1 / (1 + np.abs(ctrl.dcgain(L)))
+        return DesignEvaluation(is_stable=True, gain_margin=gm, phase_margin=pm, rise_time=rise_time,
+                                settling_time=settling_time, overshoot=overshoot, steadystate_error=ess)
+
+    def evaluate_batch(self, omega_L, beta_b):
+        """
+        Evaluates several PI designs at once, in a single vectorized pass when the plant has no delay.
+        :return: One DesignEvaluation per (omega_L, beta_b) pair.
+        """
+        if self.lead or self.tau:
+            return [self.evaluate(w, b) for w, b in zip(omega_L, beta_b)]
+        batch = loop_shaping_batch(omega_L, beta_b, self.num, self.den)
+        evaluations = []
+        for i, stable in enumerate(batch['is_stable']):
+            if not stable:
+                evaluations.append(DesignEvaluation(is_stable=False))
+                continue
+            evaluations.append(DesignEvaluation(
+                is_stable=True, gain_margin=float(batch['gain_margin'][i]),
+                phase_margin=float(batch['phase_margin'][i]), rise_time=float(batch['rise_time'][i]),
+                settling_time=float(batch['settling_time'][i]), overshoot=float(batch['overshoot'][i]),
+                steadystate_error=float(batch['steadystate_error'][i])))
+        return evaluations
+
+
+class FirstOrderPIEvaluator:
+    """
+    Closed-form evaluator for K/(s+a) plants under the PI controller, see evaluation.first_order.
+    """
+
+    def __init__(self, num, den):
+        self.num = list(num)
+        self.den = list(den)
+        self.tau = None
+        self.lead = False
+
+    def evaluate(self, omega_L, beta_b, beta_l="NA") -> DesignEvaluation:
+        loop = FirstOrderPILoop(omega_L, beta_b, self.num, self.den)
+        if not loop.is_stable():
+            return DesignEvaluation(is_stable=False)
+        rise_time, settling_time, overshoot = loop.step_metrics()
+        return DesignEvaluation(is_stable=True, gain_margin=loop.gain_margin(), phase_margin=loop.phase_margin(),
+                                rise_time=rise_time, settling_time=settling_time, overshoot=overshoot,
+                                steadystate_error=loop.steady_state_error())
+
+
+class DelayLoopShapingEvaluator:
+    """
+    Evaluates loop-shaping designs for a plant G(s) exp(-tau s) without folding the delay into a Pade model:
+    margins use the exact factor exp(-jw tau) and the step response a delay-line simulation.
+    Only the stability gate (and the simulation horizon) relies on the cached Pade approximation.
+    """
+
+    def __init__(self, num, den, tau, lead=False):
+        self.num = list(num)
+        self.den = list(den)
+        self.tau = tau
+        self.lead = lead
+        self.pade_num, self.pade_den = pade_factors(float(tau))
+
+    def evaluate(self, omega_L, beta_b, beta_l="NA") -> DesignEvaluation:
+        # |exp(-j omega_L tau)| = 1, so K_p is the same as without the delay
+        num_L, den_L = loop_coefficients(self.num, self.den, omega_L, beta_b, beta_l if self.lead else "NA")
+        char = np.polyadd(np.polymul(den_L, self.pade_den), np.polymul(num_L, self.pade_num))
+        if not is_stable(char):
+            return DesignEvaluation(is_stable=False)
+
+        rise_time, settling_time, overshoot = delayed_step_metrics(num_L, den_L, self.tau, np.roots(char))
+        gm, pm, _, _ = margins(num_L, den_L, omega_hint=omega_L, tau=self.tau)
+        ess = 0.0 if den_L[-1] == 0 else 1 / (1 + abs(num_L[-1] / den_L[-1]))
+        return DesignEvaluation(is_stable=True, gain_margin=gm, phase_margin=pm, rise_time=rise_time,
+                                settling_time=settling_time, overshoot=overshoot, steadystate_error=ess)
+
+
+def get_evaluator(num, den, tau=None, lead=False):
+    """
+    Returns the evaluator for a plant and controller structure, preferring the closed-form path when it applies.
+    """
+    if tau:
+        return DelayLoopShapingEvaluator(num, den, tau, lead=lead)
+    if not lead and is_first_order(num, den):
+        return FirstOrderPIEvaluator(num, den)
+    return LoopShapingEvaluator(num, den, lead=lead)
@@ -0,0 +1,159 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from evaluation.cache import EvaluationCache, get_evaluation_cache
+from evaluation.evaluator import DesignEvaluation, get_evaluator
+
+EXECUTOR_MODES = ("inline", "thread", "process")
+MAX_WORKER_EVALUATORS = 256
+
+# evaluators built inside a pool worker, keyed by plant and controller structure
+_worker_evaluators = {}
+
+
+def _warm_worker():
+    # pre-import the numeric stack so the first evaluation in a fresh worker pays no import cost
+    import control  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import scipy.linalg  # noqa: F401
+
+
+def _ping():
+    return os.getpid()
+
+
+def _worker_evaluator(num, den, tau, lead):
+    key = (tuple(num), tuple(den), tau, lead)
+    evaluator = _worker_evaluators.get(key)
+    if evaluator is None:
+        if len(_worker_evaluators) >= MAX_WORKER_EVALUATORS:
+            _worker_evaluators.clear()
+        evaluator = _worker_evaluators[key] = get_evaluator(num, den, tau=tau, lead=lead)
+    return evaluator
+
+
+def evaluate_design(num, den, tau, lead, omega_L, beta_b, beta_l="NA") -> DesignEvaluation:
+    """
+    Picklable entry point for pool workers; reuses the worker's evaluator for a plant across rounds.
+    """
+    return _worker_evaluator(num, den, tau, lead).evaluate(omega_L, beta_b, beta_l)
+
+
+def evaluate_design_batch(num, den, tau, lead, omega_L, beta_b):
+    # batch counterpart of evaluate_design
+    return _worker_evaluator(num, den, tau, lead).evaluate_batch(omega_L, beta_b)
+
+
+class EvaluationExecutor:
+    """
+    Runs control-system evaluations inline, in a thread pool, or in a pool of warm worker processes.
+    Repeated designs are answered from the evaluation cache before anything is dispatched.
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: int = None, cache: EvaluationCache = None):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError("Unknown evaluation executor mode {}, expected one of {}".format(mode, EXECUTOR_MODES))
+        self.mode = mode
+        self.cache = cache
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool = None
+        if mode == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="evaluation")
+        elif mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_warm_worker)
+            # start every worker now instead of on the first design round
+            for _ in range(self.max_workers):
+                self._pool.submit(_ping)
+
+    async def run(self, fn, *args):
+        if self._pool is None:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(fn, *args))
+
+    async def evaluate(self, evaluator, omega_L, beta_b, beta_l="NA") -> DesignEvaluation:
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(evaluator, omega_L, beta_b, beta_l)
+            evaluation = self.cache.get(key)
+            if evaluation is not None:
+                return evaluation
+
+        if self.mode == "process":
+            # evaluators are rebuilt (and cached) in the workers from the plant description
+            evaluation = await self.run(evaluate_design, evaluator.num, evaluator.den, evaluator.tau,
+                                        evaluator.lead, omega_L, beta_b, beta_l)
+        else:
+            evaluation = await self.run(evaluator.evaluate, omega_L, beta_b, beta_l)
+
+        if key is not None:
+            self.cache.put(key, evaluation)
+        return evaluation
+
+    async def evaluate_many(self, evaluator, candidates):
+        """
+        Evaluates several (omega_L, beta_b) designs for one plant. Evaluators with an evaluate_batch method get
+        every uncached design in a single dispatch, the others evaluate the designs concurrently.
+        :return: One DesignEvaluation per candidate, in order.
+        """
+        if len(candidates) < 2 or not hasattr(evaluator, 'evaluate_batch'):
+            return list(await asyncio.gather(*(self.evaluate(evaluator, omega_L, beta_b)
+                                               for omega_L, beta_b in candidates)))
+
+        keys = [None] * len(candidates)
+        evaluations = [None] * len(candidates)
+        if self.cache is not None:
+            for i, (omega_L, beta_b) in enumerate(candidates):
+                keys[i] = self.cache.key(evaluator, omega_L, beta_b)
+                evaluations[i] = self.cache.get(keys[i])
+        missing = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+        if not missing:
+            return evaluations
+
+        omega_L = [candidates[i][0] for i in missing]
+        beta_b = [candidates[i][1] for i in missing]
+        if self.mode == "process":
+            evaluated = await self.run(evaluate_design_batch, evaluator.num, evaluator.den, evaluator.tau,
+                                       evaluator.lead, omega_L, beta_b)
+        else:
+            evaluated = await self.run(evaluator.evaluate_batch, omega_L, beta_b)
+
+        for i, evaluation in zip(missing, evaluated):
+            evaluations[i] = evaluation
+            if keys[i] is not None:
+                self.cache.put(keys[i], evaluation)
+        return evaluations
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_default_executor = None
+
+
+def get_executor() -> EvaluationExecutor:
+    """
+    Process-wide executor configured by EVAL_EXECUTOR (inline, thread or process) and EVAL_WORKERS,
+    sharing the process-wide evaluation cache.
+    """
+    global _default_executor
+    if _default_executor is None:
+        workers = os.getenv("EVAL_WORKERS")
+        _default_executor = EvaluationExecutor(mode=os.getenv("EVAL_EXECUTOR", "thread"),
+                                               max_workers=int(workers) if workers else None,
+                                               cache=get_evaluation_cache())
+    return _default_executor
+
+
+def shutdown_executor():
+    global _default_executor
+    if _default_executor is not None:
+        _default_executor.shutdown()
+        _default_executor = None
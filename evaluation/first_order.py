@@ -0,0 +1,203 @@
+import cmath
+import math
+
+import numpy as np
+
+# same thresholds as util.check_stability and ctrl.step_info
+STABILITY_MARGIN = 0.01
+SETTLING_TIME_THRESHOLD = 0.02
+RISE_TIME_LIMITS = (0.1, 0.9)
+
+
+def is_first_order(num, den):
+    """
+    True for plants of the form K/(s+a), which the PI loop turns into a second-order closed loop.
+    """
+    num = _trimmed(num)
+    den = _trimmed(den)
+    return len(num) == 1 and len(den) == 2 and num[0] != 0
+
+
+def _trimmed(coeffs):
+    # coefficients as floats without leading zeros
+    coeffs = [float(c) for c in np.atleast_1d(coeffs)]
+    while coeffs and coeffs[0] == 0:
+        coeffs.pop(0)
+    return coeffs
+
+
+class FirstOrderPILoop:
+    """
+    L(s) = k (beta_b s + omega_L) / (s (s + a)) for the plant G(s) = K/(s+a) and the PI controller of
+    util.loop_shaping, so the closed loop T(s) = k (beta_b s + omega_L) / (s^2 + (a + k beta_b) s + k omega_L).
+    """
+
+    def __init__(self, omega_L, beta_b, num, den):
+        num = _trimmed(num)
+        den = _trimmed(den)
+        K = num[0] / den[0]
+        self.a = a = den[1] / den[0]
+        self.omega_L = omega_L = float(omega_L)
+        self.beta_b = beta_b = float(beta_b)
+        # K_p = 1/|G(j omega_L)|
+        K_p = math.hypot(omega_L, a) / abs(K)
+        self.k = k = K * K_p / math.sqrt(beta_b * beta_b + 1)
+
+        c1 = a + k * beta_b
+        c0 = k * omega_L
+        disc = cmath.sqrt(c1 * c1 - 4 * c0)
+        self.poles = ((-c1 + disc) / 2, (-c1 - disc) / 2)
+        self.repeated = abs(disc) <= 1e-9 * max(abs(c1), 1.0)
+        self.final = 1.0 if c0 != 0 else 0.0
+
+        p1, p2 = self.poles
+        if self.repeated:
+            # T(s)/s = 1/s + R1/(s-p) + R2/(s-p)^2
+            p = (p1 + p2) / 2
+            self.poles = (p, p)
+            self.R2 = k * (beta_b * p + omega_L) / p
+            self.R1 = -k * omega_L / (p * p)
+        else:
+            self.residues = tuple(k * (beta_b * pi + omega_L) / (pi * (pi - pj))
+                                  for pi, pj in ((p1, p2), (p2, p1)))
+
+    def is_stable(self):
+        return all(p.real < -STABILITY_MARGIN for p in self.poles)
+
+    def loop_response(self, w):
+        s = 1j * w
+        return self.k * (self.beta_b * s + self.omega_L) / (s * (s + self.a))
+
+    def phase_margin(self):
+        # |L(jw)| is strictly decreasing for this loop and K_p puts |L(j omega_L)| = 1
+        L = self.loop_response(self.omega_L)
+        return math.degrees(cmath.phase(L)) % 360. - 180.
+
+    def gain_margin(self):
+        # Im L(jw) = 0 for w > 0 only at beta_b w^2 = -a omega_L
+        if self.beta_b <= 0 or self.a * self.omega_L >= 0:
+            return math.inf
+        L = self.loop_response(math.sqrt(-self.a * self.omega_L / self.beta_b))
+        return 1 / abs(L) if L.real <= 0 else math.inf
+
+    def steady_state_error(self):
+        return 0.0 if self.k * self.omega_L != 0 else 1.0
+
+    def _error_at(self, t):
+        # scalar version of error() for the root finders
+        if self.repeated:
+            p = self.poles[0]
+            return ((self.R1 + self.R2 * t) * cmath.exp(p * t)).real
+        (p1, p2), (r1, r2) = self.poles, self.residues
+        return (r1 * cmath.exp(p1 * t) + r2 * cmath.exp(p2 * t)).real
+
+    def _envelope(self, t):
+        if self.repeated:
+            return (abs(self.R1) + abs(self.R2) * t) * math.exp(self.poles[0].real * t)
+        return sum(abs(r) * math.exp(p.real * t) for p, r in zip(self.poles, self.residues))
+
+    def _stationary_times(self, t_upper):
+        # stationary points of y(t) in (0, t_upper), i.e. roots of sum_i r_i p_i exp(p_i t), in increasing order
+        p1, p2 = self.poles
+        if self.repeated:
+            if self.R2 == 0:
+                return []
+            t = (-(self.R1 * p1 + self.R2) / (self.R2 * p1)).real
+            return [t] if 0 < t < t_upper else []
+        r1, r2 = self.residues
+        if p1.imag == 0:
+            ratio = -(r2 * p2) / (r1 * p1)
+            if ratio.real <= 0 or p1 == p2:
+                return []
+            t = math.log(ratio.real) / (p1 - p2).real
+            return [t] if 0 < t < t_upper else []
+        # 2 |r p| exp(sigma t) cos(omega t + phi) vanishes every half period
+        omega = abs(p1.imag)
+        rp = r1 * p1 if p1.imag > 0 else r2 * p2
+        phi = cmath.phase(rp)
+        first = (math.pi / 2 - phi) / omega
+        first -= math.floor(first * omega / math.pi) * math.pi / omega
+        if first == 0:
+            first = math.pi / omega
+        return [first + i * math.pi / omega for i in range(int(math.ceil((t_upper - first) * omega / math.pi)))]
+
+    def step_metrics(self):
+        final = self.final
+        sigma = max(p.real for p in self.poles)
+        tol = SETTLING_TIME_THRESHOLD * abs(final)
+        if sigma >= 0 or final == 0:
+            return math.nan, math.nan, math.nan
+
+        # horizon past which the envelope of the error stays inside the settling band
+        t_upper = 1 / abs(sigma)
+        while self._envelope(t_upper) >= tol:
+            t_upper *= 2
+        # y(t) is monotonic between consecutive stationary points, so each crossing has an exact bracket
+        knots = [0.0] + self._stationary_times(t_upper) + [t_upper]
+        errors = [self._error_at(t) for t in knots]
+
+        def first_crossing(level):
+            # first time y = final + error reaches level
+            for i in range(len(knots) - 1):
+                if final + errors[i + 1] >= level:
+                    if final + errors[i] >= level:
+                        return knots[i]
+                    return illinois(lambda x: final + self._error_at(x) - level, knots[i], knots[i + 1])
+            return math.nan
+
+        rise_time = (first_crossing(RISE_TIME_LIMITS[1] * final) - first_crossing(RISE_TIME_LIMITS[0] * final))
+
+        # last exit from the settling band: after the last extremum outside it, |error| stays below tol
+        settling_time = 0.0
+        for i in range(len(knots) - 2, -1, -1):
+            if abs(errors[i]) >= tol:
+                level = math.copysign(tol, errors[i])
+                settling_time = illinois(lambda x: self._error_at(x) - level, knots[i], knots[i + 1])
+                break
+
+        peak = final + max(errors)
+        overshoot = max(0.0, 100. * (peak - final) / final)
+        return rise_time, settling_time, overshoot
+
+
+def illinois(f, lo, hi, xtol=1e-12, max_iter=60):
+    # regula falsi with the Illinois modification; the bracket is a single grid interval
+    f_lo, f_hi = f(lo), f(hi)
+    side = 0
+    x = lo
+    for _ in range(max_iter):
+        if f_hi == f_lo:
+            break
+        x_prev, x = x, (lo * f_hi - hi * f_lo) / (f_hi - f_lo)
+        fx = f(x)
+        if fx == 0 or abs(x - x_prev) <= xtol * max(abs(x), 1.0):
+            break
+        if (fx > 0) == (f_hi > 0):
+            hi, f_hi = x, fx
+            if side == 1:
+                f_lo /= 2
+            side = 1
+        else:
+            lo, f_lo = x, fx
+            if side == -1:
+                f_hi /= 2
+            side = -1
+    return x
+
+
+def first_order_check_stability(omega_L, beta_b, num, den):
+    """
+    Closed-form equivalent of util.check_stability for first-order plants.
+    """
+    return FirstOrderPILoop(omega_L, beta_b, num, den).is_stable()
+
+
+def first_order_loop_shaping(omega_L, beta_b, num, den):
+    """
+    Closed-form equivalent of util.loop_shaping for first-order plants.
+    :return: (gain margin, phase margin, rise time, settling time, overshoot, steady-state error)
+    """
+    loop = FirstOrderPILoop(omega_L, beta_b, num, den)
+    rise_time, settling_time, overshoot = loop.step_metrics()
+    return (loop.gain_margin(), loop.phase_margin(), rise_time, settling_time, overshoot,
+            loop.steady_state_error())
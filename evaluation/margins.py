@@ -0,0 +1,280 @@
+import cmath
+import logging
+import math
+import os
+
+import numpy as np
+
+from evaluation.first_order import illinois
+from evaluation.stability import batch_roots
+
+MARGIN_GRID_POINTS = 400
+# grid span in decades beyond the slowest and fastest corner frequencies of the loop
+GRID_DECADES = 3
+MAX_REFINE_STEPS = 60
+REFINE_TOLERANCE = 1e-13
+# half-width (as a frequency ratio) of the bracket tried around the design crossover omega_L
+HINT_BRACKET = 1.5
+VALIDATION_TOLERANCE = 1e-4
+
+
+def loop_frequency_response(num_L, den_L, w, tau=None):
+    """
+    L(jw) for every loop, one per row of num_L and den_L (a 1-D array is shared by all loops).
+    :param w: Frequencies, either shared (1-D) or one row per loop.
+    :param tau: Optional loop delay; L(jw) is multiplied by the exact factor exp(-jw tau).
+    :return: Array with one row per loop.
+    """
+    w = np.atleast_2d(np.asarray(w, dtype=float))
+    L = _polyval_rows(num_L, 1j * w) / _polyval_rows(den_L, 1j * w)
+    return L * np.exp(-1j * w * tau) if tau else L
+
+
+def margins_batch(num_L, den_L, omega_hint=None, tau=None):
+    """
+    Gain and phase margins of many loops L = num_L/den_L at once, with ctrl.margin's choice among several
+    crossovers: the phase margin with the smallest |PM| and the gain margin closest to 1.
+    Crossovers are bracketed on a log grid spanning the loop's corner frequencies (and a narrow bracket around
+    omega_hint, the intended gain crossover) and then refined by regula falsi.
+    A loop delay tau enters through the exact factor exp(-jw tau) rather than a Pade approximation.
+    :return: Dictionary of arrays 'gain_margin', 'phase_margin', 'phase_crossover' (frequency of the gain margin)
+             and 'gain_crossover' (frequency of the phase margin). Margins without a crossover are inf and their
+             frequencies NaN, as in ctrl.margin.
+    """
+    num_L = np.atleast_2d(np.asarray(num_L, dtype=float))
+    den_L = np.atleast_2d(np.asarray(den_L, dtype=float))
+    batch = max(num_L.shape[0], den_L.shape[0])
+    omega_hint = None if omega_hint is None else np.broadcast_to(np.asarray(omega_hint, dtype=float), (batch,))
+    log_w = _log_grid(num_L, den_L, batch, omega_hint, tau)
+
+    def response(rows, lw):
+        s = 1j * np.exp(lw)
+        L = _polyval_rows(num_L, s, rows) / _polyval_rows(den_L, s, rows)
+        return L * np.exp(-s * tau) if tau else L
+
+    def log_mag(rows, lw):
+        return np.log(np.abs(response(rows, lw)))
+
+    def phase_distance(rows, lw):
+        # sin of the angle of L; vanishes on the real axis
+        L = response(rows, lw)
+        return L.imag / np.abs(L)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _margins(response, log_mag, phase_distance, log_w, batch, omega_hint)
+
+
+def _margins(response, log_mag, phase_distance, log_w, batch, omega_hint):
+    rows = np.arange(batch)
+    L = response(rows, log_w)
+    mag_sign = np.sign(np.log(np.abs(L)))
+    phase_sign = np.sign(L.imag / np.abs(L))
+
+    result = {
+        'gain_margin': np.full(batch, np.inf),
+        'phase_margin': np.full(batch, np.inf),
+        'phase_crossover': np.full(batch, np.nan),
+        'gain_crossover': np.full(batch, np.nan),
+    }
+
+    # gain crossovers |L| = 1 -> phase margin
+    b_idx, lo, hi = _brackets(mag_sign, log_w)
+    crossing = _refine(log_mag, b_idx, lo, hi)
+    if omega_hint is not None:
+        # the controllers are designed for |L(j omega_L)| = 1, so omega_L is usually a crossover itself
+        log_hint = np.log(omega_hint)
+        exact = np.abs(log_mag(rows, log_hint)) < 1e-9
+        hint_lo, hint_hi = log_hint - np.log(HINT_BRACKET), log_hint + np.log(HINT_BRACKET)
+        near = ~exact & (np.sign(log_mag(rows, hint_lo)) * np.sign(log_mag(rows, hint_hi)) < 0)
+        b_idx = np.concatenate([b_idx, rows[exact], rows[near]])
+        crossing = np.concatenate([crossing, log_hint[exact],
+                                   _refine(log_mag, rows[near], hint_lo[near], hint_hi[near])])
+    if len(b_idx):
+        pm = np.remainder(np.angle(response(b_idx, crossing), deg=True), 360.) - 180.
+        pick = _pick(b_idx, np.abs(pm))
+        result['phase_margin'][b_idx[pick]] = pm[pick]
+        result['gain_crossover'][b_idx[pick]] = np.exp(crossing[pick])
+
+    # phase crossovers on the negative real axis -> gain margin
+    b_idx, lo, hi = _brackets(phase_sign, log_w)
+    if len(b_idx):
+        crossing = _refine(phase_distance, b_idx, lo, hi)
+        L_cross = response(b_idx, crossing)
+        negative = L_cross.real < 0
+        b_idx, crossing, L_cross = b_idx[negative], crossing[negative], L_cross[negative]
+        gm = 1. / np.abs(L_cross)
+        pick = _pick(b_idx, np.abs(np.log(gm)))
+        result['gain_margin'][b_idx[pick]] = gm[pick]
+        result['phase_crossover'][b_idx[pick]] = np.exp(crossing[pick])
+    return result
+
+
+def margins(num_L, den_L, omega_hint=None, tau=None, validate=None):
+    """
+    Single-loop margins in the order of ctrl.margin: (gain margin, phase margin, phase crossover frequency,
+    gain crossover frequency). Same algorithm as margins_batch, with the crossovers refined in plain Python,
+    which beats numpy for a handful of brackets.
+    :param validate: Also run ctrl.margin and log any disagreement; defaults to the MARGIN_VALIDATE env variable.
+                     Loops with a delay are not validated since ctrl.margin only sees rational loops.
+    """
+    num = [float(c) for c in np.ravel(num_L)]
+    den = [float(c) for c in np.ravel(den_L)]
+    hint = None if omega_hint is None else np.array([float(omega_hint)])
+    log_w = _log_grid(np.atleast_2d(num), np.atleast_2d(den), 1, hint, tau)[0]
+
+    def response(lw):
+        s = 1j * math.exp(lw)
+        n = d = 0j
+        for c in num:
+            n = n * s + c
+        for c in den:
+            d = d * s + c
+        return n / d * cmath.exp(-s * tau) if tau else n / d
+
+    def log_mag(lw):
+        return math.log(abs(response(lw)))
+
+    def phase_distance(lw):
+        L = response(lw)
+        return L.imag / abs(L)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        L = loop_frequency_response(num, den, np.exp(log_w), tau)[0]
+        mag_sign = np.sign(np.log(np.abs(L)))
+        phase_sign = np.sign(L.imag / np.abs(L))
+
+    crossings = [illinois(log_mag, log_w[i], log_w[i + 1])
+                 for i in np.flatnonzero(mag_sign[:-1] * mag_sign[1:] < 0)]
+    if omega_hint is not None:
+        log_hint = math.log(omega_hint)
+        lo, hi = log_hint - math.log(HINT_BRACKET), log_hint + math.log(HINT_BRACKET)
+        if abs(log_mag(log_hint)) < 1e-9:
+            crossings.append(log_hint)
+        elif log_mag(lo) * log_mag(hi) < 0:
+            crossings.append(illinois(log_mag, lo, hi))
+    pm, wp = math.inf, math.nan
+    for lw in crossings:
+        candidate = math.degrees(cmath.phase(response(lw))) % 360. - 180.
+        if abs(candidate) < abs(pm):
+            pm, wp = candidate, math.exp(lw)
+
+    gm, wg = math.inf, math.nan
+    cells = np.flatnonzero((phase_sign[:-1] * phase_sign[1:] < 0) & ((L.real[:-1] < 0) | (L.real[1:] < 0)))
+    if len(cells):
+        # a delay adds a phase crossover every 2 pi / tau; only brackets whose gain margin estimate from the grid
+        # is close to the best one can be the crossover closest to |L| = 1
+        with np.errstate(divide='ignore'):
+            score = np.minimum(np.abs(np.log(np.abs(L[cells]))), np.abs(np.log(np.abs(L[cells + 1]))))
+        cells = cells[score <= score.min() + math.log(2)]
+    for i in cells:
+        lw = illinois(phase_distance, log_w[i], log_w[i + 1])
+        L_cross = response(lw)
+        if L_cross.real < 0 and L_cross != 0:
+            candidate = 1. / abs(L_cross)
+            if math.isinf(gm) or abs(math.log(candidate)) < abs(math.log(gm)):
+                gm, wg = candidate, math.exp(lw)
+
+    if validate is None:
+        validate = os.getenv("MARGIN_VALIDATE", "0") == "1"
+    if validate and not tau:
+        validate_margins(num, den, (gm, pm, wg, wp))
+    return gm, pm, wg, wp
+
+
+def validate_margins(num_L, den_L, computed):
+    """
+    Compares margins computed here against ctrl.margin and logs a warning on disagreement.
+    :return: True if all four values agree within VALIDATION_TOLERANCE (relative).
+    """
+    import control as ctrl
+
+    reference = ctrl.margin(ctrl.TransferFunction(np.ravel(num_L), np.ravel(den_L)))
+    agree = all(_close(a, b) for a, b in zip(computed, reference))
+    if not agree:
+        logging.warning("Margin mismatch for L = %s / %s: computed %s, ctrl.margin %s",
+                        list(np.ravel(num_L)), list(np.ravel(den_L)), computed, reference)
+    return agree
+
+
+def _close(a, b):
+    if np.isnan(a) or np.isnan(b) or np.isinf(a) or np.isinf(b):
+        return (np.isnan(a) and np.isnan(b)) or a == b
+    return abs(a - b) <= VALIDATION_TOLERANCE * max(1.0, abs(b))
+
+
+def _log_grid(num_L, den_L, batch, omega_hint, tau=None):
+    # log-spaced grid per loop from GRID_DECADES below the slowest to GRID_DECADES above the fastest corner,
+    # counting 1/tau as a corner of the delay
+    lo, hi = np.full(batch, np.inf), np.zeros(batch)
+    for coeffs in (num_L, den_L):
+        corners = np.abs(batch_roots(coeffs))
+        corners = np.where(np.isfinite(corners) & (corners > 1e-12), corners, np.nan)
+        with np.errstate(invalid='ignore'):
+            lo = np.fmin(lo, np.nanmin(np.where(np.isnan(corners), np.inf, corners), axis=1))
+            hi = np.fmax(hi, np.nanmax(np.where(np.isnan(corners), 0.0, corners), axis=1))
+    if omega_hint is not None:
+        lo, hi = np.fmin(lo, omega_hint), np.fmax(hi, omega_hint)
+    if tau:
+        lo, hi = np.fmin(lo, 1 / tau), np.fmax(hi, 1 / tau)
+    lo = np.where(np.isfinite(lo), lo, 1.0)
+    hi = np.where(hi > 0, hi, 1.0)
+    lo, hi = np.log(lo) - GRID_DECADES * np.log(10), np.log(hi) + GRID_DECADES * np.log(10)
+    return lo[:, None] + (hi - lo)[:, None] * np.linspace(0, 1, MARGIN_GRID_POINTS)[None, :]
+
+
+def _brackets(sign, log_w):
+    b_idx, w_idx = np.nonzero(sign[:, :-1] * sign[:, 1:] < 0)
+    return b_idx, log_w[b_idx, w_idx], log_w[b_idx, w_idx + 1]
+
+
+def _refine(fn, b_idx, lo, hi):
+    # Illinois regula falsi on every bracket at once, stopping when all iterates have converged
+    f_lo, f_hi = fn(b_idx, lo), fn(b_idx, hi)
+    x = 0.5 * (lo + hi)
+    last_side = np.zeros(len(lo))
+    for _ in range(MAX_REFINE_STEPS):
+        if len(x) == 0:
+            break
+        denominator = f_hi - f_lo
+        x_new = np.where(denominator != 0, (lo * f_hi - hi * f_lo) / np.where(denominator != 0, denominator, 1.0),
+                         0.5 * (lo + hi))
+        x_new = np.where(np.isfinite(x_new), x_new, 0.5 * (lo + hi))
+        f_new = fn(b_idx, x_new)
+        left = np.sign(f_new) == np.sign(f_lo)
+        # the endpoint kept twice in a row gets its value halved
+        f_hi = np.where(left & (last_side == 1), 0.5 * f_hi, f_hi)
+        f_lo = np.where(~left & (last_side == -1), 0.5 * f_lo, f_lo)
+        lo, f_lo = np.where(left, x_new, lo), np.where(left, f_new, f_lo)
+        hi, f_hi = np.where(left, hi, x_new), np.where(left, f_hi, f_new)
+        last_side = np.where(left, 1, -1)
+        done = np.max(np.abs(x_new - x)) < REFINE_TOLERANCE
+        x = x_new
+        if done:
+            break
+    return x
+
+
+def _pick(b_idx, score):
+    # index of the lowest score for every loop
+    order = np.lexsort((score, b_idx))
+    first = np.unique(b_idx[order], return_index=True)[1]
+    return order[first]
+
+
+def _polyval_rows(coeffs, x, rows=None):
+    # Horner evaluation of coeffs[rows[i]] at x[i] (x may carry a trailing frequency dimension);
+    # a single row of coefficients is shared by every loop
+    coeffs = np.atleast_2d(np.asarray(coeffs))
+    x = np.asarray(x)
+    if coeffs.shape[0] == 1:
+        result = np.zeros(x.shape, dtype=complex)
+        for c in coeffs[0]:
+            result = result * x + c
+        return result
+    if rows is not None:
+        coeffs = coeffs[rows]
+    shape = coeffs.shape[:1] + (1,) * (x.ndim - 1)
+    result = np.zeros(np.broadcast_shapes(x.shape, shape), dtype=complex)
+    for k in range(coeffs.shape[1]):
+        result = result * x + coeffs[:, k].reshape(shape)
+    return result
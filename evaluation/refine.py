@@ -0,0 +1,55 @@
+import math
+
+import numpy as np
+from scipy.optimize import minimize
+
+from util import threshold_violation
+
+UNSTABLE_PENALTY = 1e6
+# largest factor by which the refinement may move omega_L or beta_b away from the LLM proposal
+MAX_SCALE = 4.0
+MIN_BETA_B = 1e-3
+
+
+class _Found(Exception):
+    def __init__(self, parameters, evaluation):
+        super().__init__()
+        self.parameters = parameters
+        self.evaluation = evaluation
+
+
+def refine_design(evaluator, omega_L, beta_b, thresholds, max_evaluations=60):
+    """
+    Bounded Nelder-Mead search around an LLM proposal for a design that meets the thresholds.
+    The search runs on log(omega_L), log(beta_b) inside a box of +-log(MAX_SCALE) and stops at the first
+    passing design.
+    :return: ((omega_L, beta_b), DesignEvaluation) of a passing design, or None if none was found.
+    """
+    if omega_L <= 0:
+        return None
+    start = np.log([omega_L, max(beta_b, MIN_BETA_B)])
+    radius = math.log(MAX_SCALE)
+
+    def objective(x):
+        x = np.clip(x, start - radius, start + radius)
+        candidate = (float(np.exp(x[0])), float(np.exp(x[1])))
+        evaluation = evaluator.evaluate(*candidate)
+        if not evaluation.is_stable:
+            return UNSTABLE_PENALTY
+        violation = threshold_violation(evaluation.performance(), thresholds)
+        if violation == 0:
+            raise _Found(candidate, evaluation)
+        return min(violation, UNSTABLE_PENALTY / 2)
+
+    try:
+        minimize(objective, start, method='Nelder-Mead',
+                 options={'maxfev': max_evaluations, 'initial_simplex': _initial_simplex(start)})
+    except _Found as found:
+        return found.parameters, found.evaluation
+    return None
+
+
+def _initial_simplex(start):
+    # steps of about 30% in each parameter, large enough to leave a flat region of the objective
+    step = math.log(1.3)
+    return np.array([start, start + [step, 0.0], start + [0.0, step]])
@@ -0,0 +1,135 @@
+import numpy as np
+
+# closed-loop poles must satisfy Re(p) < -STABILITY_MARGIN, as in util.check_stability
+STABILITY_MARGIN = 0.01
+
+
+def characteristic_polynomial(num_L, den_L):
+    """
+    den_L + num_L, the closed-loop characteristic polynomial of the unity feedback loop L = num_L/den_L.
+    Either argument may be a batch with one row per loop; coefficients are aligned on the constant term.
+    """
+    num_L, den_L = np.atleast_2d(np.asarray(num_L, dtype=float)), np.atleast_2d(np.asarray(den_L, dtype=float))
+    width = max(num_L.shape[1], den_L.shape[1])
+    num_L = np.pad(num_L, ((0, 0), (width - num_L.shape[1], 0)))
+    den_L = np.pad(den_L, ((0, 0), (width - den_L.shape[1], 0)))
+    return den_L + num_L
+
+
+def shift_polynomial(coeffs, shift):
+    """
+    Coefficients of p(s + shift) for every row of coeffs (Taylor shift by repeated synthetic division).
+    """
+    q = np.array(np.atleast_2d(coeffs), dtype=float)
+    degree = q.shape[1] - 1
+    for i in range(degree):
+        for j in range(1, degree - i + 1):
+            q[:, j] += shift * q[:, j - 1]
+    return q
+
+
+def routh_hurwitz_batch(coeffs, margin=STABILITY_MARGIN):
+    """
+    Shifted Routh-Hurwitz test: True for rows whose roots all satisfy Re(p) < -margin.
+    Any zero or sign change in the first column of the Routh array of p(s - margin) means the test fails.
+    """
+    coeffs = np.atleast_2d(np.asarray(coeffs, dtype=float))
+    shifted = shift_polynomial(coeffs, -margin) if margin else coeffs.copy()
+    batch, width = shifted.shape
+    stable = np.ones(batch, dtype=bool)
+
+    # rows with a vanishing leading coefficient fall back to np.roots below
+    scale = np.max(np.abs(shifted), axis=1)
+    scale[scale == 0] = 1.0
+    shifted /= scale[:, None]
+    lead = shifted[:, 0]
+    degenerate = np.abs(lead) <= 1e-12
+    shifted[~degenerate] *= np.sign(lead[~degenerate])[:, None]
+
+    if width == 1:
+        return ~degenerate
+    # every coefficient of a Hurwitz polynomial has the sign of the leading one
+    stable &= np.all(shifted > 0, axis=1)
+
+    upper = shifted[:, 0::2]
+    lower = shifted[:, 1::2]
+    lower = np.pad(lower, ((0, 0), (0, upper.shape[1] - lower.shape[1])))
+    for _ in range(width - 2):
+        pivot = lower[:, 0]
+        ok = pivot > 1e-12 * np.max(np.abs(upper), axis=1)
+        stable &= ok
+        safe = np.where(ok, pivot, 1.0)
+        row = (upper[:, 1:] * pivot[:, None] - lower[:, 1:] * upper[:, :1]) / safe[:, None]
+        row = np.pad(row, ((0, 0), (0, 1)))
+        upper, lower = lower, row
+    stable &= lower[:, 0] > 0
+
+    for i in np.flatnonzero(degenerate):
+        stable[i] = _roots_stable(np.trim_zeros(coeffs[i], 'f'), margin)
+    return stable
+
+
+def is_stable(coeffs, margin=STABILITY_MARGIN):
+    """
+    Single-polynomial version of routh_hurwitz_batch in plain Python, which beats numpy at these sizes.
+    """
+    q = [float(c) for c in np.ravel(coeffs)]
+    while q and q[0] == 0:
+        q.pop(0)
+    if not q:
+        return False
+    degree = len(q) - 1
+    for i in range(degree):
+        for j in range(1, degree - i + 1):
+            q[j] -= margin * q[j - 1]
+
+    sign = 1.0 if q[0] > 0 else -1.0
+    scale = max(abs(c) for c in q)
+    q = [sign * c / scale for c in q]
+    if any(c <= 0 for c in q):
+        return False
+
+    upper, lower = q[0::2], q[1::2]
+    lower += [0.0] * (len(upper) - len(lower))
+    for _ in range(degree - 1):
+        pivot = lower[0]
+        if pivot <= 1e-12 * max(abs(c) for c in upper):
+            return False
+        row = [(upper[k + 1] * pivot - lower[k + 1] * upper[0]) / pivot for k in range(len(upper) - 1)] + [0.0]
+        upper, lower = lower, row
+    return degree == 0 or lower[0] > 0
+
+
+def batch_roots(coeffs):
+    """
+    Roots of every row of a coefficient matrix via batched companion-matrix eigenvalues.
+    Rows whose leading coefficient vanishes are solved one by one with np.roots and padded with NaN.
+    """
+    coeffs = np.atleast_2d(np.asarray(coeffs, dtype=float))
+    batch, width = coeffs.shape
+    degree = width - 1
+    if degree == 0:
+        return np.empty((batch, 0), dtype=complex)
+
+    lead = coeffs[:, 0]
+    regular = np.abs(lead) > 1e-12 * np.max(np.abs(coeffs), axis=1)
+    roots = np.full((batch, degree), np.nan, dtype=complex)
+
+    if np.any(regular):
+        normalized = coeffs[regular, 1:] / lead[regular, None]
+        companion = np.zeros((normalized.shape[0], degree, degree))
+        companion[:, 0, :] = -normalized
+        companion[:, np.arange(1, degree), np.arange(degree - 1)] = 1.0
+        roots[regular] = np.linalg.eigvals(companion)
+    for i in np.flatnonzero(~regular):
+        r = np.roots(coeffs[i])
+        roots[i, :len(r)] = r
+    return roots
+
+
+def _roots_stable(coeffs, margin):
+    if len(coeffs) == 0:
+        # the zero polynomial, as in is_stable
+        return False
+    roots = np.roots(coeffs)
+    return bool(np.all(roots.real < -margin))
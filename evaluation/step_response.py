@@ -0,0 +1,264 @@
+import math
+
+import numpy as np
+from scipy.linalg import expm, matrix_balance, toeplitz
+from scipy.signal import cont2discrete
+
+# same thresholds as ctrl.step_info
+SETTLING_TIME_THRESHOLD = 0.02
+RISE_TIME_LIMITS = (0.1, 0.9)
+
+# horizon: the slowest mode decays by LOG_DECAY, extended up to MAX_EXTENSIONS times while the response has not settled
+LOG_DECAY = math.log(1000)
+MAX_EXTENSIONS = 4
+# sampling: POINTS_PER_CYCLE samples per oscillation period and POINTS_PER_DECAY per time constant of the fastest mode
+POINTS_PER_CYCLE = 50
+POINTS_PER_DECAY = 50
+MIN_POINTS = 200
+MAX_POINTS = 100000
+MAX_BATCH_POINTS = 2 ** 15
+# samples per delay interval in delay-line simulations
+MIN_DELAY_SAMPLES = 20
+MAX_DELAY_SAMPLES = 400
+
+
+def companion_realization(num, den):
+    """
+    Controllable canonical realization of num(s)/den(s), one system per row.
+    :return: (A, B, C, D) with A of shape (batch, n, n), B and C of shape (batch, n) and D of shape (batch,).
+    """
+    num = np.atleast_2d(np.asarray(num, dtype=float))
+    den = np.atleast_2d(np.asarray(den, dtype=float))
+    batch, width = den.shape
+    n = width - 1
+    num = np.pad(num, ((0, 0), (width - num.shape[1], 0)))
+    lead = den[:, :1]
+    num, den = num / lead, den / lead
+
+    D = num[:, 0]
+    A = np.zeros((batch, n, n))
+    A[:, 0, :] = -den[:, 1:]
+    A[:, np.arange(1, n), np.arange(n - 1)] = 1.0
+    B = np.zeros((batch, n))
+    B[:, 0] = 1.0
+    C = num[:, 1:] - D[:, None] * den[:, 1:]
+    return A, B, C, D
+
+
+def step_horizon(poles):
+    """
+    Simulation horizon and sample time from the closed-loop poles of one system, in the spirit of ctrl's
+    default time vector: long enough for the slowest mode to decay, fine enough to resolve the fastest one.
+    """
+    poles = np.asarray(poles)
+    poles = poles[poles.real < 0]
+    if len(poles) == 0:
+        return 5.0, 0.01
+    decay_times = LOG_DECAY / np.abs(poles.real)
+    t_final = decay_times.max()
+    dt = np.min(np.minimum(decay_times / POINTS_PER_DECAY, 2 * np.pi / POINTS_PER_CYCLE / np.abs(poles)))
+    return t_final, dt
+
+
+def simulate_step(A, B, C, D, t_final, num_points):
+    """
+    Unit step response of stable state-space systems on uniform grids 0..t_final, one system per row.
+    The grid is discretized exactly with Ad = expm(A dt), and y_k = y_final + C Ad^k A^{-1} B is evaluated for all k
+    with a doubling scheme, so the cost grows with log(num_points) matrix products.
+    :return: (t, y, y_final) with t and y of shape (batch, num_points).
+    """
+    t_final = np.asarray(t_final, dtype=float)
+    dt = t_final / (num_points - 1)
+    Ad = expm(A * dt[:, None, None])
+    # x_k - x_ss = Ad^k (x_0 - x_ss) with x_0 = 0 and x_ss = -A^{-1} B
+    offset = np.linalg.solve(A, B[:, :, None])[:, :, 0]
+    y_final = D - np.einsum('bn,bn->b', C, offset)
+
+    rows = _power_rows(C, Ad, num_points)
+    y = y_final[:, None] + np.einsum('bkn,bn->bk', rows, offset)
+    t = dt[:, None] * np.arange(num_points)[None, :]
+    return t, y, y_final
+
+
+def step_metrics(num, den):
+    """
+    Rise time, settling time and overshoot of the unit step response of a stable num(s)/den(s), matching the
+    definitions of ctrl.step_info (10-90% rise time, 2% settling band, overshoot in percent).
+    :return: (rise_time, settling_time, overshoot); settling time is NaN if the response never settles.
+    """
+    A, B, C, D = companion_realization(num, den)
+    A, B, C = _balanced(A, B, C)
+    t_final, dt = step_horizon(np.linalg.eigvals(A[0]))
+
+    for _ in range(MAX_EXTENSIONS + 1):
+        num_points = int(min(MAX_POINTS, max(MIN_POINTS, math.ceil(t_final / dt) + 1)))
+        t, y, y_final = simulate_step(A, B, C, D, [t_final], num_points)
+        rise, settling, overshoot = step_info_from_samples(t, y, y_final)
+        if not np.isnan(settling[0]):
+            break
+        t_final *= 4
+    return float(rise[0]), float(settling[0]), float(overshoot[0])
+
+
+def step_metrics_batch(num, den):
+    """
+    step_metrics for many stable systems of the same order at once, one per row of num and den.
+    Each row gets its own horizon and sample time.
+    :return: Arrays (rise_time, settling_time, overshoot).
+    """
+    A, B, C, D = companion_realization(num, den)
+    A, B, C = _balanced(A, B, C)
+    horizons = np.array([step_horizon(p) for p in np.linalg.eigvals(A)])
+    t_final, dt = horizons[:, 0], horizons[:, 1]
+
+    batch = len(D)
+    rise, settling, overshoot = np.full(batch, np.nan), np.full(batch, np.nan), np.full(batch, np.nan)
+    pending = np.arange(batch)
+    for _ in range(MAX_EXTENSIONS + 1):
+        # rows are simulated in groups needing about the same number of samples (next power of two)
+        needed = np.clip(np.ceil(t_final[pending] / dt[pending]) + 1, MIN_POINTS, MAX_BATCH_POINTS)
+        groups = np.ceil(np.log2(needed)).astype(int)
+        for group in np.unique(groups):
+            idx = pending[groups == group]
+            t, y, y_final = simulate_step(A[idx], B[idx], C[idx], D[idx], t_final[idx],
+                                          int(min(MAX_BATCH_POINTS, 2 ** group)))
+            rise[idx], settling[idx], overshoot[idx] = step_info_from_samples(t, y, y_final)
+        pending = pending[np.isnan(settling[pending])]
+        if len(pending) == 0:
+            break
+        t_final[pending] *= 4
+    return rise, settling, overshoot
+
+
+def delayed_step_metrics(num_L, den_L, tau, poles):
+    """
+    Step metrics of the unity feedback loop around L(s) exp(-tau s), with L = num_L/den_L rational.
+    L is discretized with a first-order hold on a grid whose step divides tau, and the delay is an exact shift
+    by tau/dt samples: each block of tau/dt output samples is driven by the error of the previous block, so the
+    simulation advances one block (one affine map) at a time.
+    :param poles: Approximate closed-loop poles (e.g. with a Pade model of the delay) that set the horizon and the
+                  sample time.
+    :return: (rise_time, settling_time, overshoot) as in step_metrics.
+    """
+    num_L = np.trim_zeros(np.asarray(num_L, dtype=float), 'f')
+    den_L = np.trim_zeros(np.asarray(den_L, dtype=float), 'f')
+    # closed-loop DC gain; an integrator in L drives it to 1
+    final = 1.0 if den_L[-1] == 0 else num_L[-1] / (num_L[-1] + den_L[-1])
+    t_final, dt = step_horizon(poles)
+    dt = min(max(dt, tau / MAX_DELAY_SAMPLES), tau / MIN_DELAY_SAMPLES)
+
+    for _ in range(MAX_EXTENSIONS + 1):
+        num_points = int(min(MAX_POINTS, max(MIN_POINTS, math.ceil(t_final / dt) + 1)))
+        delay_samples = max(1, round(tau * (num_points - 1) / t_final))
+        step = tau / delay_samples
+        num_points = math.ceil(t_final / step) + 1
+        y = _simulate_delay_loop(num_L, den_L, step, delay_samples, num_points)
+        t = step * np.arange(num_points)
+        rise, settling, overshoot = step_info_from_samples(t, y, final)
+        if not np.isnan(settling[0]):
+            break
+        t_final *= 4
+    return float(rise[0]), float(settling[0]), float(overshoot[0])
+
+
+def _simulate_delay_loop(num_L, den_L, dt, delay_samples, num_points):
+    A, B, C, D = companion_realization(num_L, den_L)
+    A, B, C = _balanced(A, B, C)
+    Ad, Bd, Cd, Dd, _ = cont2discrete((A[0], B[0][:, None], C[0][None, :], D[:, None]), dt, method='foh')
+    Bd, Cd, Dd = Bd[:, 0], Cd[0], Dd[0, 0]
+    n, d = len(Bd), delay_samples
+
+    # a block of d samples driven by the delayed error u: y = free x + toeplitz u, x' = Ad^d x + forced u
+    free = _power_rows(Cd[None, :], Ad[None], d)[0]
+    impulse = free[:d - 1] @ Bd
+    forced = _power_rows(Bd[None, :], Ad.T[None], d)[0][::-1].T
+    response = np.hstack([free, toeplitz(np.r_[Dd, impulse], np.r_[Dd, np.zeros(d - 1)])])
+    # the next block sees u' = 1 - y, so z = (x, u) follows z' = F z + g
+    F = np.vstack([np.hstack([np.linalg.matrix_power(Ad, d), forced]), -response])
+    g = np.r_[np.zeros(n), np.ones(d)]
+
+    blocks = -(-num_points // d)
+    states = np.empty((blocks, n + d))
+    z = np.zeros(n + d)
+    for j in range(blocks):
+        states[j] = z
+        z = F @ z + g
+    return (states @ response.T).ravel()[:num_points]
+
+
+def step_info_from_samples(t, y, final):
+    """
+    Step metrics from sampled responses, one per row. Rise and settling times are interpolated between samples,
+    and the settling time comes from a single reverse scan for the last sample outside the band.
+    """
+    t, y = np.atleast_2d(t), np.atleast_2d(y)
+    final = np.atleast_1d(final)
+    rows = np.arange(len(final))
+    sgn = np.sign(final)[:, None]
+    n = t.shape[1]
+
+    rise_time = (_first_crossing(t, sgn * y, RISE_TIME_LIMITS[1] * np.abs(final))
+                 - _first_crossing(t, sgn * y, RISE_TIME_LIMITS[0] * np.abs(final)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = np.abs(y / final[:, None] - 1)
+    outside = error >= SETTLING_TIME_THRESHOLD
+    last_outside = n - 1 - np.argmax(outside[:, ::-1], axis=1)
+    settling_time = np.where(outside.any(axis=1), np.nan, 0.0)
+    # interpolate where the error enters the band for good; unsettled if it is still outside at the horizon
+    inside = outside.any(axis=1) & (last_outside < n - 1)
+    i, k = rows[inside], last_outside[inside]
+    e0, e1 = error[i, k], error[i, k + 1]
+    fraction = np.clip((e0 - SETTLING_TIME_THRESHOLD) / np.where(e0 > e1, e0 - e1, 1.0), 0.0, 1.0)
+    settling_time[inside] = t[i, k] + fraction * (t[i, k + 1] - t[i, k])
+
+    peak = np.max(sgn * y, axis=1)
+    overshoot = np.maximum(0.0, 100. * (np.abs(peak) - np.abs(final)) / np.abs(final))
+    return rise_time, settling_time, overshoot
+
+
+def settling_time_from_samples(t, y, final=None, tol=SETTLING_TIME_THRESHOLD):
+    """
+    First sample time after which y stays within +-tol of final (default: the last sample), or None if the
+    response is still outside the band at the last sample.
+    """
+    t, y = np.asarray(t), np.asarray(y)
+    final = y[-1] if final is None else final
+    outside = (y < final * (1 - tol)) | (y > final * (1 + tol))
+    if not outside.any():
+        return t[0]
+    settled = len(y) - np.argmax(outside[::-1])
+    return t[settled] if settled < len(y) else None
+
+
+def _power_rows(v, M, count):
+    # v M^k for k = 0..count-1 and every row of the batch, by repeated doubling
+    rows = v[:, None, :]
+    power = M
+    while rows.shape[1] < count:
+        rows = np.concatenate([rows, rows @ power], axis=1)
+        if rows.shape[1] < count:
+            power = power @ power
+    return rows[:, :count]
+
+
+def _first_crossing(t, y, level):
+    # first time each row reaches level, interpolated between the two samples around it
+    above = y >= level[:, None]
+    k = np.argmax(above, axis=1)
+    rows = np.arange(len(k))
+    prev = np.maximum(k - 1, 0)
+    y0, y1 = y[rows, prev], y[rows, k]
+    fraction = np.where((k > 0) & (y1 > y0), (level - y0) / np.where(y1 > y0, y1 - y0, 1.0), 1.0)
+    crossing = t[rows, prev] + fraction * (t[rows, k] - t[rows, prev])
+    return np.where(above.any(axis=1), crossing, np.nan)
+
+
+def _balanced(A, B, C):
+    # diagonal similarity transforms keep companion matrices of badly scaled polynomials well conditioned
+    A, B, C = A.copy(), B.copy(), C.copy()
+    for i in range(len(A)):
+        A[i], (scale, _) = matrix_balance(A[i], permute=False, separate=True)
+        B[i] /= scale
+        C[i] *= scale
+    return A, B, C
@@ -0,0 +1,107 @@
+import os
+
+from llm.usage import estimate_tokens
+from util import FEEDBACK_HEADER, FEEDBACK_QUESTION, design_feedback_block, threshold_violation
+
+
+class FeedbackPromptBuilder:
+    """
+    Incremental design prompt of a sub-agent. Each design is rendered once, when it enters the design memory,
+    instead of re-rendering and re-checking the whole history every round as util.feedback_prompt does.
+    With a window only the latest `window` designs are shown in full. Older ones are compacted into a summary
+    (best design so far and the trend of every metric), or only counted if summarize is off.
+    """
+
+    def __init__(self, instructions, task, response_format, thresholds, window: int = None,
+                 summarize: bool = None):
+        """
+        :param instructions: Static design instructions, identical for every task.
+        :param task: Task requirement of this session.
+        :param response_format: Static response format.
+        :param window: Number of designs shown in full, 0 for all. Defaults to FEEDBACK_WINDOW.
+        :param summarize: Summarize the designs outside the window. Defaults to FEEDBACK_SUMMARY.
+        """
+        self.instructions = instructions
+        self.task = task
+        self.response_format = response_format
+        self.thresholds = thresholds
+        self.window = window if window is not None else int(os.getenv("FEEDBACK_WINDOW", "0"))
+        self.summarize = summarize if summarize is not None else os.getenv("FEEDBACK_SUMMARY", "1") == "1"
+        self.designs = []
+        self.blocks = []
+        # estimated prompt tokens of every built prompt
+        self.token_estimates = []
+        self._history = ""
+        # designs before this index have left the window
+        self._folded = 0
+        self._best = None
+        self._first = {}
+        self._last = {}
+        self._unstable = 0
+
+    def update(self, design_memory):
+        # render the designs added to the memory since the last call
+        for design in design_memory.get_all_designs()[len(self.designs):]:
+            self.add_design(design)
+
+    def add_design(self, design):
+        self.designs.append(design)
+        block = design_feedback_block(len(self.designs), design, self.thresholds)
+        self.blocks.append(block)
+        if not self.window:
+            self._history += block
+            return
+        while len(self.designs) - self._folded > self.window:
+            self._fold(self._folded)
+
+    def build_messages(self):
+        """
+        Design prompt as a system message with the static instructions and response format, byte-identical
+        across rounds and tasks so providers serve it from their prefix cache, then the task and the feedback.
+        """
+        messages = [
+            {"role": "system", "content": self.instructions + self.response_format},
+            {"role": "user", "content": self._task_and_feedback()},
+        ]
+        self.token_estimates.append(sum(estimate_tokens(message['content']) for message in messages))
+        return messages
+
+    def _task_and_feedback(self):
+        if not self.designs:
+            return self.task
+        history = self._history if not self.window else self._summary() + "".join(self.blocks[self._folded:])
+        return self.task + "\n\n" + FEEDBACK_HEADER + history + FEEDBACK_QUESTION
+
+    def _fold(self, index):
+        design = self.designs[index]
+        performance = design['performance']
+        self._folded += 1
+        if "unstable" in performance.values():
+            self._unstable += 1
+            return
+        violation = threshold_violation(performance, self.thresholds)
+        if self._best is None or violation < self._best[0]:
+            self._best = (violation, index + 1, design)
+        for metric, value in performance.items():
+            self._first.setdefault(metric, value)
+            self._last[metric] = value
+
+    def _summary(self):
+        if not self._folded:
+            return ""
+        span = "Design 1" if self._folded == 1 else "Designs 1-{}".format(self._folded)
+        if not self.summarize:
+            return "### {} omitted\n\n".format(span)
+        summary = "### {} (summary)\n".format(span)
+        if self._best is None:
+            return summary + "All of them were unstable.\n\n"
+        _, index, design = self._best
+        parameters = ', '.join(f"{key}={value}" for key, value in design['parameters'].items())
+        performance = ', '.join(f"{key}={value}" for key, value in design['performance'].items())
+        summary += "Best so far: Design {}, Parameters: {}, Performance: {}\n".format(index, parameters, performance)
+        trends = ', '.join("{} from {:.4g} to {:.4g}".format(metric, self._first[metric], self._last[metric])
+                           for metric in self._first)
+        summary += "Trend over the stable designs: {}\n".format(trends)
+        if self._unstable:
+            summary += "{} of them were unstable.\n".format(self._unstable)
+        return summary + "\n"
@@ -176,6 +176,22 @@ Example of expected JSON response format:
 """
 
 
+# parameter first, so a streamed response can be evaluated before the rationale has been written
+response_format_PI_stream = """
+
+## Response Instruction
+Please provide the controller design to the given plant G(s). Your response should strictly adhere to the following JSON format, which includes two keys: 'parameter' and 'design', in this order. The 'parameter' key should ONLY provide a list of numerical values of the chosen parameters [omega_L, beta_b], and the 'design' key can contain design steps and rationale about the parameters choice or the reason to update specific parameter based on the previous design and performance.
+
+Example of expected JSON response format:
+
+{
+    "parameter": [List of Parameters],
+    "design": "[Detailed design steps and rationale behind parameters choice]"
+}
+
+"""
+
+
 response_format_PID = """
 
 ## Response Instruction
@@ -208,6 +224,22 @@ Example of expected JSON response format:
 """
 
 
+response_format_PI_candidates = """
+
+## Response Instruction
+Please provide {num_candidates} candidate controller designs to the given plant G(s), ranked from the most to the least promising. Your response should strictly adhere to the following JSON format, which includes three keys: 'design', 'parameter' and 'candidates'. The 'design' key can contain design steps and rationale about the parameters choice or the reason to update specific parameter based on the previous design and performance, the 'parameter' key should ONLY provide a list of numerical values of your top-ranked parameters [omega_L, beta_b], and the 'candidates' key should ONLY provide a list of {num_candidates} distinct parameter lists [omega_L, beta_b] ordered by rank, starting with the top-ranked one.
+
+Example of expected JSON response format:
+
+{
+    "design": "[Detailed design steps and rationale behind parameters choice]",
+    "parameter": [List of Parameters],
+    "candidates": [[List of Parameters], [List of Parameters], ...]
+}
+
+"""
+
+
 
 
 
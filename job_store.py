@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+# jobs in these states are resumed when their lease runs out
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+
+class JobStore:
+    """
+    Durable design sessions in a sqlite file: the task, the routing decision, a checkpoint of the sub-agent
+    after every round and the published round results. Runs in WAL mode so several workers can share the file;
+    a worker owns a job while its lease is fresh, and any worker may resume a job whose lease has expired.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, specs TEXT NOT NULL, status TEXT NOT NULL, agent_number INTEGER, "
+            "agent_name TEXT, task_requirement TEXT, checkpoint TEXT, final TEXT, owner TEXT, "
+            "lease_expires REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_rounds ("
+            "job_id TEXT NOT NULL, seq INTEGER NOT NULL, result TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)")
+
+    def create(self, specs: dict, owner: str = None, lease: float = 0) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, specs, status, owner, lease_expires, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(specs), JOB_QUEUED, owner, now + lease if owner else 0, now, now))
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, specs, status, agent_number, agent_name, task_requirement, checkpoint, final, owner, "
+                "lease_expires FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'specs', 'status', 'agent_number', 'agent_name', 'task_requirement', 'checkpoint',
+                        'final', 'owner', 'lease_expires'), row))
+        for field in ('specs', 'checkpoint', 'final'):
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def rounds(self, job_id: str, since: int = 0):
+        # published round results as (seq, result) in publication order
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, result FROM job_rounds WHERE job_id = ? AND seq >= ? ORDER BY seq",
+                                      (job_id, since)).fetchall()
+        return [(seq, json.loads(result)) for seq, result in rows]
+
+    def set_routing(self, job_id: str, agent_number: int, agent_name: str, task_requirement: str) -> bool:
+        return self._update(job_id, status=JOB_RUNNING, agent_number=agent_number, agent_name=agent_name,
+                            task_requirement=task_requirement)
+
+    def save_round(self, job_id: str, seq: int, result: dict, checkpoint: dict) -> bool:
+        """
+        Stores a round result together with the sub-agent checkpoint taken after it, atomically.
+        :return: False, storing nothing, when the job has already finished or been cancelled.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET checkpoint = ?, status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                    (json.dumps(checkpoint), JOB_RUNNING, time.time(), job_id, *ACTIVE_STATES))
+                if cursor.rowcount == 1:
+                    self._conn.execute("INSERT OR REPLACE INTO job_rounds VALUES (?, ?, ?)",
+                                       (job_id, seq, json.dumps(result)))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, status: str, final: dict = None) -> bool:
+        """
+        Moves an active job to its final status; a job that already finished keeps the first final status.
+        """
+        return self._update(job_id, status=status, final=json.dumps(final) if final is not None else None,
+                            owner=None, lease_expires=0)
+
+    def claim(self, job_id: str, owner: str, lease: float) -> bool:
+        """
+        Takes over an active job whose lease has expired (or that owner already holds).
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET owner = ?, lease_expires = ?, updated_at = ? WHERE id = ? AND status IN (?, ?) "
+                "AND (lease_expires < ? OR owner = ?)",
+                (owner, now + lease, now, job_id, *ACTIVE_STATES, now, owner))
+        return cursor.rowcount == 1
+
+    def renew(self, owner: str, lease: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status IN (?, ?)",
+                               (now + lease, owner, *ACTIVE_STATES))
+
+    def expired(self):
+        # ids of active jobs nobody holds a lease on
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status IN (?, ?) AND lease_expires < ?",
+                                      (*ACTIVE_STATES, time.time())).fetchall()
+        return [row[0] for row in rows]
+
+    def _update(self, job_id, **fields):
+        # only active jobs change, so a cancelled or finished job is never brought back
+        fields['updated_at'] = time.time()
+        assignments = ", ".join("{} = ?".format(name) for name in fields)
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET {} WHERE id = ? AND status IN (?, ?)".format(assignments),
+                                        (*fields.values(), job_id, *ACTIVE_STATES))
+        return cursor.rowcount == 1
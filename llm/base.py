@@ -1,4 +1,11 @@
+import asyncio
 from abc import ABC
+from typing import AsyncIterator, Dict, List
+
+
+def join_messages(messages: List[Dict[str, str]]) -> str:
+    # single-prompt form of a message list, for models without a chat API
+    return "".join(message['content'] for message in messages)
 
 
 class LLM(ABC):
@@ -6,4 +13,26 @@ class LLM(ABC):
         pass
 
     def complete(self, prompt: str) -> str:
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    async def acomplete(self, prompt: str) -> str:
+        # subclasses without a native async client fall back to a worker thread,
+        # so a slow completion never blocks the event loop
+        return await asyncio.to_thread(self.complete, prompt)
+
+    def complete_messages(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Completion of a chat as a list of {'role', 'content'} messages. Callers put the static instructions
+        first, so that providers with prefix caching see a byte-identical prefix on every call.
+        """
+        return self.complete(join_messages(messages))
+
+    async def acomplete_messages(self, messages: List[Dict[str, str]]) -> str:
+        return await self.acomplete(join_messages(messages))
+
+    async def astream_messages(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """
+        Completion of a chat as text chunks in arrival order. Models without streaming yield the whole
+        completion as one chunk.
+        """
+        yield await self.acomplete_messages(messages)
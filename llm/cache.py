@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from llm.base import LLM
+
+
+class ResponseCache:
+    """
+    Two-tier completion store: an in-memory LRU in front of an optional sqlite file.
+    The sqlite tier runs in WAL mode so several uvicorn workers can share the same file.
+    """
+
+    def __init__(self, path: str = None, max_memory_entries: int = 1024, max_disk_entries: int = 100000,
+                 ttl: float = None):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[str]:
+        """
+        :param count_miss: False for a look-ahead whose miss is followed by a counted lookup of the same key.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT response, created_at FROM completions WHERE key = ?",
+                                         (key,)).fetchone()
+                if row is not None:
+                    response, created_at = row
+                    if not self._expired(created_at, now):
+                        self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+                        self._remember(key, response, created_at)
+                        self.disk_hits += 1
+                        return response
+                    self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, response, now, now))
+                self._evict_disk(now)
+
+    def _remember(self, key, response, created_at):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        if count > self.max_disk_entries:
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY last_access LIMIT ?)", (count - self.max_disk_entries,)
+            )
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+
+class CachedLLM(LLM):
+    """
+    Wraps any LLM and serves repeated completions from a ResponseCache.
+    Keys hash the engine, temperature, max_tokens and prompt (or message list), so a change to any of them is
+    a miss.
+    Concurrent identical requests share a single in-flight completion.
+    """
+
+    def __init__(self, llm: LLM, cache: ResponseCache):
+        super().__init__()
+        self.llm = llm
+        self.cache = cache
+        self._in_flight = {}
+
+    def __getattr__(self, name):
+        # expose engine, temperature, ... of the wrapped model
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def cache_key(self, prompt) -> str:
+        request = {
+            'engine': getattr(self.llm, 'engine', type(self.llm).__name__),
+            'temperature': getattr(self.llm, 'temperature', None),
+            'max_tokens': getattr(self.llm, 'max_tokens', None),
+        }
+        # a list is a chat of role/content messages, see LLM.complete_messages
+        request['messages' if isinstance(prompt, list) else 'prompt'] = prompt
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def complete(self, prompt: str) -> str:
+        return self._complete(prompt, self.llm.complete)
+
+    def complete_messages(self, messages) -> str:
+        return self._complete(messages, self.llm.complete_messages)
+
+    async def acomplete(self, prompt: str) -> str:
+        return await self._acomplete(prompt, self.llm.acomplete)
+
+    async def acomplete_messages(self, messages) -> str:
+        return await self._acomplete(messages, self.llm.acomplete_messages)
+
+    async def astream_messages(self, messages):
+        # a cached completion arrives as one chunk, a fresh one is stored once it has been streamed completely
+        key = self.cache_key(messages)
+        response = await asyncio.to_thread(self.cache.get, key)
+        if response is not None:
+            yield response
+            return
+        chunks = []
+        async for chunk in self.llm.astream_messages(messages):
+            chunks.append(chunk)
+            yield chunk
+        await asyncio.to_thread(self.cache.put, key, "".join(chunks))
+
+    def _complete(self, prompt, complete):
+        key = self.cache_key(prompt)
+        response = self.cache.get(key)
+        if response is None:
+            response = complete(prompt)
+            self.cache.put(key, response)
+        return response
+
+    async def _acomplete(self, prompt, acomplete):
+        key = self.cache_key(prompt)
+        response = await asyncio.to_thread(self.cache.get, key)
+        if response is not None:
+            return response
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+                # the caller we were sharing with was cancelled, issue our own request
+                return await self._acomplete(prompt, acomplete)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await acomplete(prompt)
+            await asyncio.to_thread(self.cache.put, key, response)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # nobody else may be awaiting it; retrieve it so asyncio does not log it as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+
+_shared_cache = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Process-wide cache configured by LLM_CACHE_PATH (sqlite file, or ':memory:' for the LRU tier only),
+    LLM_CACHE_SIZE, LLM_CACHE_DISK_SIZE and LLM_CACHE_TTL (seconds). None when caching is disabled.
+    """
+    global _shared_cache
+    path = os.getenv("LLM_CACHE_PATH")
+    if not path:
+        return None
+    if _shared_cache is None:
+        ttl = os.getenv("LLM_CACHE_TTL")
+        _shared_cache = ResponseCache(
+            path=None if path == ":memory:" else path,
+            max_memory_entries=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+            max_disk_entries=int(os.getenv("LLM_CACHE_DISK_SIZE", "100000")),
+            ttl=float(ttl) if ttl else None,
+        )
+    return _shared_cache
+
+
+def with_cache(llm: LLM) -> LLM:
+    """
+    Wraps llm with the shared response cache when one is configured, otherwise returns it unchanged.
+    """
+    cache = get_response_cache()
+    return CachedLLM(llm, cache) if cache is not None else llm
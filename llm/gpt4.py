@@ -1,9 +1,32 @@
+import asyncio
 import os
 
+import httpx
 import openai
 import time
 import logging
 from llm.base import LLM
+from llm.rate_limit import get_rate_limiter, retry_after_seconds
+from llm.usage import estimate_tokens, record_usage
+
+SYSTEM_MESSAGE = {"role": "system", "content": "You are an expert in control engineering design."}
+
+# one async client (and therefore one connection pool) shared by every GPT4 instance in the process
+_async_client = None
+
+
+def get_async_client() -> openai.AsyncOpenAI:
+    global _async_client
+    if _async_client is None:
+        max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+        _async_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections)
+            ),
+        )
+    return _async_client
 
 
 class GPT4(LLM):
@@ -17,30 +40,129 @@ class GPT4(LLM):
         self.engine = engine
         self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+    def _request_kwargs(self, messages):
+        if self.rstrip:
+            messages = messages[:-1] + [dict(messages[-1], content=messages[-1]['content'].rstrip())]
+        return dict(
+            model=self.engine,
+            response_format={"type": "json_object"},
+            messages=[SYSTEM_MESSAGE] + messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens
+        )
+
+    def _token_budget(self, request):
+        # prompt estimate plus the completion allowance, reserved from the shared token bucket before the call
+        return sum(estimate_tokens(message['content']) for message in request['messages']) + self.max_tokens
+
+    @staticmethod
+    def _record_usage(response):
+        # cached_tokens counts the prompt prefix the API served from its prompt cache
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        record_usage(usage.prompt_tokens, getattr(details, "cached_tokens", None) or 0, usage.completion_tokens)
+        return usage.prompt_tokens + usage.completion_tokens
+
     def complete(self, prompt):
+        return self.complete_messages([{"role": "user", "content": prompt}])
 
-        if self.rstrip:
-            prompt = prompt.rstrip()
+    async def acomplete(self, prompt):
+        return await self.acomplete_messages([{"role": "user", "content": prompt}])
+
+    def complete_messages(self, messages):
+        request = self._request_kwargs(messages)
+        limiter = get_rate_limiter()
+        budget = self._token_budget(request)
         retry_interval_exp = 1
 
         while True:
+            limiter.acquire_blocking(budget)
+            used_tokens, backoff = None, 0
             try:
-                response = self.client.chat.completions.create(
-                    model=self.engine,
-                    response_format={"type": "json_object"},
-                    messages=[
-                        {"role": "system", "content": "You are an expert in control engineering design."},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=self.temperature,
-                    max_tokens=self.max_tokens
-                )
+                raw = self.client.chat.completions.with_raw_response.create(**request)
+                limiter.update_from_headers(raw.headers)
+                response = raw.parse()
+                used_tokens = self._record_usage(response)
                 return response.choices[0].message.content
-            except openai.RateLimitError:
+            except openai.RateLimitError as e:
+                # the shared limiter pauses every caller instead of each one backing off on its own
                 logging.warning("Rate limit error. Retrying...")
-                time.sleep(max(4, 0.5 * (2 ** retry_interval_exp)))
+                limiter.on_rate_limited(retry_after_seconds(e))
+            except openai.APIConnectionError:
+                logging.warning("API connection error. Retrying...")
+                backoff = max(4, 0.5 * (2 ** retry_interval_exp))
                 retry_interval_exp += 1
+            finally:
+                limiter.release(budget, used_tokens)
+            time.sleep(backoff)
+
+    async def astream_messages(self, messages):
+        request = self._request_kwargs(messages)
+        client = get_async_client()
+        limiter = get_rate_limiter()
+        budget = self._token_budget(request)
+        retry_interval_exp = 1
+
+        # retries only cover opening the stream, chunks already yielded cannot be taken back
+        while True:
+            await limiter.acquire(budget)
+            backoff = 0
+            try:
+                raw = await client.chat.completions.with_raw_response.create(
+                    stream=True, stream_options={"include_usage": True}, **request)
+                limiter.update_from_headers(raw.headers)
+                stream = raw.parse()
+                break
+            except openai.RateLimitError as e:
+                logging.warning("Rate limit error. Retrying...")
+                limiter.on_rate_limited(retry_after_seconds(e))
+            except openai.APIConnectionError:
+                logging.warning("API connection error. Retrying...")
+                backoff = max(4, 0.5 * (2 ** retry_interval_exp))
+                retry_interval_exp += 1
+            except BaseException:
+                limiter.release(budget)
+                raise
+            limiter.release(budget)
+            await asyncio.sleep(backoff)
+
+        # the slot is held until the stream is exhausted or closed
+        used_tokens = None
+        try:
+            async for chunk in stream:
+                # the final chunk has no choices and carries the usage of the whole completion
+                if chunk.usage is not None:
+                    used_tokens = self._record_usage(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            limiter.release(budget, used_tokens)
+
+    async def acomplete_messages(self, messages):
+        request = self._request_kwargs(messages)
+        client = get_async_client()
+        limiter = get_rate_limiter()
+        budget = self._token_budget(request)
+        retry_interval_exp = 1
+
+        while True:
+            await limiter.acquire(budget)
+            used_tokens, backoff = None, 0
+            try:
+                raw = await client.chat.completions.with_raw_response.create(**request)
+                limiter.update_from_headers(raw.headers)
+                response = raw.parse()
+                used_tokens = self._record_usage(response)
+                return response.choices[0].message.content
+            except openai.RateLimitError as e:
+                logging.warning("Rate limit error. Retrying...")
+                limiter.on_rate_limited(retry_after_seconds(e))
             except openai.APIConnectionError:
                 logging.warning("API connection error. Retrying...")
-                time.sleep(max(4, 0.5 * (2 ** retry_interval_exp)))
+                backoff = max(4, 0.5 * (2 ** retry_interval_exp))
                 retry_interval_exp += 1
+            finally:
+                limiter.release(budget, used_tokens)
+            await asyncio.sleep(backoff)
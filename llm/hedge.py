@@ -0,0 +1,183 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from llm.base import LLM
+from llm.cache import CachedLLM
+from llm.tiering import TieredLLM
+from llm.usage import set_usage, with_usage
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent completions, shared by every hedged LLM of the process.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, q: float):
+        """
+        :return: The q-th percentile of the recent latencies, None until min_samples calls have been seen.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * q / 100.0), len(ordered) - 1)]
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(engine: str) -> LatencyTracker:
+    # one per engine, a small model's latencies say nothing about when a large one is late
+    with _trackers_lock:
+        if engine not in _trackers:
+            _trackers[engine] = LatencyTracker()
+        return _trackers[engine]
+
+
+class HedgeBudget:
+    """
+    Hedges a session may issue, shared by the hedged models of all its tiers.
+    """
+
+    def __init__(self, max_hedges: int):
+        self.max_hedges = max_hedges
+        self.used = 0
+
+    def available(self) -> bool:
+        return self.used < self.max_hedges
+
+    def take(self) -> bool:
+        # no await between the check and the increment, concurrent calls of a session cannot overspend
+        if not self.available():
+            return False
+        self.used += 1
+        return True
+
+
+class HedgedLLM(LLM):
+    """
+    Issues a duplicate request when a completion is slower than the given percentile of recent calls of the same
+    engine; the first response wins and the other request is cancelled. Both go through the wrapped model, so a
+    hedge counts against the shared rate limiter like any other call. Streaming is passed through without
+    hedging.
+    Over a CachedLLM the first request keeps the cache and its in-flight sharing; the hedge goes to the model
+    beneath it, as it would otherwise join the request it duplicates, and a winning hedge is stored in the cache.
+    """
+
+    def __init__(self, llm: LLM, max_hedges: int = 3, percentile: float = 95.0, tracker: LatencyTracker = None,
+                 budget: HedgeBudget = None):
+        """
+        :param max_hedges: Hedges this instance may issue, i.e. per session when every session wraps its own.
+        :param budget: Budget shared with other instances of the same session, replaces max_hedges.
+        """
+        super().__init__()
+        self.llm = llm
+        self.budget = budget or HedgeBudget(max_hedges)
+        self.percentile = percentile
+        self.direct = llm.llm if isinstance(llm, CachedLLM) else llm
+        self.tracker = tracker or get_latency_tracker(getattr(self.direct, "engine", type(self.direct).__name__))
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def __getattr__(self, name):
+        # expose engine, temperature, ... of the wrapped model
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def complete(self, prompt: str) -> str:
+        return self.llm.complete(prompt)
+
+    def complete_messages(self, messages) -> str:
+        return self.llm.complete_messages(messages)
+
+    async def acomplete(self, prompt: str) -> str:
+        return await self._hedged(self.llm.acomplete, self.direct.acomplete, prompt)
+
+    async def acomplete_messages(self, messages) -> str:
+        return await self._hedged(self.llm.acomplete_messages, self.direct.acomplete_messages, messages)
+
+    async def astream_messages(self, messages):
+        async for chunk in self.llm.astream_messages(messages):
+            yield chunk
+
+    async def _timed(self, acomplete, prompt):
+        # runs in a task of its own, hence returns the usage along with the response
+        start = time.perf_counter()
+        response, usage = await with_usage(acomplete(prompt))
+        self.tracker.record(time.perf_counter() - start)
+        return response, usage
+
+    async def _hedged(self, acomplete, hedge_acomplete, prompt):
+        if isinstance(self.llm, CachedLLM):
+            # a cache hit says nothing about latency and needs no hedge; a miss is counted by the CachedLLM lookup
+            response = await asyncio.to_thread(self.llm.cache.get, self.llm.cache_key(prompt), False)
+            if response is not None:
+                return response
+        delay = self.tracker.percentile(self.percentile)
+        if delay is None or not self.budget.available():
+            start = time.perf_counter()
+            response = await acomplete(prompt)
+            self.tracker.record(time.perf_counter() - start)
+            return response
+
+        primary = asyncio.ensure_future(self._timed(acomplete, prompt))
+        requests = [primary]
+        try:
+            done, _ = await asyncio.wait(requests, timeout=delay)
+            if not done and self.budget.take():
+                self.hedges += 1
+                requests.append(asyncio.ensure_future(self._timed(hedge_acomplete, prompt)))
+            pending = set(requests)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for request in done:
+                    if request.exception() is None:
+                        if request is not primary:
+                            self.hedge_wins += 1
+                            if isinstance(self.llm, CachedLLM):
+                                # sessions sharing the cancelled primary find the response in the cache
+                                await asyncio.to_thread(self.llm.cache.put, self.llm.cache_key(prompt),
+                                                        request.result()[0])
+                        return self._finish(request.result())
+            # every request failed, report the primary's error
+            return self._finish(primary.result())
+        finally:
+            for request in requests:
+                request.cancel()
+
+    @staticmethod
+    def _finish(result):
+        response, usage = result
+        set_usage(usage)
+        return response
+
+
+def with_hedging(llm: LLM, max_hedges: int = None, percentile: float = None) -> LLM:
+    """
+    Wraps llm with hedging when LLM_HEDGE_MAX (hedges per session) is positive, otherwise returns it unchanged.
+    A response cache stays shared with the other sessions (see HedgedLLM) and a TieredLLM is hedged per tier,
+    with one budget of hedges for all its tiers.
+    """
+    max_hedges = max_hedges if max_hedges is not None else int(os.getenv("LLM_HEDGE_MAX", "0"))
+    if max_hedges <= 0:
+        return llm
+    percentile = percentile if percentile is not None else float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    budget = HedgeBudget(max_hedges)
+    if isinstance(llm, TieredLLM):
+        return TieredLLM([HedgedLLM(model, percentile=percentile, budget=budget) for model in llm.models],
+                         llm.stage_tiers, stall_timeout=llm.stall_timeout, validate=llm.validate)
+    return HedgedLLM(llm, percentile=percentile, budget=budget)
@@ -0,0 +1,41 @@
+import asyncio
+
+from llm.base import LLM
+
+
+class ConcurrencyLimitedLLM(LLM):
+    """
+    Wraps any LLM so that completions acquire a slot of a shared semaphore first.
+    Several wrappers sharing one semaphore are capped together, e.g. the sub-agents racing on one request.
+    """
+
+    def __init__(self, llm: LLM, semaphore: asyncio.Semaphore):
+        super().__init__()
+        self.llm = llm
+        self.semaphore = semaphore
+
+    def __getattr__(self, name):
+        # expose engine, temperature, ... of the wrapped model
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def complete(self, prompt: str) -> str:
+        return self.llm.complete(prompt)
+
+    async def acomplete(self, prompt: str) -> str:
+        async with self.semaphore:
+            return await self.llm.acomplete(prompt)
+
+    def complete_messages(self, messages) -> str:
+        return self.llm.complete_messages(messages)
+
+    async def acomplete_messages(self, messages) -> str:
+        async with self.semaphore:
+            return await self.llm.acomplete_messages(messages)
+
+    async def astream_messages(self, messages):
+        # the slot is held until the stream is exhausted or closed
+        async with self.semaphore:
+            async for chunk in self.llm.astream_messages(messages):
+                yield chunk
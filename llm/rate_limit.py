@@ -0,0 +1,337 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# lower values are served first
+ROUTING_PRIORITY = 0
+DESIGN_PRIORITY = 100
+# how often queued callers re-check their turn
+POLL_INTERVAL = 0.02
+# pause after a rate-limit error without a retry-after header
+DEFAULT_RETRY_AFTER = 1.0
+# refills accumulate rounding error; a bucket this close to the cost counts as full enough
+LEVEL_TOLERANCE = 1e-9
+
+llm_priority = contextvars.ContextVar("llm_priority", default=DESIGN_PRIORITY)
+
+
+@contextlib.contextmanager
+def priority(value):
+    """
+    Priority of the LLM calls made inside the block, e.g. `with priority(ROUTING_PRIORITY): ...`.
+    """
+    token = llm_priority.set(value)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+def parse_duration(text):
+    # reset durations of the rate-limit headers, e.g. "6m0s", "1.5s", "20ms"
+    seconds = 0.0
+    for value, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", text or ""):
+        seconds += float(value) * {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}[unit]
+    return seconds
+
+
+def _refill(state, now):
+    elapsed = max(now - state['updated'], 0.0)
+    if state['rpm']:
+        state['requests'] = min(state['rpm'], state['requests'] + elapsed * state['rpm'] / 60.0)
+    if state['tpm']:
+        state['tokens'] = min(state['tpm'], state['tokens'] + elapsed * state['tpm'] / 60.0)
+    state['updated'] = now
+
+
+class _LocalState:
+    """
+    Bucket state of one process.
+    """
+    # cheap enough to update on the event loop
+    blocking = False
+
+    def __init__(self, rpm, tpm, now):
+        self._values = {'rpm': rpm, 'tpm': tpm, 'requests': rpm, 'tokens': tpm, 'updated': now, 'paused_until': 0.0}
+        self._lock = threading.Lock()
+
+    def transact(self, update):
+        with self._lock:
+            return update(self._values)
+
+
+class _SqliteState:
+    """
+    Bucket state shared by every worker process that opens the same sqlite file.
+    """
+    # waits for the file lock held by other workers, never run on the event loop
+    blocking = True
+
+    def __init__(self, path, rpm, tpm, now):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit (id INTEGER PRIMARY KEY CHECK (id = 0), rpm REAL, tpm REAL, "
+            "requests REAL, tokens REAL, updated REAL, paused_until REAL)"
+        )
+        self._conn.execute("INSERT OR IGNORE INTO rate_limit VALUES (0, ?, ?, ?, ?, ?, 0)",
+                           (rpm, tpm, rpm, tpm, now))
+
+    def transact(self, update):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT rpm, tpm, requests, tokens, updated, paused_until FROM rate_limit WHERE id = 0").fetchone()
+            values = dict(zip(('rpm', 'tpm', 'requests', 'tokens', 'updated', 'paused_until'), row))
+            result = update(values)
+            self._conn.execute(
+                "UPDATE rate_limit SET rpm = ?, tpm = ?, requests = ?, tokens = ?, updated = ?, paused_until = ? "
+                "WHERE id = 0", (values['rpm'], values['tpm'], values['requests'], values['tokens'],
+                                 values['updated'], values['paused_until']))
+            self._conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute plus a cap on in-flight calls, shared by every LLM call of
+    the process (or of all workers with a sqlite path). Callers wait in priority order, so routing calls and
+    sessions close to their last round are served first when the buckets run dry.
+    The limits adapt to the x-ratelimit-* response headers, and a rate-limit error pauses every caller for the
+    retry-after time instead of letting each one back off on its own.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_concurrency: int = 64, path: str = None, clock=None, sleep=None):
+        """
+        :param requests_per_minute: Initial request limit, None until the response headers report one.
+        :param tokens_per_minute: Initial token limit, None until the response headers report one.
+        :param path: sqlite file that shares the buckets between worker processes.
+        :param clock: Wall-clock time in seconds, time.time by default; shared buckets need the same clock everywhere.
+        :param sleep: Coroutine function that waits, asyncio.sleep by default.
+        """
+        self.max_concurrency = max_concurrency
+        self._clock = clock or time.time
+        self._sleep = sleep or asyncio.sleep
+        self._state = (_SqliteState(path, requests_per_minute, tokens_per_minute, self._clock()) if path
+                       else _LocalState(requests_per_minute, tokens_per_minute, self._clock()))
+        # a single thread runs the transactions on a shared file, in order and off the event loop
+        self._state_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limit") if path else None
+        # guards the waiter queue and the in-flight count, never held during a state transaction
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        # ticket of the head waiter while it takes from the buckets
+        self._granting = None
+
+    async def acquire(self, tokens: int = 0):
+        """
+        Waits for a request slot and `tokens` tokens; pair every call with release().
+        """
+        ticket = self._enqueue()
+        try:
+            while True:
+                wait = POLL_INTERVAL
+                if self._claim_turn(ticket):
+                    wait = self._grant(ticket, await self._atransact(lambda state: self._take(state, tokens)))
+                if wait <= 0:
+                    return
+                await self._sleep(min(wait, 1.0))
+        except BaseException:
+            self._dequeue(ticket)
+            raise
+
+    def acquire_blocking(self, tokens: int = 0):
+        # acquire() for synchronous callers
+        ticket = self._enqueue()
+        try:
+            while True:
+                wait = POLL_INTERVAL
+                if self._claim_turn(ticket):
+                    wait = self._grant(ticket, self._transact(lambda state: self._take(state, tokens)))
+                if wait <= 0:
+                    return
+                time.sleep(min(wait, 1.0))
+        except BaseException:
+            self._dequeue(ticket)
+            raise
+
+    def release(self, tokens: int = 0, used_tokens: int = None):
+        """
+        Frees the in-flight slot and returns the difference between the reserved and the used tokens.
+        """
+        with self._lock:
+            self._in_flight -= 1
+        if used_tokens is not None:
+            self._transact_later(lambda state: self._correct(state, tokens - used_tokens))
+
+    def update_from_headers(self, headers):
+        """
+        Adopts the limits and remaining capacity reported by the API, which also accounts for other clients
+        sharing the key.
+        """
+        if headers is None:
+            return
+        limits = {}
+        for field, bucket in (('requests', 'rpm'), ('tokens', 'tpm')):
+            limit = headers.get("x-ratelimit-limit-" + field)
+            remaining = headers.get("x-ratelimit-remaining-" + field)
+            try:
+                limits[bucket] = (float(limit) if limit else None, float(remaining) if remaining else None)
+            except ValueError:
+                continue
+        if not limits:
+            return
+
+        def update(state):
+            _refill(state, self._clock())
+            for bucket, (limit, remaining) in limits.items():
+                level = 'requests' if bucket == 'rpm' else 'tokens'
+                if limit:
+                    if not state[bucket]:
+                        state[level] = limit
+                    state[bucket] = limit
+                if remaining is not None and state[bucket]:
+                    state[level] = min(state[level], remaining)
+
+        self._transact_later(update)
+
+    def on_rate_limited(self, retry_after: float = None):
+        """
+        Pauses all callers after a rate-limit error.
+        """
+        pause = retry_after if retry_after else DEFAULT_RETRY_AFTER
+
+        def update(state):
+            state['paused_until'] = max(state['paused_until'], self._clock() + pause)
+
+        self._transact_later(update)
+
+    def _transact(self, update):
+        if self._state_thread is None:
+            return self._state.transact(update)
+        return self._state_thread.submit(self._state.transact, update).result()
+
+    async def _atransact(self, update):
+        if self._state_thread is None:
+            return self._state.transact(update)
+        return await asyncio.get_running_loop().run_in_executor(self._state_thread, self._state.transact, update)
+
+    def _transact_later(self, update):
+        # bookkeeping nobody waits for: header limits, token corrections, pauses
+        if self._state_thread is None:
+            self._state.transact(update)
+            return
+        self._state_thread.submit(self._state.transact, update).add_done_callback(_log_failure)
+
+    def _enqueue(self):
+        ticket = (llm_priority.get(), next(self._seq))
+        with self._lock:
+            heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _dequeue(self, ticket):
+        with self._lock:
+            if self._granting == ticket:
+                self._granting = None
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+
+    def _claim_turn(self, ticket):
+        # True when the ticket is first in line, a slot is free and nobody else is taking from the buckets
+        with self._lock:
+            if self._granting is not None or self._waiters[0] != ticket or self._in_flight >= self.max_concurrency:
+                return False
+            self._granting = ticket
+            return True
+
+    def _grant(self, ticket, wait):
+        # 0 when the ticket got its slot, otherwise the time to wait before trying again
+        with self._lock:
+            self._granting = None
+            if wait > 0:
+                return wait
+            self._waiters.remove(ticket)
+            heapq.heapify(self._waiters)
+            self._in_flight += 1
+            return 0
+
+    def _take(self, state, tokens):
+        now = self._clock()
+        _refill(state, now)
+        if now < state['paused_until']:
+            return state['paused_until'] - now
+        wait = 0.0
+        if state['rpm'] and state['requests'] < 1 - LEVEL_TOLERANCE:
+            wait = (1 - state['requests']) * 60.0 / state['rpm']
+        # a request larger than the whole bucket only waits for a full bucket
+        cost = min(tokens, state['tpm']) if state['tpm'] else 0
+        if cost and state['tokens'] < cost - LEVEL_TOLERANCE * cost:
+            wait = max(wait, (cost - state['tokens']) * 60.0 / state['tpm'])
+        if wait > 0:
+            return wait
+        if state['rpm']:
+            state['requests'] -= 1
+        if cost:
+            state['tokens'] -= cost
+        return 0.0
+
+    def _correct(self, state, tokens):
+        if state['tpm']:
+            _refill(state, self._clock())
+            state['tokens'] = min(state['tpm'], state['tokens'] + tokens)
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logging.warning("Rate limit state update failed: %s", future.exception())
+
+
+def retry_after_seconds(error):
+    # retry-after(-ms) header of a rate-limit error, None if the API sent none
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return parse_duration(headers.get("x-ratelimit-reset-requests")) or None
+
+
+_shared_limiter = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Process-wide limiter configured by LLM_RPM, LLM_TPM (initial limits, learned from the response headers when
+    unset), LLM_MAX_CONCURRENCY and LLM_RATE_LIMIT_PATH (sqlite file shared by all workers).
+    """
+    global _shared_limiter
+    if _shared_limiter is None:
+        rpm, tpm = os.getenv("LLM_RPM"), os.getenv("LLM_TPM")
+        _shared_limiter = RateLimiter(
+            requests_per_minute=float(rpm) if rpm else None,
+            tokens_per_minute=float(tpm) if tpm else None,
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+            path=os.getenv("LLM_RATE_LIMIT_PATH") or None,
+        )
+    return _shared_limiter
@@ -0,0 +1,108 @@
+import json
+
+
+class IncrementalJSONParser:
+    """
+    Parses top-level fields of a JSON object while its text is still arriving.
+    Every character is scanned once and only the text of the field being parsed is kept, so feeding a whole
+    response chunk by chunk costs O(length).
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: Names of the top-level fields to extract.
+        """
+        self.wanted = set(fields)
+        self.fields = {}
+        # unparsed tail of the response, starting at offset _base
+        self._chunks = []
+        self._base = 0
+        self._end = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._pending_key = None
+        self._key = None
+        self._value_start = None
+        self._value_done = False
+
+    @property
+    def complete(self) -> bool:
+        return self.wanted <= self.fields.keys()
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Adds the next piece of the response.
+        :return: True once every wanted field has been parsed.
+        """
+        start = self._end
+        self._chunks.append(chunk)
+        self._end += len(chunk)
+        for i, c in enumerate(chunk, start):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._key is None:
+                            self._pending_key = json.loads(self._slice(self._string_start, i + 1))
+                        elif self._value_start == self._string_start:
+                            self._finish(i + 1)
+                continue
+
+            if self._depth == 1 and self._key is not None and self._value_start is None and not c.isspace():
+                self._value_start = i
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                if self._depth == 1:
+                    self._finish(i)
+                self._depth -= 1
+                if self._depth == 1 and self._key is not None:
+                    self._finish(i + 1)
+            elif self._depth == 1:
+                if c == ':':
+                    self._key, self._pending_key = self._pending_key, None
+                    self._value_start, self._value_done = None, False
+                elif c == ',':
+                    self._finish(i)
+                    self._key, self._value_start = None, None
+        self._trim()
+        return self.complete
+
+    def _slice(self, start, end):
+        text = "".join(self._chunks)
+        self._chunks = [text]
+        return text[start - self._base:end - self._base]
+
+    def _trim(self):
+        # drops the chunks before the key or wanted value still being parsed
+        if self._in_string and self._depth == 1 and self._key is None:
+            keep = self._string_start
+        elif self._key in self.wanted and self._value_start is not None and not self._value_done:
+            keep = self._value_start
+        else:
+            keep = self._end
+        dropped = 0
+        while dropped < len(self._chunks) and self._base + len(self._chunks[dropped]) <= keep:
+            self._base += len(self._chunks[dropped])
+            dropped += 1
+        del self._chunks[:dropped]
+
+    def _finish(self, end):
+        # the value of the current key spans text[_value_start:end]
+        if self._key is None or self._value_start is None or self._value_done:
+            return
+        self._value_done = True
+        if self._key in self.wanted:
+            try:
+                self.fields[self._key] = json.loads(self._slice(self._value_start, end))
+            except ValueError:
+                pass
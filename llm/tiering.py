@@ -0,0 +1,159 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+from typing import Dict, List
+
+from llm.base import LLM
+from llm.cache import with_cache
+from llm.gpt4 import GPT4
+from llm.usage import set_usage, with_usage
+
+ROUTING = "routing"
+FIRST_PROPOSAL = "first_proposal"
+FEEDBACK = "feedback"
+STAGES = (ROUTING, FIRST_PROPOSAL, FEEDBACK)
+
+llm_stage = contextvars.ContextVar("llm_stage", default=None)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Pipeline stage of the LLM calls made inside the block, used by TieredLLM to pick the model.
+    """
+    token = llm_stage.set(name)
+    try:
+        yield
+    finally:
+        llm_stage.reset(token)
+
+
+def is_json(response):
+    try:
+        json.loads(response)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+class TieredLLM(LLM):
+    """
+    Model tiers ordered from the cheapest to the most capable. Each stage starts at its configured tier and a
+    call escalates to the next tier when the response fails validation (by default: is not valid JSON) or when
+    the call stalls. Calls outside any configured stage use the last, most capable tier.
+    Streaming from a lower tier is collected and validated as a whole before it is passed on, so a stream that
+    stalls or turns out invalid escalates like a plain call; the last tier streams directly.
+    """
+
+    def __init__(self, models: List[LLM], stage_tiers: Dict[str, int], stall_timeout: float = None,
+                 validate=is_json):
+        """
+        :param models: Any LLM instances, cheapest first.
+        :param stage_tiers: Index in models of the first tier tried per stage.
+        :param stall_timeout: Seconds after which a call on a lower tier is abandoned, None to wait.
+        """
+        super().__init__()
+        self.models = models
+        self.stage_tiers = stage_tiers
+        self.stall_timeout = stall_timeout
+        self.validate = validate
+        self.escalations = 0
+
+    def __getattr__(self, name):
+        # engine, temperature, ... of the most capable model
+        if name == "models":
+            raise AttributeError(name)
+        return getattr(self.models[-1], name)
+
+    def _first_tier(self):
+        return self.stage_tiers.get(llm_stage.get(), len(self.models) - 1)
+
+    def complete(self, prompt: str) -> str:
+        return self._complete(lambda model: model.complete(prompt))
+
+    def complete_messages(self, messages) -> str:
+        return self._complete(lambda model: model.complete_messages(messages))
+
+    async def acomplete(self, prompt: str) -> str:
+        return await self._acomplete(lambda model: model.acomplete(prompt))
+
+    async def acomplete_messages(self, messages) -> str:
+        return await self._acomplete(lambda model: model.acomplete_messages(messages))
+
+    def _complete(self, call):
+        # stalls are not detected on the blocking path
+        tier = self._first_tier()
+        while True:
+            response = call(self.models[tier])
+            if tier == len(self.models) - 1 or self.validate(response):
+                return response
+            tier = self._escalate(tier, "invalid response")
+
+    async def _acomplete(self, call):
+        tier = self._first_tier()
+        while True:
+            if tier == len(self.models) - 1:
+                return await call(self.models[tier])
+            try:
+                # wait_for runs the call in a task of its own, whose usage is handed back explicitly
+                response, usage = await asyncio.wait_for(with_usage(call(self.models[tier])), self.stall_timeout)
+            except asyncio.TimeoutError:
+                tier = self._escalate(tier, "stalled")
+                continue
+            set_usage(usage)
+            if self.validate(response):
+                return response
+            tier = self._escalate(tier, "invalid response")
+
+    async def astream_messages(self, messages):
+        tier = self._first_tier()
+        while tier < len(self.models) - 1:
+            stream = self.models[tier].astream_messages(messages)
+            chunks = []
+            try:
+                first, usage = await asyncio.wait_for(with_usage(stream.__anext__()), self.stall_timeout)
+                set_usage(usage)
+                chunks.append(first)
+                async for chunk in stream:
+                    chunks.append(chunk)
+            except asyncio.TimeoutError:
+                await stream.aclose()
+                tier = self._escalate(tier, "stalled")
+                continue
+            except StopAsyncIteration:
+                pass
+            response = "".join(chunks)
+            if self.validate(response):
+                yield response
+                return
+            tier = self._escalate(tier, "invalid response")
+        async for chunk in self.models[-1].astream_messages(messages):
+            yield chunk
+
+    def _escalate(self, tier, reason):
+        self.escalations += 1
+        logging.warning("LLM tier %d %s for stage %s, escalating", tier, reason, llm_stage.get())
+        return tier + 1
+
+
+def with_tiering(llm: LLM) -> LLM:
+    """
+    Puts a cheaper GPT-4 family model (LLM_TIER_SMALL_ENGINE) in front of llm for the stages listed in
+    LLM_TIER_STAGES (default: routing and feedback rounds); llm stays the escalation target and the model of
+    every other stage. Returns llm unchanged when no small engine is configured.
+    """
+    engine = os.getenv("LLM_TIER_SMALL_ENGINE")
+    if not engine:
+        return llm
+    small = with_cache(GPT4(engine=engine, temperature=getattr(llm, "temperature", 0.0),
+                            max_tokens=getattr(llm, "max_tokens", 1024)))
+    stages = [name.strip() for name in os.getenv("LLM_TIER_STAGES", ROUTING + "," + FEEDBACK).split(",")]
+    unknown = set(stages) - set(STAGES) - {""}
+    if unknown:
+        raise ValueError("Unknown LLM stages {}, expected some of {}".format(sorted(unknown), STAGES))
+    stall = os.getenv("LLM_TIER_STALL", "15")
+    return TieredLLM([small, llm], {name: 0 for name in stages if name},
+                     stall_timeout=float(stall) if stall else None)
@@ -0,0 +1,58 @@
+import contextvars
+import threading
+
+# usage of the latest completion in the current task, see take_usage()
+_last_usage = contextvars.ContextVar("llm_last_usage", default=None)
+_totals_lock = threading.Lock()
+_totals = {'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+# rough characters per token of the GPT-4 tokenizers on English text and numbers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def record_usage(prompt_tokens, cached_tokens, completion_tokens):
+    """
+    Records the token usage of one completion, both for the calling task and in the process-wide totals.
+    """
+    usage = {'prompt_tokens': prompt_tokens, 'cached_tokens': cached_tokens, 'completion_tokens': completion_tokens}
+    _last_usage.set(usage)
+    with _totals_lock:
+        _totals['calls'] += 1
+        for key, value in usage.items():
+            _totals[key] += value
+    return usage
+
+
+def take_usage():
+    """
+    Usage of the latest completion awaited by the current task, None if it was served without an API call
+    (e.g. from the response cache). Clears it, so the next call starts fresh.
+    """
+    usage = _last_usage.get()
+    _last_usage.set(None)
+    return usage
+
+
+async def with_usage(awaitable):
+    """
+    Awaits a completion and returns it with its usage, for completions awaited in a task of their own
+    (ensure_future, wait_for), whose usage would otherwise stay in that task's copy of the context.
+    Hand the usage back to the calling task with set_usage().
+    """
+    _last_usage.set(None)
+    result = await awaitable
+    return result, _last_usage.get()
+
+
+def set_usage(usage):
+    _last_usage.set(usage)
+
+
+def usage_totals():
+    with _totals_lock:
+        totals = dict(_totals)
+    totals['cached_ratio'] = totals['cached_tokens'] / totals['prompt_tokens'] if totals['prompt_tokens'] else 0.0
+    return totals
@@ -1,17 +1,26 @@
 import asyncio
 import traceback
 
+from typing import List
+
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from api.task import CompleteTaskResp, complete_task
-from model.control_task import TaskSpecs, TaskDesignResult
-
+# load before importing the agents, whose default LLMs read their configuration at import time
 load_dotenv()
 
+from api.batch import BatchStatus, BatchSubmitResp, get_batch_manager
+from api.jobs import JobStatus, get_job_manager
+from api.progress import ProgressChannel, is_final
+from api.task import CompleteTaskResp, complete_task
+from evaluation.executor import shutdown_executor
+from job_store import ACTIVE_STATES
+from model.control_task import TaskSpecs
+
 app = FastAPI(title="ControlAgent Service")
 app.add_middleware(
     CORSMiddleware,
@@ -21,16 +30,114 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def resume_design_jobs():
+    job_manager = get_job_manager()
+    if job_manager is not None:
+        job_manager.start_maintenance()
+
+
+@app.on_event("shutdown")
+def release_evaluation_workers():
+    get_batch_manager().shutdown()
+    job_manager = get_job_manager()
+    if job_manager is not None:
+        job_manager.shutdown()
+    shutdown_executor()
+
+
 @app.post("/api/complete_task", response_model=CompleteTaskResp)
 async def handle_complete_task(specs: TaskSpecs):
     return await complete_task(specs)
 
 
-async def _queue_iter(q: asyncio.Queue):
-    while True:
-        item = await q.get()
-        yield item
-        q.task_done()
+@app.post("/api/batch", response_model=BatchSubmitResp)
+async def submit_batch(specs: List[TaskSpecs]):
+    try:
+        batch = get_batch_manager().submit(specs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return BatchSubmitResp(batch_id=batch.batch_id, total=len(batch.specs))
+
+
+def _find_batch(batch_id: str):
+    batch = get_batch_manager().get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Unknown batch {}".format(batch_id))
+    return batch
+
+
+@app.get("/api/batch/{batch_id}", response_model=BatchStatus)
+async def poll_batch(batch_id: str, since: int = 0):
+    # `since` skips results the client already has, in completion order
+    return _find_batch(batch_id).snapshot(since)
+
+
+@app.get("/api/batch/{batch_id}/stream")
+async def stream_batch(batch_id: str):
+    batch = _find_batch(batch_id)
+    return StreamingResponse(get_batch_manager().stream(batch), media_type="application/x-ndjson")
+
+
+@app.delete("/api/batch/{batch_id}", response_model=BatchStatus)
+async def cancel_batch(batch_id: str):
+    _find_batch(batch_id)
+    return get_batch_manager().cancel(batch_id).snapshot()
+
+
+def _job_manager_or_404():
+    job_manager = get_job_manager()
+    if job_manager is None:
+        raise HTTPException(status_code=404, detail="Durable jobs are disabled, set JOB_STORE_PATH")
+    return job_manager
+
+
+@app.post("/api/jobs", response_model=JobStatus)
+async def submit_job(specs: TaskSpecs):
+    job_manager = _job_manager_or_404()
+    return await job_manager.status(await job_manager.submit(specs))
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+async def poll_job(job_id: str):
+    status = await _job_manager_or_404().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job {}".format(job_id))
+    return status
+
+
+@app.delete("/api/jobs/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str):
+    job_manager = _job_manager_or_404()
+    if not await job_manager.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Unknown job {}".format(job_id))
+    return await job_manager.status(job_id)
+
+
+async def _forward_job(websocket: WebSocket, job_id: str, since: int = 0):
+    # replays the stored rounds of the job, then forwards live results; disconnecting leaves the job running
+    try:
+        job_manager = get_job_manager()
+        async for cur_result in job_manager.subscribe(job_id, since):
+            await websocket.send_json(cur_result.model_dump(mode="json"))
+        status = (await job_manager.status(job_id)).status
+        if status in ACTIVE_STATES:
+            # this worker is shutting down, another one resumes the job
+            await websocket.close(code=1012, reason="Job interrupted, reattach to follow it")
+        else:
+            await websocket.close(code=1000, reason="Job {}".format(status))
+    except WebSocketDisconnect:
+        print("WebSocket disconnected, job {} keeps running".format(job_id))
+
+
+@app.websocket("/api/jobs/{job_id}/attach")
+async def attach_job(websocket: WebSocket, job_id: str, since: int = 0):
+    await websocket.accept()
+    job_manager = get_job_manager()
+    if job_manager is None or await job_manager.status(job_id) is None:
+        await websocket.close(code=1008, reason="Unknown job {}".format(job_id))
+        return
+    await _forward_job(websocket, job_id, since)
 
 
 @app.websocket("/api/complete_task")
@@ -40,18 +147,27 @@ async def handle_complete_task_websocket(websocket: WebSocket):
     task_spec = TaskSpecs.parse_obj(task_spec_data)
     print("Received task spec:", task_spec)
 
-    result_chan: asyncio.Queue[TaskDesignResult] = asyncio.Queue()
+    job_manager = get_job_manager()
+    if job_manager is not None:
+        job_id = await job_manager.submit(task_spec)
+        await websocket.send_json({"job_id": job_id})
+        await _forward_job(websocket, job_id)
+        return
+
+    # bounded and never blocking, the design loop does not wait for the client
+    result_chan = ProgressChannel()
     design_task = asyncio.create_task(complete_task(task_spec, _async=True, result_queue=result_chan))
+    design_task.add_done_callback(lambda _: result_chan.close())
     print("start design task")
 
     async def forward_to_client():
         try:
-            async for cur_result in _queue_iter(result_chan):
+            async for cur_result in result_chan:
                 print("Send result to client:", cur_result)
                 await websocket.send_json(cur_result.model_dump(mode="json"))
-                if cur_result.conversation_round == -1:
-                    await websocket.close(code=1000, reason="Task completed")
+                if is_final(cur_result):
                     break
+            await websocket.close(code=1000, reason="Task completed")
         except asyncio.CancelledError:
             return
 
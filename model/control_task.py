@@ -43,9 +43,25 @@ class TaskDesignResult(BaseModel):
     parameters: dict = Field(..., description="output parameters")
     performance: dict = Field(..., description="output performance")
     conversation_round: int = Field(..., description="conversation round")
+    refined: bool = Field(False, description="design found by numeric refinement of the LLM proposal")
+    agent: Optional[str] = Field(None, description="sub-agent of the round, set when several sub-agents race")
+
+
+class DesignTextDelta(BaseModel):
+    text: str = Field(..., description="next piece of the LLM response of the round")
+    conversation_round: int = Field(..., description="conversation round")
+    agent: Optional[str] = Field(None, description="sub-agent of the round, set when several sub-agents race")
+    kind: str = Field("text_delta", description="distinguishes streamed text from round results")
+
+
+class ProgressHeartbeat(BaseModel):
+    dropped: int = Field(0, description="progress messages dropped so far because the client fell behind")
+    kind: str = Field("heartbeat", description="sent while no progress is available, keeps the connection alive")
 
 
 class FinalTaskDesignResult(BaseModel):
     used_agent: str = Field(..., description="used agent")
     is_success: bool = Field(..., description="final design success or not")
     design_history: List[TaskDesignResult] = Field(..., description="design history")
+    other_agents: Optional[List["FinalTaskDesignResult"]] = Field(
+        None, description="partial results of the sub-agents that lost a race, if requested")
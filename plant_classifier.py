@@ -0,0 +1,92 @@
+import numpy as np
+
+from model.control_task import TaskSpecs
+
+# plant classes, matched against the plant_class attribute of the sub-agents
+FIRST_ORDER_STABLE = "first_order_stable"
+FIRST_ORDER_UNSTABLE = "first_order_unstable"
+SECOND_ORDER_STABLE = "second_order_stable"
+SECOND_ORDER_UNSTABLE = "second_order_unstable"
+FIRST_ORDER_DELAY = "first_order_delay"
+HIGHER_ORDER = "higher_order"
+
+PLANT_CLASS_DESCRIPTIONS = {
+    FIRST_ORDER_STABLE: "first-order stable system",
+    FIRST_ORDER_UNSTABLE: "first-order unstable system",
+    SECOND_ORDER_STABLE: "second-order stable system",
+    SECOND_ORDER_UNSTABLE: "second-order unstable system",
+    FIRST_ORDER_DELAY: "first-order system with time delay",
+    HIGHER_ORDER: "higher-order system",
+}
+
+# poles closer than this (relative to the largest pole) to the imaginary axis make the class ambiguous
+MARGINAL_POLE_TOLERANCE = 1e-6
+
+
+def classify_plant(num, den, tau=None, strict=True):
+    """
+    Deterministic plant classification from the degree of the denominator, its right-half-plane poles and
+    the presence of a delay.
+    :param strict: If False, ambiguous plants get their nearest class instead of None (marginal poles count as
+                   unstable, delayed plants beyond first order are higher-order); used to guess, not to route.
+    :return: One of the plant classes above, or None if the plant is ambiguous (improper, static, marginally
+             stable, or delayed beyond first order), in which case the LLM decides.
+    """
+    num = np.trim_zeros(np.asarray(num, dtype=float), 'f')
+    den = np.trim_zeros(np.asarray(den, dtype=float), 'f')
+    if len(num) == 0 or len(den) < 2 or len(num) > len(den):
+        return None
+    order = len(den) - 1
+    poles = np.roots(den)
+    scale = max(1.0, np.max(np.abs(poles)))
+    marginal = np.any(np.abs(poles.real) <= MARGINAL_POLE_TOLERANCE * scale)
+    if marginal and strict:
+        return None
+    stable = bool(np.all(poles.real < 0)) and not marginal
+
+    if tau:
+        if order == 1 and stable:
+            return FIRST_ORDER_DELAY
+        return None if strict else HIGHER_ORDER
+    if order == 1:
+        return FIRST_ORDER_STABLE if stable else FIRST_ORDER_UNSTABLE
+    if order == 2:
+        return SECOND_ORDER_STABLE if stable else SECOND_ORDER_UNSTABLE
+    return HIGHER_ORDER
+
+
+def describe_task(task_specs: TaskSpecs, plant_class: str) -> str:
+    """
+    Task Requirement text for a sub-agent, built locally in place of the central agent's LLM summary.
+    """
+    plant = "G(s) = ({}) / ({})".format(_polynomial(task_specs.num), _polynomial(task_specs.den))
+    if task_specs.tau:
+        plant += " * exp(-{} s)".format(task_specs.tau)
+    return (
+        "The plant is a {description} with transfer function {plant}. "
+        "Design a controller such that the closed-loop system has a phase margin of at least {pm} degrees, "
+        "a settling time between {ts_min} and {ts_max} sec, and a steady-state error of at most {ess}."
+    ).format(description=PLANT_CLASS_DESCRIPTIONS[plant_class], plant=plant, pm=task_specs.phase_margin_min,
+             ts_min=task_specs.settling_time_min, ts_max=task_specs.settling_time_max,
+             ess=task_specs.steadystate_error_max)
+
+
+def _polynomial(coeffs):
+    # coefficients in descending powers of s, e.g. [1, 2.5, 0] -> "s^2 + 2.5 s"
+    coeffs = list(np.trim_zeros(np.asarray(coeffs, dtype=float), 'f')) or [0.0]
+    degree = len(coeffs) - 1
+    terms = []
+    for i, c in enumerate(coeffs):
+        power = degree - i
+        if c == 0 and len(coeffs) > 1:
+            continue
+        magnitude = "{:g}".format(abs(c))
+        if power > 0 and abs(c) == 1:
+            magnitude = ""
+        variable = "" if power == 0 else "s" if power == 1 else "s^{}".format(power)
+        term = " ".join(part for part in (magnitude, variable) if part)
+        if not terms:
+            terms.append(("-" if c < 0 else "") + term)
+        else:
+            terms.append(("- " if c < 0 else "+ ") + term)
+    return " ".join(terms)
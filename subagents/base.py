@@ -7,20 +7,58 @@ from abc import ABC
 
 from typing import List, Dict
 
+from evaluation.evaluator import get_evaluator
+from evaluation.executor import get_executor
 from llm.base import LLM
+from llm.cache import with_cache
 from llm.gpt4 import GPT4
 from model.control_task import TaskDesignResult, FinalTaskDesignResult
 
 
 class AbstractSubAgent(ABC):
     agent_name = "AbstractSubAgent"
+    # controller structure tuned by the sub-agent, used to build its loop evaluator
+    lead_compensator = False
+    delay_aware = False
+    # plant class from plant_classifier handled by the sub-agent, used to route without the LLM
+    plant_class = None
 
     def __init__(self, system, thresholds, task_requirement, scenario,
-                 llm: LLM = GPT4(engine='gpt-4o-2024-08-06', temperature=0.0, max_tokens=1024)):
-        pass
+                 llm: LLM = with_cache(GPT4(engine='gpt-4o-2024-08-06', temperature=0.0, max_tokens=1024))):
+        # one evaluator per plant, reused by every design round, on the full plant including its zeros
+        self.evaluator = get_evaluator(system['num'], system['den'],
+                                       tau=system['tau'] if self.delay_aware else None,
+                                       lead=self.lead_compensator)
+        # evaluations are awaited through the shared executor so they never stall the event loop
+        self.executor = get_executor()
+        # first design round started before the central agent confirmed the routing, see speculate()
+        self._speculative_round = None
+
+    def speculate(self) -> asyncio.Task:
+        """
+        Starts the first design round right away, concurrently with the central agent's routing.
+        handle_task picks up the round through next_round() if the routing agrees, cancel_speculation() drops it.
+        """
+        self._speculative_round = asyncio.ensure_future(self.handle_one_iter_design())
+        # a discarded round that fails, e.g. while it is being cancelled, is never awaited: retrieve its error so
+        # asyncio does not log it as unhandled. next_round() still raises it when the round is kept
+        self._speculative_round.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._speculative_round
+
+    def cancel_speculation(self):
+        if self._speculative_round is not None:
+            self._speculative_round.cancel()
+            self._speculative_round = None
+
+    async def next_round(self) -> (bool, TaskDesignResult):
+        # the speculative first round if there is one, otherwise a fresh design round
+        if self._speculative_round is not None:
+            pending, self._speculative_round = self._speculative_round, None
+            return await pending
+        return await self.handle_one_iter_design()
 
     @abc.abstractmethod
-    def handle_task(self, result_chan: asyncio.Queue = None) -> FinalTaskDesignResult:
+    async def handle_task(self, result_chan: asyncio.Queue = None) -> FinalTaskDesignResult:
         # used for try as much as possible until success or reach max attempts
         raise NotImplementedError
 
@@ -30,10 +68,20 @@ class AbstractSubAgent(ABC):
     #     raise NotImplementedError
 
     @abc.abstractmethod
-    def handle_one_iter_design(self) -> (bool, TaskDesignResult):
+    async def handle_one_iter_design(self) -> (bool, TaskDesignResult):
         # used for chat-style interactions
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def checkpoint(self) -> dict:
+        # JSON-serializable session state after a round, for durable jobs; see restore()
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def restore(self, state: dict):
+        # continues a session from checkpoint() output
+        raise NotImplementedError
+
 
 def get_all_available_subagents() -> (List[type], Dict[int, str]):
     classes = {}
@@ -1,23 +1,57 @@
 import asyncio
 import json
+import os
 
 from DesignMemory import design_memory
-from instruction import overall_instruction_PI, response_format_PI
+from feedback_builder import FeedbackPromptBuilder
+from evaluation.refine import refine_design
+from instruction import overall_instruction_PI, response_format_PI, response_format_PI_candidates, \
+    response_format_PI_stream
 from llm.base import LLM
+from llm.cache import with_cache
 from llm.gpt4 import GPT4
-from model.control_task import TaskDesignResult, FinalTaskDesignResult
+from llm.hedge import with_hedging
+from llm.rate_limit import DESIGN_PRIORITY, priority
+from llm.tiering import FEEDBACK, FIRST_PROPOSAL, stage, with_tiering
+from llm.stream import IncrementalJSONParser
+from llm.usage import take_usage
+from model.control_task import DesignTextDelta, TaskDesignResult, FinalTaskDesignResult
+from plant_classifier import FIRST_ORDER_STABLE
 from subagents.base import AbstractSubAgent
-from util import check_stability, loop_shaping, feedback_prompt
+from util import meets_thresholds, threshold_violation
 
 
 class first_ord_stable_Design(AbstractSubAgent):
     agent_name = "First-order stable system"
+    plant_class = FIRST_ORDER_STABLE
+    # also the fallback for delayed first-order plants, which then get the delay evaluator
+    delay_aware = True
 
     def __init__(self, system, thresholds, task_requirement, scenario,
-                 llm: LLM = GPT4(engine='gpt-4o-2024-08-06', temperature=0.0, max_tokens=1024)):
+                 llm: LLM = with_cache(GPT4(engine='gpt-4o-2024-08-06', temperature=0.0, max_tokens=1024)),
+                 num_candidates: int = None, refine: bool = None, stream: bool = None):
         super().__init__(system, thresholds, task_requirement, scenario)
-        self.llm = llm
+        # cheaper model for the configured stages (LLM_TIER_SMALL_ENGINE), per-session hedging (LLM_HEDGE_MAX)
+        self.llm = with_hedging(with_tiering(llm))
         self.max_attempts = 10
+        # number of ranked designs requested per LLM call, all evaluated together
+        self.num_candidates = num_candidates or int(os.getenv("DESIGN_CANDIDATES", "1"))
+        # numeric local refinement of stable proposals that miss the thresholds
+        self.refine = refine if refine is not None else os.getenv("DESIGN_REFINE", "0") == "1"
+        # stream the LLM response to the client and evaluate as soon as the parameters are complete
+        self.stream = stream if stream is not None else os.getenv("DESIGN_STREAM", "0") == "1"
+        if self.num_candidates > 1:
+            self.response_format = response_format_PI_candidates.replace("{num_candidates}",
+                                                                         str(self.num_candidates))
+        elif self.stream:
+            self.response_format = response_format_PI_stream
+        else:
+            self.response_format = response_format_PI
+        # rest of the streamed responses whose parameters have already been evaluated
+        self.stream_tails = set()
+        self.result_chan = None
+        # text streamed by a speculative round before handle_task attached the result channel
+        self.early_deltas = []
         self.design_memory = design_memory()
 
         # new added attrs
@@ -28,61 +62,94 @@ class first_ord_stable_Design(AbstractSubAgent):
         self.num_attempt = 1
         self.prompt = overall_instruction_PI  #
         self.new_problem = "Now consider the following design task:" + self.task_requirement
-        self.problem_statement = self.prompt + self.new_problem + response_format_PI
+        # renders each design once and bounds the history per FEEDBACK_WINDOW / FEEDBACK_SUMMARY
+        self.feedback = FeedbackPromptBuilder(self.prompt, self.new_problem, self.response_format, self.thresholds)
+        # static instructions first so every round shares the cached prompt prefix, see build_messages
+        self.messages = self.feedback.build_messages()
+        self.problem_statement = self.messages[-1]['content']
         self.conversation_log = []
         self.is_success = False
 
     async def handle_task(self, result_chan: asyncio.Queue = None) -> FinalTaskDesignResult:
-        while self.num_attempt < self.max_attempts:
-            print("attempt {}".format(self.num_attempt))
-            success, cur_result = self.handle_one_iter_design()
-            if result_chan is not None:
-                await result_chan.put(cur_result)
-                await result_chan.join()
-                print("put result to queue", cur_result)
-            if success:
+        self.result_chan = result_chan
+        early_deltas, self.early_deltas = self.early_deltas, None
+        if result_chan is not None:
+            for delta in early_deltas:
+                result_chan.put_nowait(delta)
+        finished = False
+        try:
+            while self.num_attempt < self.max_attempts:
+                print("attempt {}".format(self.num_attempt))
+                success, cur_result = await self.next_round()
                 if result_chan is not None:
-                    await result_chan.put(TaskDesignResult(success=True, parameters={}, performance={},
-                                                           conversation_round=-1))
-                break
+                    # never wait for the consumer, a slow client must not hold up the next round
+                    result_chan.put_nowait(cur_result)
+                    print("put result to queue", cur_result)
+                if success:
+                    if result_chan is not None:
+                        result_chan.put_nowait(TaskDesignResult(success=True, parameters={}, performance={},
+                                                                conversation_round=-1))
+                    break
+            finished = True
+        finally:
+            # after a success or a cancellation nobody reads the remaining rationale
+            await self.close_streams(cancel=self.is_success or not finished)
         return self.construct_final_result()
 
-    def handle_one_iter_design(self):
+    async def handle_one_iter_design(self):
         # Construct the design prompt
         # Call LLM to complete the prompt
-        response = self.llm.complete(self.problem_statement)
-        self.conversation_log.append({
-            "Problem Statement": self.problem_statement,
-            "Response": response
-        })
-
-        data = json.loads(response)
-
-        # parameters for plant transfer function
-        num = [self.system['num'][0]]
-        den = self.system['den']
-
-        # Extract the list of parameters
-        parameters = data['parameter']
-        omega_L = parameters[0]
-        beta_b = parameters[1]
-        is_stable = check_stability(omega_L, beta_b, num, den)
-        if is_stable:
-            _, phase_margin, _, settlingtime, _, sse = loop_shaping(omega_L, beta_b, num, den)
+        # later rounds go first when the shared rate limiter queues calls, feedback rounds may use a cheaper model
+        round_stage = FIRST_PROPOSAL if self.num_attempt == 1 else FEEDBACK
+        with priority(DESIGN_PRIORITY - self.num_attempt), stage(round_stage):
+            if self.stream:
+                data = await self.stream_design(['parameter'] if self.num_candidates == 1 else None)
+            else:
+                response = await self.llm.acomplete_messages(self.messages)
+                self.conversation_log.append({
+                    "Problem Statement": self.problem_statement,
+                    "Estimated Prompt Tokens": self.feedback.token_estimates[-1],
+                    "Usage": take_usage(),
+                    "Response": response
+                })
+                data = json.loads(response)
+
+        # designs stored from here on belong to this round, see _stamp_round
+        first_design = len(self.design_memory.get_all_designs())
+        # Extract the list of parameters, evaluate every candidate in one go and keep the best one
+        candidates = self.extract_candidates(data)
+        evaluations = await self.executor.evaluate_many(self.evaluator, candidates)
+        (omega_L, beta_b), evaluation = self.select_candidate(candidates, evaluations)
+        if len(candidates) > 1:
+            self.conversation_log.append({
+                "Candidate Designs": [
+                    {"parameters": {'omega_L': w, 'beta_b': b},
+                     "performance": e.performance() if e.is_stable else 'unstable'}
+                    for (w, b), e in zip(candidates, evaluations)
+                ]
+            })
+        if evaluation.is_stable:
+            phase_margin, settlingtime, sse = (evaluation.phase_margin, evaluation.settling_time,
+                                               evaluation.steadystate_error)
             self.design_memory.add_design(
                 parameters={'omega_L': omega_L, 'beta_b': beta_b},
-                performance={'phase_margin': phase_margin, 'settling_time_min': settlingtime,
-                             'settling_time_max': settlingtime, 'steadystate_error': sse}
+                performance=evaluation.performance()
             )
             design = self.design_memory.get_latest_design()
-            is_succ = True  # Assume success unless a metric fails
-            for metric, specs in self.thresholds.items():
-                value = design['performance'].get(metric)
-                if value is not None:
-                    if 'min' in specs and value < specs['min']:
-                        is_succ = False  # Set success to False if any metric fails
-                    elif 'max' in specs and value > specs['max']:
-                        is_succ = False  # Set success to False if any metric fails
+            is_succ = meets_thresholds(design['performance'], self.thresholds)
+            if not is_succ and self.refine:
+                refined = await self.executor.run(refine_design, self.evaluator, omega_L, beta_b, self.thresholds)
+                if refined is not None:
+                    (omega_L, beta_b), evaluation = refined
+                    phase_margin, settlingtime, sse = (evaluation.phase_margin, evaluation.settling_time,
+                                                       evaluation.steadystate_error)
+                    self.design_memory.add_design(
+                        parameters={'omega_L': omega_L, 'beta_b': beta_b},
+                        performance=evaluation.performance(),
+                        refined=True
+                    )
+                    design = self.design_memory.get_latest_design()
+                    is_succ = True
             if is_succ:
                 print("The current design satisfies the requirement.")
                 print(f"Phase Margin is {phase_margin}")
@@ -101,13 +168,16 @@ class first_ord_stable_Design(AbstractSubAgent):
                     success=True,
                     parameters=design['parameters'],
                     performance=design['performance'],
-                    conversation_round=self.num_attempt + 1
+                    conversation_round=self.num_attempt + 1,
+                    refined=design['refined']
                 )
+                self._stamp_round(first_design, cur_iter_result.conversation_round)
                 return True, cur_iter_result
             else:
                 # abaltion 1: with or without feedback
-                feedback = feedback_prompt(self.design_memory, self.thresholds)
-                self.problem_statement = self.prompt + self.new_problem + "\n\n" + feedback + response_format_PI
+                self.feedback.update(self.design_memory)
+                self.messages = self.feedback.build_messages()
+                self.problem_statement = self.messages[-1]['content']
         else:  # not stable
             self.design_memory.add_design(
                 parameters={'omega_L': omega_L, 'beta_b': beta_b},
@@ -120,8 +190,9 @@ class first_ord_stable_Design(AbstractSubAgent):
                 "Failed Design Performance": self.design_memory.get_latest_design()['performance']
             })
             # Save unstable design information to the log
-            feedback = feedback_prompt(self.design_memory, self.thresholds)
-            self.problem_statement = self.prompt + self.new_problem + "\n\n" + feedback + response_format_PI
+            self.feedback.update(self.design_memory)
+            self.messages = self.feedback.build_messages()
+            self.problem_statement = self.messages[-1]['content']
         self.num_attempt += 1
         design = self.design_memory.get_latest_design()
         cur_iter_result = TaskDesignResult(
@@ -130,8 +201,119 @@ class first_ord_stable_Design(AbstractSubAgent):
             performance=design['performance'],
             conversation_round=self.num_attempt + 1
         )
+        self._stamp_round(first_design, cur_iter_result.conversation_round)
         return False, cur_iter_result
 
+    def _stamp_round(self, first_design, conversation_round):
+        # the final design history reports each design under the round number already streamed for it
+        for design in self.design_memory.get_all_designs()[first_design:]:
+            design['conversation_round'] = conversation_round
+
+    async def stream_design(self, fields=None):
+        """
+        Streams the LLM response of this round, forwarding the text to the result channel as it arrives.
+        :param fields: Top-level JSON fields needed for the evaluation, None to wait for the whole response.
+        :return: The parsed fields as soon as they are complete; the rest of the text keeps streaming in the
+                 background until close_streams.
+        """
+        log_entry = {
+            "Problem Statement": self.problem_statement,
+            "Estimated Prompt Tokens": self.feedback.token_estimates[-1],
+            "Usage": None,
+            "Response": None
+        }
+        self.conversation_log.append(log_entry)
+        parser = IncrementalJSONParser(fields or [])
+        ready = asyncio.get_running_loop().create_future()
+        conversation_round = self.num_attempt + 1
+        messages = self.messages
+
+        async def consume():
+            chunks = []
+            try:
+                async for chunk in self.llm.astream_messages(messages):
+                    chunks.append(chunk)
+                    delta = DesignTextDelta(text=chunk, conversation_round=conversation_round)
+                    if self.result_chan is not None:
+                        self.result_chan.put_nowait(delta)
+                    elif self.early_deltas is not None:
+                        self.early_deltas.append(delta)
+                    if fields and not ready.done() and parser.feed(chunk):
+                        ready.set_result(parser.fields)
+                log_entry["Usage"] = take_usage()
+                if not ready.done():
+                    ready.set_result(json.loads("".join(chunks)))
+            except Exception as e:
+                if not ready.done():
+                    ready.set_exception(e)
+                else:
+                    print("Streaming the rest of the response failed:", e)
+            finally:
+                log_entry["Response"] = "".join(chunks)
+                if not ready.done():
+                    ready.cancel()
+
+        tail = asyncio.create_task(consume())
+        self.stream_tails.add(tail)
+        tail.add_done_callback(self.stream_tails.discard)
+        try:
+            return await ready
+        except asyncio.CancelledError:
+            tail.cancel()
+            raise
+
+    async def close_streams(self, cancel=False):
+        tails = list(self.stream_tails)
+        for tail in tails:
+            if cancel:
+                tail.cancel()
+        await asyncio.gather(*tails, return_exceptions=True)
+
+    def extract_candidates(self, data):
+        # ranked [omega_L, beta_b] pairs, falling back to the single 'parameter' entry
+        candidates = []
+        if self.num_candidates > 1:
+            for parameters in data.get('candidates') or []:
+                if isinstance(parameters, list) and len(parameters) >= 2:
+                    candidates.append((parameters[0], parameters[1]))
+        if not candidates:
+            parameters = data['parameter']
+            candidates.append((parameters[0], parameters[1]))
+        return candidates[:max(self.num_candidates, 1)]
+
+    def select_candidate(self, candidates, evaluations):
+        # the first passing candidate in rank order, otherwise the stable one closest to the thresholds
+        best, best_violation = 0, float('inf')
+        for idx, evaluation in enumerate(evaluations):
+            if not evaluation.is_stable:
+                continue
+            violation = threshold_violation(evaluation.performance(), self.thresholds)
+            if violation == 0:
+                return candidates[idx], evaluation
+            if violation < best_violation:
+                best, best_violation = idx, violation
+        return candidates[best], evaluations[best]
+
+    def checkpoint(self):
+        return {
+            'num_attempt': self.num_attempt,
+            'is_success': self.is_success,
+            'designs': self.design_memory.get_all_designs(),
+            'messages': self.messages,
+            'conversation_log': self.conversation_log,
+        }
+
+    def restore(self, state):
+        self.num_attempt = state['num_attempt']
+        self.is_success = state['is_success']
+        for design in state['designs']:
+            self.design_memory.add_design(design['parameters'], design['performance'], design.get('refined', False),
+                                          design.get('conversation_round'))
+        self.feedback.update(self.design_memory)
+        self.messages = state['messages']
+        self.problem_statement = self.messages[-1]['content']
+        self.conversation_log = state['conversation_log']
+
     def construct_final_result(self):
         history_result = []
         for idx, design in enumerate(self.design_memory.get_all_designs()):
@@ -140,7 +322,8 @@ class first_ord_stable_Design(AbstractSubAgent):
                     success=False if idx != len(self.design_memory.get_all_designs()) else self.is_success,
                     parameters=design['parameters'],
                     performance=design['performance'],
-                    conversation_round=idx + 1
+                    conversation_round=design.get('conversation_round') or idx + 1,
+                    refined=design.get('refined', False)
                 )
             )
         res = FinalTaskDesignResult(
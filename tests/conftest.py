@@ -0,0 +1,4 @@
+import os
+
+# the default LLM clients are built at import time and need a key; tests never send a request
+os.environ.setdefault("OPENAI_API_KEY", "test")
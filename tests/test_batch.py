@@ -0,0 +1,56 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+from evaluation.cache import EvaluationCache
+from evaluation.evaluator import LoopShapingEvaluator
+from evaluation.executor import EvaluationExecutor
+
+
+def random_plants(count, seed=0):
+    # stable second and third order plants, some with a zero, with a handful of candidate designs each
+    rng = np.random.default_rng(seed)
+    plants = []
+    for index in range(count):
+        den = list(np.poly(-rng.uniform(0.2, 5, rng.integers(2, 4))))
+        num = [1, rng.uniform(0.5, 3)] if index % 3 == 0 else [rng.uniform(0.5, 10)]
+        omega_L = list(10 ** rng.uniform(-1, 1, 5))
+        beta_b = list(10 ** rng.uniform(-1.5, 1, 5))
+        plants.append((num, den, omega_L, beta_b))
+    return plants
+
+
+def assert_same_evaluation(got, expected):
+    assert got.is_stable == expected.is_stable
+    if not expected.is_stable:
+        return
+    for field in ('gain_margin', 'phase_margin', 'rise_time', 'settling_time', 'steadystate_error'):
+        value, reference = getattr(got, field), getattr(expected, field)
+        assert value == pytest.approx(reference, rel=1e-3, abs=1e-3) or (math.isinf(value) and math.isinf(reference))
+    # both sample the peak, the batch on a grid rounded up to a power of two points
+    assert got.overshoot == pytest.approx(expected.overshoot, rel=5e-3, abs=0.05)
+
+
+@pytest.mark.parametrize("num, den, omega_L, beta_b", random_plants(30, seed=3))
+def test_evaluate_batch_matches_evaluate(num, den, omega_L, beta_b):
+    evaluator = LoopShapingEvaluator(num, den)
+    evaluations = evaluator.evaluate_batch(omega_L, beta_b)
+    assert len(evaluations) == len(omega_L)
+    for evaluation, w, b in zip(evaluations, omega_L, beta_b):
+        assert_same_evaluation(evaluation, evaluator.evaluate(w, b))
+
+
+def test_evaluate_many_uses_cache_and_keeps_order():
+    num, den, omega_L, beta_b = random_plants(1, seed=5)[0]
+    evaluator = LoopShapingEvaluator(num, den)
+    candidates = list(zip(omega_L, beta_b))
+    executor = EvaluationExecutor(mode="inline", cache=EvaluationCache())
+    # one design already cached, the other four are evaluated in a single batch
+    cached = asyncio.run(executor.evaluate(evaluator, *candidates[2]))
+    evaluations = asyncio.run(executor.evaluate_many(evaluator, candidates))
+    assert evaluations[2] is cached
+    for evaluation, (w, b) in zip(evaluations, candidates):
+        assert_same_evaluation(evaluation, evaluator.evaluate(w, b))
+    assert executor.cache.stats()['entries'] == len(candidates)
@@ -0,0 +1,119 @@
+import math
+
+import control as ctrl
+import numpy as np
+import pytest
+
+import util
+from evaluation.evaluator import DelayLoopShapingEvaluator, loop_coefficients
+
+# the exact delay is the limit of the Pade models; higher orders than this break down numerically in ctrl
+PADE_ORDER = 10
+# lightly damped delayed loop (omega_L tau = 1.35, phase margin 8.5 degrees), where low Pade orders are off
+LIGHTLY_DAMPED = (12.977, 8.553, [5.8412], [1, 0.55319], 0.10386)
+
+
+def pade_loop(omega_L, beta_b, num, den, tau, order=PADE_ORDER):
+    # the loop of util.loop_shaping with the delay folded into the plant as a Pade model
+    G = ctrl.TransferFunction(num, den) * ctrl.TransferFunction(*ctrl.pade(tau, order))
+    K_p = 1 / abs(np.polyval(num, 1j * omega_L) / np.polyval(den, 1j * omega_L))
+    return G * K_p * ctrl.TransferFunction([beta_b, omega_L], [math.sqrt(beta_b * beta_b + 1), 0])
+
+
+def pade_step_info(L, points=20001):
+    sys = ctrl.feedback(L, 1)
+    T = np.linspace(0, 1.5 * ctrl.step_response(sys).time[-1], points)
+    info = ctrl.step_info(sys, T=T)
+    return info['RiseTime'], info['SettlingTime'], info['Overshoot']
+
+
+def random_delayed_designs(count, seed=0):
+    # first-order plants, stable or not, with delays of 0.03 to 1 s and crossovers up to 3/tau
+    rng = np.random.default_rng(seed)
+    designs = []
+    for _ in range(count):
+        tau = 10 ** rng.uniform(-1.5, 0)
+        designs.append((rng.uniform(0.1, 3) / tau, 10 ** rng.uniform(-1, 1), [rng.uniform(0.5, 10)],
+                        [1, rng.uniform(-1, 5)], tau))
+    return designs
+
+
+@pytest.mark.parametrize("omega_L, beta_b, num, den, tau", random_delayed_designs(30))
+def test_matches_pade_model(omega_L, beta_b, num, den, tau):
+    evaluation = DelayLoopShapingEvaluator(num, den, tau).evaluate(omega_L, beta_b)
+    L = pade_loop(omega_L, beta_b, num, den, tau)
+    assert evaluation.is_stable == bool(np.all(ctrl.feedback(L, 1).poles().real < -0.01))
+    if not evaluation.is_stable:
+        return
+    gm, pm, _, _ = ctrl.margin(L)
+    assert evaluation.gain_margin == pytest.approx(gm, rel=1e-6)
+    assert evaluation.phase_margin == pytest.approx(pm, rel=1e-6)
+    rise_time, settling_time, overshoot = pade_step_info(L)
+    # a Pade model ripples around t = tau, which moves the 10% crossing of long delays by a few percent
+    assert evaluation.rise_time == pytest.approx(rise_time, rel=0.05)
+    assert evaluation.settling_time == pytest.approx(settling_time, rel=0.01)
+    assert evaluation.overshoot == pytest.approx(overshoot, abs=0.5)
+
+
+def simulate_delay_loop(num_L, den_L, tau, t_final, steps_per_delay=2000):
+    """
+    Unit step response of the unity feedback loop around L(s) exp(-tau s), integrated directly with Heun's method
+    on a fine grid: x' = A x + B e(t - tau), y = C x, e = 1 - y.
+    """
+    a = np.asarray(den_L, dtype=float) / den_L[0]
+    b = np.pad(np.asarray(num_L, dtype=float) / den_L[0], (len(a) - len(num_L), 0))
+    n = len(a) - 1
+    A = np.zeros((n, n))
+    A[0, :] = -a[1:]
+    A[np.arange(1, n), np.arange(n - 1)] = 1.0
+    C = b[1:] - b[0] * a[1:]
+    dt, delay = tau / steps_per_delay, steps_per_delay
+    y = np.zeros(int(t_final / dt))
+    x = np.zeros(n)
+    for i in range(len(y) - 1):
+        slope = A @ x
+        slope[0] += 1 - y[i - delay] if i >= delay else 0.0
+        predicted = A @ (x + dt * slope)
+        predicted[0] += 1 - y[i + 1 - delay] if i + 1 >= delay else 0.0
+        x = x + dt / 2 * (slope + predicted)
+        y[i + 1] = C @ x
+    return dt * np.arange(len(y)), y
+
+
+@pytest.mark.parametrize("omega_L, beta_b, num, den, tau", [
+    LIGHTLY_DAMPED,
+    # long delay, where the Pade models are least accurate in rise time
+    (2.5131, 2.8774, [5.6644], [1, 4.6104], 0.73983),
+])
+def test_matches_direct_simulation(omega_L, beta_b, num, den, tau):
+    evaluation = DelayLoopShapingEvaluator(num, den, tau).evaluate(omega_L, beta_b)
+    num_L, den_L = loop_coefficients(num, den, omega_L, beta_b)
+    t, y = simulate_delay_loop(num_L, den_L, tau, 3 * tau + 5 * evaluation.rise_time)
+    rise_time = t[np.argmax(y >= 0.9)] - t[np.argmax(y >= 0.1)]
+    assert evaluation.rise_time == pytest.approx(rise_time, abs=2 * t[1])
+    assert evaluation.overshoot == pytest.approx(100 * (y.max() - 1), abs=0.05)
+
+
+def test_pade_models_converge_to_exact_delay():
+    evaluation = DelayLoopShapingEvaluator(*LIGHTLY_DAMPED[2:]).evaluate(*LIGHTLY_DAMPED[:2])
+    errors = [abs(pade_step_info(pade_loop(*LIGHTLY_DAMPED, order=order))[2] - evaluation.overshoot)
+              for order in (2, 4, 6, 10)]
+    assert errors[0] > errors[1] > errors[2] > errors[3]
+    assert errors[3] < 0.01
+
+
+def test_util_delay_helpers():
+    omega_L, beta_b, num, den, tau = LIGHTLY_DAMPED
+    evaluation = DelayLoopShapingEvaluator(num, den, tau).evaluate(omega_L, beta_b)
+    assert util.loop_shaping_w_delay(omega_L, beta_b, num, den, tau) == (
+        evaluation.gain_margin, evaluation.phase_margin, evaluation.rise_time, evaluation.settling_time,
+        evaluation.overshoot, evaluation.steadystate_error)
+
+    # the same PI controller as K_num / K_den
+    K_p = 1 / abs(np.polyval(num, 1j * omega_L) / np.polyval(den, 1j * omega_L))
+    K_num, K_den = [K_p * beta_b, K_p * omega_L], [math.sqrt(beta_b * beta_b + 1), 0]
+    gm, pm, settling_time = util.performance_eval_w_delay(K_num, K_den, num, den, tau)
+    assert (gm, pm) == pytest.approx((evaluation.gain_margin, evaluation.phase_margin), rel=1e-9)
+    assert settling_time == pytest.approx(evaluation.settling_time, rel=1e-9)
+    # an unstable loop never settles
+    assert util.performance_eval_w_delay([10 * c for c in K_num], K_den, num, den, tau)[2] == 10e5
@@ -0,0 +1,77 @@
+import math
+
+import control as ctrl
+import numpy as np
+import pytest
+
+import util
+from evaluation.first_order import first_order_check_stability, first_order_loop_shaping, is_first_order
+
+
+def random_designs(count, seed=0):
+    # random plants K/(s+a), stable and unstable, with the loop-shaping parameters the LLM proposes
+    rng = np.random.default_rng(seed)
+    designs = []
+    while len(designs) < count:
+        num = [rng.uniform(0.1, 20)]
+        den = [1, rng.uniform(-2, 5)]
+        omega_L = 10 ** rng.uniform(-1, 1.5)
+        beta_b = 10 ** rng.uniform(-1.5, 1)
+        if util.check_stability(omega_L, beta_b, num, den):
+            designs.append((omega_L, beta_b, num, den))
+    return designs
+
+
+def dense_step_metrics(omega_L, beta_b, num, den, points=50001):
+    # reference step metrics on a fine grid, same definitions as ctrl.step_info
+    G = ctrl.TransferFunction(num, den)
+    K_p = 1 / abs(np.polyval(num, 1j * omega_L) / np.polyval(den, 1j * omega_L))
+    L = G * K_p * ctrl.TransferFunction([beta_b, omega_L], [math.sqrt(beta_b * beta_b + 1), 0])
+    sys = ctrl.feedback(L, 1)
+    t_final = 20 / min(abs(p.real) for p in sys.poles())
+    t, y = ctrl.step_response(sys, T=np.linspace(0, t_final, points))
+    final = 1.0
+    rise_time = t[np.argmax(y >= 0.9 * final)] - t[np.argmax(y >= 0.1 * final)]
+    outside = np.flatnonzero(np.abs(y - final) >= 0.02 * final)
+    settling_time = t[outside[-1] + 1] if len(outside) else 0.0
+    overshoot = max(0.0, 100. * (y.max() - final) / final)
+    return rise_time, settling_time, overshoot, t[1] - t[0]
+
+
+def test_is_first_order():
+    assert is_first_order([2], [1, 3])
+    assert is_first_order([0, 2], [0, 1, 3])
+    assert not is_first_order([1, 2], [1, 3])
+    assert not is_first_order([2], [1, 3, 2])
+
+
+@pytest.mark.parametrize("omega_L, beta_b, num, den", random_designs(40, seed=1))
+def test_stability_matches_generic_path(omega_L, beta_b, num, den):
+    assert first_order_check_stability(omega_L, beta_b, num, den) == util.check_stability(omega_L, beta_b, num, den)
+
+
+@pytest.mark.parametrize("omega_L, beta_b, num, den", random_designs(40))
+def test_loop_shaping_matches_generic_path(omega_L, beta_b, num, den):
+    gm, pm, _, _, overshoot, ess = util.loop_shaping(omega_L, beta_b, num, den)
+    got = first_order_loop_shaping(omega_L, beta_b, num, den)
+    assert got[0] == pytest.approx(gm, rel=1e-6) or (math.isinf(gm) and math.isinf(got[0]))
+    assert got[1] == pytest.approx(pm, rel=1e-6)
+    # util samples the response (50 points per oscillation period), the closed form finds the exact peak
+    assert got[4] == pytest.approx(overshoot, rel=5e-3, abs=0.05)
+    assert got[5] == pytest.approx(ess, abs=1e-9)
+
+
+@pytest.mark.parametrize("omega_L, beta_b, num, den", random_designs(40))
+def test_step_metrics_match_dense_reference(omega_L, beta_b, num, den):
+    rise_time, settling_time, overshoot, dt = dense_step_metrics(omega_L, beta_b, num, den)
+    _, _, got_rise, got_settling, got_overshoot, _ = first_order_loop_shaping(omega_L, beta_b, num, den)
+    assert got_rise == pytest.approx(rise_time, abs=2 * dt)
+    assert got_settling == pytest.approx(settling_time, abs=2 * dt)
+    assert got_overshoot == pytest.approx(overshoot, abs=1e-3)
+
+
+def test_settling_time_sees_a_brief_last_exit():
+    # the last excursion outside the settling band barely touches it and is easy to step over when sampling
+    omega_L, beta_b, num, den = 25.09, 0.1853, [19.1875], [1, -0.4381]
+    _, settling_time, _, dt = dense_step_metrics(omega_L, beta_b, num, den)
+    assert first_order_loop_shaping(omega_L, beta_b, num, den)[3] == pytest.approx(settling_time, abs=2 * dt)
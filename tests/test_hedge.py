@@ -0,0 +1,68 @@
+import asyncio
+
+from llm.base import LLM
+from llm.cache import CachedLLM, ResponseCache
+from llm.hedge import HedgedLLM, LatencyTracker, with_hedging
+from llm.tiering import ROUTING, TieredLLM, stage
+
+
+class SlowLLM(LLM):
+    # the first call stalls, later ones answer at once
+    engine = "fake"
+
+    def __init__(self, stall: float = 0.0):
+        super().__init__()
+        self.stall = stall
+        self.calls = 0
+
+    async def acomplete(self, prompt: str) -> str:
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.sleep(self.stall)
+        return "{}:{}".format(prompt, self.calls)
+
+
+def warm_tracker(latency=0.001):
+    tracker = LatencyTracker(min_samples=5)
+    for _ in range(5):
+        tracker.record(latency)
+    return tracker
+
+
+def test_cache_lookup_counts_a_miss_once():
+    cache = ResponseCache()
+    hedged = HedgedLLM(CachedLLM(SlowLLM(), cache), tracker=LatencyTracker())
+
+    assert asyncio.run(hedged.acomplete("a")) == "a:1"
+    assert (cache.memory_hits, cache.misses) == (0, 1)
+    assert asyncio.run(hedged.acomplete("a")) == "a:1"
+    assert (cache.memory_hits, cache.misses) == (1, 1)
+
+
+def test_hedge_wins_over_stalled_request_and_is_cached():
+    cache = ResponseCache()
+    model = SlowLLM(stall=5.0)
+    hedged = HedgedLLM(CachedLLM(model, cache), max_hedges=1, percentile=50, tracker=warm_tracker())
+
+    response = asyncio.run(asyncio.wait_for(hedged.acomplete("a"), 2))
+    assert response == "a:2"
+    assert (hedged.hedges, hedged.hedge_wins) == (1, 1)
+    assert cache.misses == 1
+    assert asyncio.run(hedged.acomplete("a")) == "a:2"
+    assert model.calls == 2
+
+
+def test_tiers_share_one_hedge_budget():
+    tiered = with_hedging(TieredLLM([SlowLLM(stall=0.3), SlowLLM(stall=0.3)], {ROUTING: 0},
+                                    validate=lambda response: True), max_hedges=1, percentile=50)
+    for model in tiered.models:
+        model.tracker = warm_tracker()
+
+    async def run():
+        with stage(ROUTING):
+            routed = await tiered.acomplete("a")
+        return routed, await tiered.acomplete("b")
+
+    # the cheap tier spends the session's only hedge, the capable tier waits for its stalled call
+    assert asyncio.run(run()) == ("a:2", "b:1")
+    assert [model.hedges for model in tiered.models] == [1, 0]
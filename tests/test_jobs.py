@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from api.jobs import JobManager
+from central_agent import CentralAgentLLM
+from job_store import JOB_CANCELLED, JOB_RUNNING, JOB_SUCCEEDED, JobStore
+from model.control_task import FinalTaskDesignResult, TaskDesignResult
+
+SPECS = {'num': [2.0], 'den': [1.0, 3.0], 'phase_margin_min': 45, 'settling_time_min': 0, 'settling_time_max': 5,
+         'steadystate_error_max': 0.01, 'scenario': 'test'}
+
+
+def design_round(n):
+    return TaskDesignResult(success=False, parameters={'omega_L': n}, performance={}, conversation_round=n)
+
+
+class EndlessAgent:
+    # publishes a round every few milliseconds and never finishes by itself
+    is_success = False
+
+    def __init__(self):
+        self.rounds = 0
+
+    def checkpoint(self):
+        return {'rounds': self.rounds}
+
+    def restore(self, state):
+        self.rounds = state['rounds']
+
+    async def handle_task(self, result_chan):
+        while True:
+            self.rounds += 1
+            result_chan.put_nowait(design_round(self.rounds))
+            await asyncio.sleep(0.005)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"))
+
+
+def routed_job(store, owner="other", lease=30):
+    job_id = store.create(SPECS, owner, lease)
+    store.set_routing(job_id, 1, "test agent", "requirement")
+    return job_id
+
+
+def test_cancelled_job_stays_cancelled(store):
+    job_id = routed_job(store, lease=0)
+    assert store.finish(job_id, JOB_CANCELLED)
+    # the owner has not noticed yet and stores another round, then its final status
+    assert not store.save_round(job_id, 0, design_round(1).model_dump(), {'rounds': 1})
+    assert not store.finish(job_id, JOB_SUCCEEDED, {'is_success': True})
+    job = store.get(job_id)
+    assert job['status'] == JOB_CANCELLED and job['final'] is None
+    assert store.rounds(job_id) == []
+    assert job_id not in store.expired()
+    assert not store.claim(job_id, "another", 30)
+
+
+def test_save_round_keeps_active_job_running(store):
+    job_id = routed_job(store)
+    assert store.save_round(job_id, 0, design_round(1).model_dump(), {'rounds': 1})
+    assert store.get(job_id)['status'] == JOB_RUNNING
+    assert store.get(job_id)['checkpoint'] == {'rounds': 1}
+    assert [seq for seq, _ in store.rounds(job_id)] == [0]
+
+
+def test_subscribe_follows_job_of_another_worker(store):
+    job_id = routed_job(store)
+    manager = JobManager(store, poll_interval=0.01)
+
+    async def other_worker():
+        for seq in range(3):
+            await asyncio.sleep(0.03)
+            store.save_round(job_id, seq, design_round(seq + 1).model_dump(mode="json"), {'rounds': seq + 1})
+        store.finish(job_id, JOB_SUCCEEDED, {'is_success': True, 'msg': 'done', 'final_result': None})
+
+    async def follow():
+        worker = asyncio.create_task(other_worker())
+        seen = [item.conversation_round async for item in manager.subscribe(job_id, since=1)]
+        await worker
+        return seen, (await manager.status(job_id)).status
+
+    # the subscription lasts until the job finishes instead of ending with the rounds stored so far
+    assert asyncio.run(follow()) == ([2, 3], JOB_SUCCEEDED)
+
+
+def test_run_stops_when_cancelled_by_another_worker(store, monkeypatch):
+    monkeypatch.setattr(CentralAgentLLM, "_create_agent", staticmethod(lambda *args: EndlessAgent()))
+    manager = JobManager(store, worker_id="owner")
+
+    async def run():
+        job_id = routed_job(store, owner="owner")
+        manager._start(job_id)
+        task = manager.runs[job_id].task
+        await asyncio.sleep(0.05)
+        store.finish(job_id, JOB_CANCELLED)
+        await asyncio.wait([task], timeout=1)
+        return job_id, task.done()
+
+    job_id, stopped = asyncio.run(run())
+    assert stopped
+    rounds = len(store.rounds(job_id))
+    assert rounds > 0
+    assert store.get(job_id)['status'] == JOB_CANCELLED
+    assert store.get(job_id)['checkpoint'] == {'rounds': rounds}
+
+
+def test_cancel_stops_local_run(store, monkeypatch):
+    monkeypatch.setattr(CentralAgentLLM, "_create_agent", staticmethod(lambda *args: EndlessAgent()))
+    manager = JobManager(store, worker_id="owner")
+
+    async def run():
+        job_id = routed_job(store, owner="owner")
+        manager._start(job_id)
+        task = manager.runs[job_id].task
+        await asyncio.sleep(0.03)
+        subscription = manager.subscribe(job_id)
+        first = await subscription.__anext__()
+        assert await manager.cancel(job_id)
+        rest = [item async for item in subscription]
+        return job_id, task.done(), first, rest
+
+    job_id, stopped, first, rest = asyncio.run(run())
+    assert stopped and isinstance(first, TaskDesignResult)
+    assert not any(isinstance(item, FinalTaskDesignResult) for item in rest)
+    assert store.get(job_id)['status'] == JOB_CANCELLED
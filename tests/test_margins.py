@@ -0,0 +1,72 @@
+import logging
+import math
+
+import numpy as np
+import pytest
+
+from evaluation.evaluator import loop_coefficients
+from evaluation.margins import margins, margins_batch, validate_margins
+
+
+def random_loops(count, seed=0):
+    # PI and PI-lead loops on first to fourth order plants, stable or not, some with a zero
+    rng = np.random.default_rng(seed)
+    loops = []
+    for index in range(count):
+        den = list(np.poly(-rng.uniform(-0.5, 5, rng.integers(1, 5))))
+        num = [1, rng.uniform(0.2, 5)] if index % 4 == 0 else [rng.uniform(0.5, 10)]
+        omega_L = 10 ** rng.uniform(-1, 1.3)
+        beta_l = 10 ** rng.uniform(-1, 1) if index % 3 == 0 else "NA"
+        num_L, den_L = loop_coefficients(num, den, omega_L, 10 ** rng.uniform(-1.5, 1), beta_l)
+        loops.append((num_L, den_L, omega_L))
+    return loops
+
+
+LOOPS = random_loops(200)
+
+
+def test_loops_cover_both_margins():
+    # a PI loop on a first or second order plant has no phase crossover, higher orders do
+    finite = sum(math.isfinite(margins(num_L, den_L, omega_hint=omega_L)[0]) for num_L, den_L, omega_L in LOOPS)
+    assert 50 < finite < len(LOOPS)
+
+
+@pytest.mark.parametrize("num_L, den_L, omega_L", LOOPS)
+def test_margins_match_ctrl_margin(num_L, den_L, omega_L):
+    # gain margin, phase margin and both crossover frequencies
+    assert validate_margins(num_L, den_L, margins(num_L, den_L, omega_hint=omega_L))
+
+
+@pytest.mark.parametrize("width", sorted({len(den_L) for _, den_L, _ in LOOPS}))
+def test_margins_batch_match_ctrl_margin(width):
+    # rows of a batch share one loop order, numerators are padded with leading zeros
+    loops = [loop for loop in LOOPS if len(loop[1]) == width]
+    num_rows = np.array([np.pad(num_L, (width - len(num_L), 0)) for num_L, _, _ in loops])
+    result = margins_batch(num_rows, np.array([den_L for _, den_L, _ in loops]),
+                           omega_hint=[omega_L for _, _, omega_L in loops])
+    for i, (num_L, den_L, _) in enumerate(loops):
+        computed = (result['gain_margin'][i], result['phase_margin'][i], result['phase_crossover'][i],
+                    result['gain_crossover'][i])
+        assert validate_margins(num_L, den_L, computed)
+
+
+def test_validation_logs_disagreement(caplog):
+    num_L, den_L, omega_L = LOOPS[1]
+    gm, pm, wg, wp = margins(num_L, den_L, omega_hint=omega_L)
+    with caplog.at_level(logging.WARNING):
+        assert not validate_margins(num_L, den_L, (gm, pm + 1, wg, wp))
+    assert "Margin mismatch" in caplog.text
+
+
+def test_validate_mode(monkeypatch):
+    num_L, den_L, omega_L = LOOPS[1]
+    checked = []
+    monkeypatch.setattr("evaluation.margins.validate_margins", lambda *args: checked.append(args))
+    margins(num_L, den_L, omega_hint=omega_L)
+    assert not checked
+    monkeypatch.setenv("MARGIN_VALIDATE", "1")
+    computed = margins(num_L, den_L, omega_hint=omega_L)
+    assert checked and checked[0][2] == computed
+    # loops with a delay are never validated, ctrl.margin only sees rational loops
+    margins(num_L, den_L, omega_hint=omega_L, tau=0.1)
+    assert len(checked) == 1
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from api.progress import COALESCE, DROP, ProgressChannel
+from model.control_task import DesignTextDelta, ProgressHeartbeat, TaskDesignResult
+
+
+def result(n, agent=None):
+    return TaskDesignResult(success=False, parameters={'omega_L': n}, performance={}, conversation_round=n,
+                            agent=agent)
+
+
+def final():
+    return TaskDesignResult(success=True, parameters={}, performance={}, conversation_round=-1)
+
+
+def delta(text, n=1, agent=None):
+    return DesignTextDelta(text=text, conversation_round=n, agent=agent)
+
+
+def drain(chan):
+    async def collect():
+        chan.close()
+        return [item async for item in chan]
+    return asyncio.run(collect())
+
+
+def test_buffer_below_maxsize_keeps_everything():
+    chan = ProgressChannel(maxsize=4, overflow=DROP, heartbeat=0)
+    items = [result(1), delta("a"), result(2)]
+    for item in items:
+        chan.put_nowait(item)
+    assert drain(chan) == items
+    assert chan.dropped == 0
+
+
+def test_drop_policy_drops_oldest():
+    chan = ProgressChannel(maxsize=3, overflow=DROP, heartbeat=0)
+    for n in range(1, 6):
+        chan.put_nowait(result(n))
+    assert [item.conversation_round for item in drain(chan)] == [3, 4, 5]
+    assert chan.dropped == 2
+
+
+def test_coalesce_merges_text_of_same_round_and_agent():
+    chan = ProgressChannel(maxsize=2, overflow=COALESCE, heartbeat=0)
+    chan.put_nowait(delta("Hel", agent="a"))
+    chan.put_nowait(delta("x", agent="b"))
+    chan.put_nowait(delta("lo", agent="a"))
+    chan.put_nowait(delta("y", agent="b"))
+    items = drain(chan)
+    assert [(item.agent, item.text) for item in items] == [("a", "Hello"), ("b", "xy")]
+    # merged text loses nothing
+    assert chan.dropped == 0
+
+
+def test_coalesce_keeps_text_of_other_rounds_apart():
+    chan = ProgressChannel(maxsize=2, overflow=COALESCE, heartbeat=0)
+    chan.put_nowait(delta("a", n=1))
+    chan.put_nowait(delta("b", n=2))
+    chan.put_nowait(delta("c", n=3))
+    # nothing to merge with, so the oldest message makes room
+    assert [item.text for item in drain(chan)] == ["b", "c"]
+    assert chan.dropped == 1
+
+
+def test_coalesce_replaces_result_of_same_agent():
+    chan = ProgressChannel(maxsize=2, overflow=COALESCE, heartbeat=0)
+    chan.put_nowait(result(1, agent="a"))
+    chan.put_nowait(result(1, agent="b"))
+    chan.put_nowait(result(2, agent="a"))
+    items = drain(chan)
+    assert [(item.agent, item.conversation_round) for item in items] == [("b", 1), ("a", 2)]
+    assert chan.dropped == 1
+
+
+@pytest.mark.parametrize("overflow", [COALESCE, DROP])
+def test_final_marker_is_never_dropped(overflow):
+    chan = ProgressChannel(maxsize=2, overflow=overflow, heartbeat=0)
+    chan.put_nowait(result(1, agent="a"))
+    chan.put_nowait(final())
+    for n in range(2, 10):
+        chan.put_nowait(result(n, agent="b"))
+    items = drain(chan)
+    assert sum(item.conversation_round == -1 for item in items) == 1
+    assert len(items) == 2
+
+
+def test_final_marker_is_buffered_beyond_maxsize():
+    chan = ProgressChannel(maxsize=2, overflow=DROP, heartbeat=0)
+    chan.put_nowait(result(1))
+    chan.put_nowait(result(2))
+    chan.put_nowait(final())
+    assert [item.conversation_round for item in drain(chan)] == [1, 2, -1]
+    assert chan.dropped == 0
+
+
+def test_heartbeat_while_idle_reports_dropped():
+    chan = ProgressChannel(maxsize=1, overflow=DROP, heartbeat=0.01)
+
+    async def run():
+        chan.put_nowait(result(1))
+        chan.put_nowait(result(2))
+        received = []
+        async for item in chan:
+            received.append(item)
+            if sum(isinstance(seen, ProgressHeartbeat) for seen in received) == 2:
+                chan.put_nowait(final())
+                chan.close()
+        return received
+
+    received = asyncio.run(asyncio.wait_for(run(), 5))
+    assert received[0].conversation_round == 2
+    assert [item.dropped for item in received[1:3]] == [1, 1]
+    assert received[-1].conversation_round == -1
+
+
+def test_no_heartbeat_when_disabled():
+    chan = ProgressChannel(maxsize=4, heartbeat=0)
+
+    async def run():
+        async def late_close():
+            await asyncio.sleep(0.05)
+            chan.put_nowait(result(1))
+            chan.close()
+        closer = asyncio.create_task(late_close())
+        received = [item async for item in chan]
+        await closer
+        return received
+
+    assert [type(item) for item in asyncio.run(run())] == [TaskDesignResult]
+
+
+def test_closed_channel_ignores_new_messages():
+    chan = ProgressChannel(maxsize=4, heartbeat=0)
+    chan.put_nowait(result(1))
+    chan.close()
+    chan.put_nowait(result(2))
+    assert [item.conversation_round for item in drain(chan)] == [1]
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        ProgressChannel(overflow="block")
+
+
+def test_defaults_from_environment(monkeypatch):
+    monkeypatch.setenv("PROGRESS_BUFFER", "5")
+    monkeypatch.setenv("PROGRESS_OVERFLOW", DROP)
+    monkeypatch.setenv("PROGRESS_HEARTBEAT", "2.5")
+    chan = ProgressChannel()
+    assert (chan.maxsize, chan.overflow, chan.heartbeat) == (5, DROP, 2.5)
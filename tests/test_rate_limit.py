@@ -0,0 +1,199 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from llm.rate_limit import (DEFAULT_RETRY_AFTER, ROUTING_PRIORITY, RateLimiter, parse_duration, priority,
+                            retry_after_seconds)
+
+
+class FakeClock:
+    # virtual time that moves only when a caller sleeps
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def state(rate_limiter):
+    # a copy of the bucket state, after every pending update
+    return rate_limiter._transact(dict)
+
+
+async def acquire_all(rate_limiter, clock, names, granted, tokens=0, hold=False):
+    async def one(name):
+        await rate_limiter.acquire(tokens)
+        granted.append((name, clock()))
+        if not hold:
+            rate_limiter.release()
+
+    tasks = []
+    for name in names:
+        if name.startswith("routing"):
+            with priority(ROUTING_PRIORITY):
+                tasks.append(asyncio.create_task(one(name)))
+        else:
+            tasks.append(asyncio.create_task(one(name)))
+    return tasks
+
+
+def test_request_bucket_paces_calls():
+    clock = FakeClock()
+    rate_limiter = limiter(clock, requests_per_minute=60)
+    start = clock()
+
+    async def run():
+        granted = []
+        await asyncio.gather(*await acquire_all(rate_limiter, clock, ["design"] * 65, granted))
+        return [at - start for _, at in granted]
+
+    times = run_async(run())
+    # a full bucket of 60 at once, then one per second
+    assert times[:60] == [0.0] * 60
+    assert times[64] == pytest.approx(5.0, abs=0.1)
+
+
+def test_priority_order():
+    clock = FakeClock()
+    rate_limiter = limiter(clock, requests_per_minute=1)
+
+    async def run():
+        await rate_limiter.acquire()
+        rate_limiter.release()
+        granted = []
+        # the bucket is empty, so everybody queues; routing calls jump the queue
+        await asyncio.gather(*await acquire_all(rate_limiter, clock, ["design 1", "design 2", "routing"], granted))
+        return [name for name, _ in granted]
+
+    assert run_async(run()) == ["routing", "design 1", "design 2"]
+
+
+def test_concurrency_cap():
+    clock = FakeClock()
+    rate_limiter = limiter(clock, max_concurrency=2)
+
+    async def run():
+        granted = []
+        tasks = await acquire_all(rate_limiter, clock, ["a", "b", "c", "d"], granted, hold=True)
+        for _ in range(20):
+            await asyncio.sleep(0)
+        first = [name for name, _ in granted]
+        rate_limiter.release()
+        for _ in range(20):
+            await asyncio.sleep(0)
+        second = [name for name, _ in granted]
+        rate_limiter.release()
+        rate_limiter.release()
+        rate_limiter.release()
+        await asyncio.gather(*tasks)
+        return first, second
+
+    first, second = run_async(run())
+    assert first == ["a", "b"]
+    assert second == ["a", "b", "c"]
+
+
+def test_token_bucket_and_correction():
+    clock = FakeClock()
+    rate_limiter = limiter(clock, tokens_per_minute=6000)
+
+    async def run():
+        await rate_limiter.acquire(5000)
+        # 4000 of the 5000 reserved tokens were not used
+        rate_limiter.release(5000, used_tokens=1000)
+        start = clock()
+        await rate_limiter.acquire(5000)
+        rate_limiter.release()
+        return clock() - start
+
+    assert run_async(run()) == 0.0
+    assert state(rate_limiter)['tokens'] == pytest.approx(0.0)
+
+
+def test_adapts_to_response_headers():
+    clock = FakeClock()
+    rate_limiter = limiter(clock)
+    rate_limiter.update_from_headers({"x-ratelimit-limit-requests": "120", "x-ratelimit-remaining-requests": "0",
+                                      "x-ratelimit-limit-tokens": "90000", "x-ratelimit-remaining-tokens": "500"})
+    assert state(rate_limiter)['rpm'] == 120 and state(rate_limiter)['requests'] == 0
+    assert state(rate_limiter)['tpm'] == 90000 and state(rate_limiter)['tokens'] == 500
+
+    async def run():
+        start = clock()
+        await rate_limiter.acquire()
+        rate_limiter.release()
+        return clock() - start
+
+    # the API reported no request left; one refills in 60 / 120 seconds
+    assert run_async(run()) == pytest.approx(0.5, abs=0.05)
+
+
+def test_pause_after_rate_limit_error():
+    clock = FakeClock()
+    rate_limiter = limiter(clock)
+
+    async def run(retry_after):
+        rate_limiter.on_rate_limited(retry_after)
+        start = clock()
+        await rate_limiter.acquire()
+        rate_limiter.release()
+        return clock() - start
+
+    assert run_async(run(3.0)) == pytest.approx(3.0, abs=0.05)
+    assert run_async(run(None)) == pytest.approx(DEFAULT_RETRY_AFTER, abs=0.05)
+
+
+def test_retry_after_seconds():
+    def error(**headers):
+        return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+    assert retry_after_seconds(error(**{"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(error(**{"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(error(**{"x-ratelimit-reset-requests": "1m30s"})) == 90.0
+    assert retry_after_seconds(error()) is None
+    assert retry_after_seconds(Exception()) is None
+    assert parse_duration("20ms") == pytest.approx(0.02)
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "rate_limit.sqlite")
+    first = limiter(clock, requests_per_minute=2, path=path)
+    second = limiter(clock, requests_per_minute=2, path=path)
+
+    async def run():
+        granted = []
+        start = clock()
+        tasks = await acquire_all(first, clock, ["first"] * 2, granted)
+        tasks += await acquire_all(second, clock, ["second"], granted)
+        await asyncio.gather(*tasks)
+        return [at - start for _, at in granted]
+
+    # two workers share one bucket of two requests, so the third call waits 30 s for a refill; queued callers
+    # keep polling (and moving the virtual clock) while a transaction runs on the state thread
+    times = sorted(run_async(run()))
+    assert times[1] < 29.0 <= times[2]
+    # a pause set by one worker holds the other back too
+    first.on_rate_limited(5.0)
+    state(first)
+
+    async def paused():
+        start = clock()
+        await second.acquire()
+        second.release()
+        return clock() - start
+
+    assert run_async(paused()) >= 5.0
+
+
+def run_async(coroutine):
+    return asyncio.run(coroutine)
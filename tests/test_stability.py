@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from evaluation.stability import STABILITY_MARGIN, batch_roots, is_stable, routh_hurwitz_batch
+
+
+def random_polynomials(count, seed=0):
+    # polynomials of degree 1 to 6 from real roots and complex pairs, none within 1e-3 of the stability boundary
+    rng = np.random.default_rng(seed)
+    polynomials = []
+    while len(polynomials) < count:
+        roots = []
+        for _ in range(rng.integers(1, 4)):
+            real = rng.uniform(-5, 1)
+            if abs(real + STABILITY_MARGIN) < 1e-3:
+                continue
+            if rng.random() < 0.4:
+                roots.append(real)
+            else:
+                imag = rng.uniform(0.1, 5)
+                roots += [complex(real, imag), complex(real, -imag)]
+        if roots:
+            polynomials.append(rng.uniform(-3, 3) * np.real(np.poly(roots)))
+    return polynomials
+
+
+def roots_stable(coeffs, margin=STABILITY_MARGIN):
+    return bool(np.all(np.roots(coeffs).real < -margin))
+
+
+@pytest.mark.parametrize("margin", [0.0, STABILITY_MARGIN, 0.5])
+def test_matches_root_real_parts(margin):
+    polynomials = random_polynomials(300)
+    expected = [roots_stable(p, margin) for p in polynomials]
+    assert 50 < sum(expected) < 250
+    assert [is_stable(p, margin) for p in polynomials] == expected
+    for degree in range(1, 7):
+        rows = [i for i, p in enumerate(polynomials) if len(p) == degree + 1]
+        if rows:
+            batch = routh_hurwitz_batch(np.array([polynomials[i] for i in rows]), margin)
+            assert list(batch) == [expected[i] for i in rows]
+
+
+@pytest.mark.parametrize("coeffs, margin, stable", [
+    # roots on the imaginary axis, at the origin and exactly on the shifted boundary are not stable
+    (np.poly([1j, -1j, -1]), 0.0, False),
+    (np.poly([0, -1, -2]), 0.0, False),
+    (np.poly([-STABILITY_MARGIN, -1]), STABILITY_MARGIN, False),
+    # only the margin shift rejects a slow pole
+    (np.poly([-0.005, -1]), 0.0, True),
+    (np.poly([-0.005, -1]), STABILITY_MARGIN, False),
+    (np.poly([-0.02 + 3j, -0.02 - 3j]), STABILITY_MARGIN, True),
+    (np.poly([-0.005 + 3j, -0.005 - 3j]), STABILITY_MARGIN, False),
+    # sign of the leading coefficient and leading zeros do not matter
+    (-np.poly([-1, -2, -3]), STABILITY_MARGIN, True),
+    ([0, 0, 1, 3, 2], STABILITY_MARGIN, True),
+    ([0, 1, -3, 2], STABILITY_MARGIN, False),
+    ([3], STABILITY_MARGIN, True),
+])
+def test_marginal_cases(coeffs, margin, stable):
+    assert is_stable(coeffs, margin) == stable
+    assert routh_hurwitz_batch([coeffs], margin)[0] == stable
+
+
+def test_batch_with_leading_zero_rows():
+    rows = np.array([[0, 0, 1, 3, 2], [0, 1, 6, 11, 6], [1, 2, 3, 4, 5], [0, 0, 0, 0, 0], np.poly([-1, -2, -3, -4])])
+    assert list(routh_hurwitz_batch(rows)) == [True, True, False, False, True]
+    assert not is_stable([0, 0, 0])
+
+
+def test_batch_roots_match_np_roots():
+    polynomials = [p for p in random_polynomials(200, seed=1) if len(p) == 5]
+    rows = np.array(polynomials + [[0, 1, 6, 11, 6]])
+    roots = batch_roots(rows)
+    for row, found in zip(rows, roots):
+        expected = np.roots(row)
+        assert np.sum(~np.isnan(found)) == len(expected)
+        for root in expected:
+            assert np.nanmin(np.abs(found - root)) < 1e-6 * max(1.0, abs(root))
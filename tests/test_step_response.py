@@ -0,0 +1,83 @@
+import math
+
+import control as ctrl
+import numpy as np
+import pytest
+
+from evaluation.evaluator import loop_coefficients
+from evaluation.stability import is_stable
+from evaluation.step_response import step_metrics, step_metrics_batch
+
+# the fast first-order scenario of test.http, settling_time_max = 0.1395
+FAST_PLANT = ([6.320967437802861], [1, 7.289934314716213])
+
+
+def closed_loop(num, den, omega_L, beta_b):
+    # unity feedback around the PI loop-shaping design, as num_L / (den_L + num_L)
+    num_L, den_L = loop_coefficients(num, den, omega_L, beta_b)
+    return num_L, np.polyadd(den_L, num_L)
+
+
+def random_loops(count, seed=0):
+    # stable closed loops of first to third order plants under the PI controller
+    rng = np.random.default_rng(seed)
+    loops = []
+    while len(loops) < count:
+        den = list(np.poly(-rng.uniform(-0.5, 5, rng.integers(1, 4))))
+        num = [rng.uniform(0.5, 10)]
+        num_cl, den_cl = closed_loop(num, den, 10 ** rng.uniform(-1, 1.3), 10 ** rng.uniform(-1.5, 1))
+        if is_stable(den_cl):
+            loops.append((num_cl, den_cl))
+    return loops
+
+
+def step_info_reference(num, den, points=20001):
+    """
+    ctrl.step_info on a fine grid over its own horizon. On its default grid step_info is only accurate to about
+    one of its sample intervals, and lightly damped loops can slip through between samples, so the default
+    result is off by a few percent for some loops.
+    """
+    sys = ctrl.TransferFunction(num, den)
+    t_final = ctrl.step_response(sys).time[-1]
+    T = np.linspace(0, 1.5 * t_final, points)
+    info = ctrl.step_info(sys, T=T)
+    return info['RiseTime'], info['SettlingTime'], info['Overshoot'], T[1]
+
+
+def assert_matches_step_info(metrics, reference):
+    rise_time, settling_time, overshoot, dt = reference
+    assert metrics[0] == pytest.approx(rise_time, rel=1e-3, abs=2 * dt)
+    assert metrics[1] == pytest.approx(settling_time, rel=1e-3, abs=2 * dt)
+    assert metrics[2] == pytest.approx(overshoot, rel=1e-3, abs=0.05)
+
+
+@pytest.mark.parametrize("num, den", random_loops(30))
+def test_step_metrics_match_step_info(num, den):
+    assert_matches_step_info(step_metrics(num, den), step_info_reference(num, den))
+
+
+def test_step_metrics_batch_match_step_info():
+    # rows of a batch share one order
+    loops = [loop for loop in random_loops(30, seed=1) if len(loop[1]) == 4]
+    rise, settling, overshoot = step_metrics_batch([num for num, _ in loops], [den for _, den in loops])
+    for i, (num, den) in enumerate(loops):
+        assert_matches_step_info((rise[i], settling[i], overshoot[i]), step_info_reference(num, den))
+
+
+def test_lightly_damped_loop():
+    # poles at -0.017 +- 2.8j: step_info's default grid misses the last exit from the band by 13 of its samples
+    num, den = closed_loop([1.5022], [1.0, 6.787063, 10.757723, 4.217413], 2.7987, 6.5749)
+    assert_matches_step_info(step_metrics(num, den), step_info_reference(num, den))
+
+
+@pytest.mark.parametrize("omega_L", [1e-3, 0.1, 40, 100, 1e4])
+def test_fast_and_slow_loops_settle(omega_L):
+    num, den = closed_loop(*FAST_PLANT, omega_L, 1.0)
+    metrics = step_metrics(num, den)
+    assert all(math.isfinite(m) for m in metrics)
+    assert_matches_step_info(metrics, step_info_reference(num, den))
+
+
+def test_fast_scenario_is_reachable():
+    num, den = closed_loop(*FAST_PLANT, 100, 1.0)
+    assert step_metrics(num, den)[1] < 0.139522084529487
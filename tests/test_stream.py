@@ -0,0 +1,90 @@
+import json
+import random
+
+import pytest
+
+from llm.stream import IncrementalJSONParser
+
+RESPONSE = json.dumps({
+    "analysis": "The \"phase\" margin is low: {raise} it, see C:\\path and [brackets], \u00e9\u2713",
+    "nested": {"candidates": [[1.0, 2.0], {"parameter": [9, 9]}], "note": "}]"},
+    "parameter": [12.5, 0.75],
+    "design": "PI with \\\"boost\\\"",
+    "count": -3,
+    "flag": True,
+    "empty": None,
+})
+
+
+def feed_in_chunks(text, fields, sizes):
+    parser = IncrementalJSONParser(fields)
+    position, done_at = 0, None
+    for size in sizes:
+        chunk = text[position:position + size]
+        if not chunk:
+            break
+        position += len(chunk)
+        if parser.feed(chunk) and done_at is None:
+            done_at = position
+    return parser, done_at
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(RESPONSE)])
+def test_values_split_across_chunks(size):
+    fields = ["analysis", "nested", "parameter", "design", "count", "flag", "empty"]
+    parser, _ = feed_in_chunks(RESPONSE, fields, [size] * len(RESPONSE))
+    assert parser.fields == json.loads(RESPONSE)
+
+
+def test_random_chunking():
+    rng = random.Random(0)
+    expected = json.loads(RESPONSE)
+    for _ in range(200):
+        parser, _ = feed_in_chunks(RESPONSE, list(expected), [rng.randint(1, 9) for _ in range(len(RESPONSE))])
+        assert parser.fields == expected
+
+
+def test_only_top_level_fields():
+    # "parameter" inside "nested" is not the top-level field
+    parser, _ = feed_in_chunks(RESPONSE, ["parameter"], [1] * len(RESPONSE))
+    assert parser.fields == {"parameter": [12.5, 0.75]}
+
+
+def test_complete_as_soon_as_fields_are_parsed():
+    parser, done_at = feed_in_chunks(RESPONSE, ["parameter"], [1] * len(RESPONSE))
+    assert parser.complete
+    # the list ends at its closing bracket, well before the rest of the response
+    assert RESPONSE[:done_at].endswith('"parameter": [12.5, 0.75]')
+    assert not IncrementalJSONParser(["missing"]).feed(RESPONSE)
+
+
+def test_number_ends_at_comma_or_brace():
+    parser = IncrementalJSONParser(["a", "b"])
+    assert not parser.feed('{"a": 1')
+    assert parser.fields == {}
+    assert not parser.feed('2, "b": 3')
+    assert parser.fields == {"a": 12}
+    assert parser.feed('4}')
+    assert parser.fields == {"a": 12, "b": 34}
+
+
+def test_keeps_only_unparsed_tail():
+    parser = IncrementalJSONParser(["design"])
+    parser.feed('{"analysis": "' + "x" * 10000)
+    # an unwanted value is never kept
+    assert sum(map(len, parser._chunks)) == 0
+    parser.feed('", "design": ')
+    assert sum(map(len, parser._chunks)) == 0
+    parser.feed('"' + "y" * 5000)
+    # a wanted value is kept from the chunk it starts in, chunks are never copied
+    assert sum(map(len, parser._chunks)) == 5001
+    parser.feed('", "rest": [' + "1, " * 1000 + '1]}')
+    assert parser.fields == {"design": "y" * 5000}
+    assert sum(map(len, parser._chunks)) == 0
+
+
+def test_key_split_across_chunks():
+    parser = IncrementalJSONParser(["parameter"])
+    for chunk in ['{"para', 'm', 'eter"', ' : ', '[1,', ' 2]', '}']:
+        parser.feed(chunk)
+    assert parser.fields == {"parameter": [1, 2]}
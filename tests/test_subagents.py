@@ -0,0 +1,70 @@
+import asyncio
+import gc
+import math
+
+import pytest
+
+import central_agent  # noqa: F401, registers the sub-agents
+import util
+from model.control_task import TaskSpecs
+from subagents.first_ord_stable import first_ord_stable_Design
+
+SPECS = {'phase_margin_min': 45, 'settling_time_min': 0, 'settling_time_max': 5, 'steadystate_error_max': 0.01,
+         'scenario': 'test'}
+
+
+def first_order_agent(num, den):
+    specs = TaskSpecs(num=num, den=den, **SPECS)
+    return first_ord_stable_Design(specs, specs.construct_thresholds(), "", specs.scenario)
+
+
+@pytest.mark.parametrize("omega_L, beta_b", [(1.0, 1.0), (3.0, 0.5), (0.5, 4.0)])
+def test_evaluator_keeps_plant_zero(omega_L, beta_b):
+    # (s+2)/(s+3) must not be scored as 1/(s+3)
+    num, den = [1.0, 2.0], [1.0, 3.0]
+    evaluation = first_order_agent(num, den).evaluator.evaluate(omega_L, beta_b)
+    _, phase_margin, _, settling_time, _, steadystate_error = util.loop_shaping(omega_L, beta_b, num, den)
+    _, leading_only, _, _, _, _ = util.loop_shaping(omega_L, beta_b, num[:1], den)
+    assert evaluation.is_stable
+    assert evaluation.phase_margin == pytest.approx(phase_margin, rel=1e-6)
+    assert not math.isclose(evaluation.phase_margin, leading_only, rel_tol=1e-3)
+    assert evaluation.settling_time == pytest.approx(settling_time, rel=1e-3)
+    assert evaluation.steadystate_error == pytest.approx(steadystate_error, abs=1e-9)
+
+
+class FailingAgent(first_ord_stable_Design):
+    async def handle_one_iter_design(self):
+        # fails shortly after it starts, or while it is being cancelled
+        try:
+            await asyncio.sleep(0.005)
+        finally:
+            raise RuntimeError("design round failed")
+
+
+def run_speculation(keep):
+    agent = FailingAgent(TaskSpecs(num=[2.0], den=[1.0, 3.0], **SPECS), {}, "", "test")
+    unhandled = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        agent.speculate()
+        await asyncio.sleep(0)
+        if keep:
+            with pytest.raises(RuntimeError):
+                await agent.next_round()
+        else:
+            agent.cancel_speculation()
+            await asyncio.sleep(0.01)
+        gc.collect()
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    return unhandled
+
+
+def test_discarded_failed_speculation_is_not_reported_unhandled():
+    assert run_speculation(keep=False) == []
+
+
+def test_kept_failed_speculation_raises_in_next_round():
+    assert run_speculation(keep=True) == []
@@ -0,0 +1,34 @@
+import math
+
+from model.control_task import TaskSpecs
+from util import meets_thresholds, threshold_violation
+
+THRESHOLDS = TaskSpecs(num=[1], den=[1, 1], phase_margin_min=45, settling_time_min=1, settling_time_max=5,
+                       steadystate_error_max=0.01, scenario="test").construct_thresholds()
+
+
+def performance(phase_margin=60.0, settling_time=3.0, steadystate_error=0.0):
+    return {'phase_margin': phase_margin, 'settling_time_min': settling_time, 'settling_time_max': settling_time,
+            'steadystate_error': steadystate_error}
+
+
+def test_meets_thresholds():
+    assert meets_thresholds(performance(), THRESHOLDS)
+    assert meets_thresholds(performance(phase_margin=45.0, settling_time=5.0), THRESHOLDS)
+    assert not meets_thresholds(performance(phase_margin=44.0), THRESHOLDS)
+    assert not meets_thresholds(performance(settling_time=0.5), THRESHOLDS)
+    assert not meets_thresholds(performance(settling_time=6.0), THRESHOLDS)
+    assert not meets_thresholds(performance(steadystate_error=0.1), THRESHOLDS)
+
+
+def test_nan_metric_fails_thresholds():
+    # step_metrics reports NaN for a response that never settles
+    unsettled = performance(settling_time=math.nan)
+    assert not meets_thresholds(unsettled, THRESHOLDS)
+    assert threshold_violation(unsettled, THRESHOLDS) == math.inf
+
+
+def test_threshold_violation_is_relative():
+    assert threshold_violation(performance(), THRESHOLDS) == 0
+    assert threshold_violation(performance(settling_time=10.0), THRESHOLDS) == 1.0
+    assert threshold_violation(performance(phase_margin=22.5, settling_time=10.0), THRESHOLDS) == 1.5
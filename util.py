@@ -3,44 +3,43 @@ import numpy as np
 import control as ctrl
 import math
 
+from evaluation.evaluator import DelayLoopShapingEvaluator, pade_factors
+from evaluation.margins import margins
+from evaluation.stability import is_stable
+from evaluation.step_response import delayed_step_metrics, settling_time_from_samples, step_metrics
+
 def check_stability(omega_L, beta_b, num, den):
-    G = ctrl.TransferFunction(num, den)
     # Calculate |G(jω_c)|
-    mag_c, phase_c, _ = ctrl.frequency_response(G, omega_L)
+    G_c = np.polyval(num, 1j * omega_L) / np.polyval(den, 1j * omega_L)
     # Compute proportional gain controller
-    K_p = 1 / np.abs(mag_c)[0]
-    # Integral boost Ki(s)
-    Ki = ctrl.TransferFunction([beta_b, omega_L], [math.sqrt(beta_b*beta_b + 1), 0])
-    # Final controller
-    K = K_p * Ki 
-    # Performance Check
-    L = G * K
-    # Closed-loop transfer function
-    T = ctrl.feedback(L, 1)
-    poles = ctrl.poles(T)
-    return np.all(np.real(poles) < -0.01)
+    K_p = 1 / np.abs(G_c)
+    # Loop L = G * K_p * Ki with the integral boost Ki(s) = (beta_b s + omega_L) / (sqrt(beta_b^2 + 1) s)
+    num_L = K_p * np.polymul(num, [beta_b, omega_L])
+    den_L = np.polymul(den, [math.sqrt(beta_b*beta_b + 1), 0])
+    # Closed-loop poles are the roots of den_L + num_L
+    return is_stable(np.polyadd(den_L, num_L))
 
 def check_stability_pid(omega_L, beta_b, beta_l, num, den):
-    G = ctrl.TransferFunction(num, den)
     # Calculate |G(jω_c)|
-    mag_c, phase_c, _ = ctrl.frequency_response(G, omega_L)
+    G_c = np.polyval(num, 1j * omega_L) / np.polyval(den, 1j * omega_L)
     # Compute proportional gain controller
-    K_p = 1 / np.abs(mag_c)[0]
-    # Integral boost Ki(s)
-    Ki = ctrl.TransferFunction([beta_b, omega_L], [math.sqrt(beta_b*beta_b + 1), 0])
+    K_p = 1 / np.abs(G_c)
+    # Loop L = G * K_p * Ki with the integral boost Ki(s) = (beta_b s + omega_L) / (sqrt(beta_b^2 + 1) s)
+    num_L = K_p * np.polymul(num, [beta_b, omega_L])
+    den_L = np.polymul(den, [math.sqrt(beta_b*beta_b + 1), 0])
     # Add a lead compensator with adjusted beta
     if beta_l != "NA":
-        Kl = ctrl.TransferFunction([beta_l, omega_L], [1, beta_l * omega_L])
-    else:
-        Kl = 1
-    # Final controller
-    K = K_p * Ki * Kl
-    # Performance Check
-    L = G * K
-    # Closed-loop transfer function
-    T = ctrl.feedback(L, 1)
-    poles = ctrl.poles(T)
-    return np.all(np.real(poles) < -0.01)
+        num_L = np.polymul(num_L, [beta_l, omega_L])
+        den_L = np.polymul(den_L, [1, beta_l * omega_L])
+    # Closed-loop poles are the roots of den_L + num_L
+    return is_stable(np.polyadd(den_L, num_L))
+
+def closed_loop_step_metrics(sys):
+    # Rise time, settling time and overshoot from the same engine as the evaluators, NaN for an unstable loop
+    num_cl, den_cl = sys.num[0][0], sys.den[0][0]
+    if not is_stable(den_cl):
+        return math.nan, math.nan, math.nan
+    return step_metrics(num_cl, den_cl)
 
 def loop_shaping(omega_L, beta_b, num, den):
     # Define the transfer function G(s)
@@ -57,28 +56,22 @@ def loop_shaping(omega_L, beta_b, num, den):
     L = G * K
     # Closed-loop transfer function
     sys = ctrl.feedback(L, 1)
-    # Get the step response of the closed-loop system T(s)
-    T_out, T_time = ctrl.step_response(sys)
-    T = np.linspace(0, 500, 10000)  # More time points for better resolution
-    info = ctrl.step_info(sys)
+    # Step metrics of the closed-loop system T(s)
+    rise_time, settling_time, overshoot = closed_loop_step_metrics(sys)
     # Gain margin and phase margin
     gm, pm, wg, wp = ctrl.margin(L)
     # Steady-state error (assuming unit step input)
     ess = 1 / (1 + np.abs(ctrl.dcgain(L)))
-    return gm, pm, info['RiseTime'], info['SettlingTime'], info['Overshoot'], ess
+    return gm, pm, rise_time, settling_time, overshoot, ess
 
 
 
 def check_stability_baseline(K_num, K_den, num, den):
-    G = ctrl.TransferFunction(num, den)
-    # Define the transfer function K(s)
-    K = ctrl.TransferFunction(K_num, K_den)
-    # Performance Check
-    L = G * K
-    # Closed-loop transfer function
-    T = ctrl.feedback(L, 1)
-    poles = ctrl.poles(T)
-    return np.all(np.real(poles) < -0.001)
+    # Loop L = G * K with K(s) = K_num / K_den
+    num_L = np.polymul(num, K_num)
+    den_L = np.polymul(den, K_den)
+    # Closed-loop poles are the roots of den_L + num_L
+    return is_stable(np.polyadd(den_L, num_L), margin=0.001)
 
 
 
@@ -86,21 +79,9 @@ def compute_settling_time(sys, tol=0.02):
     # Generate the step response
     T, yout = ctrl.step_response(sys,T=20)
     
-    # Approximate the final value as the last value in the response
-    final_value = yout[-1]
-    
-    # Determine the tolerance band (e.g., 2% of the final value)
-    lower_bound = final_value * (1 - tol)
-    upper_bound = final_value * (1 + tol)
-    
-    # Find the time index where the response enters the tolerance band and stays within it
-    for i in range(len(yout)):
-        if np.all(yout[i:] >= lower_bound) and np.all(yout[i:] <= upper_bound):
-            settling_time = T[i]
-            return settling_time
-    
-    # If the settling time is not found, return None or an indication of failure
-    return None
+    # Approximate the final value as the last value in the response,
+    # then find the last sample outside the tolerance band (e.g., 2% of the final value) in a single reverse scan
+    return settling_time_from_samples(T, yout, yout[-1], tol)
 
 def performance_eval(K_num, K_den, num, den):
     # Define the transfer function G(s)
@@ -111,18 +92,14 @@ def performance_eval(K_num, K_den, num, den):
     L = G * K
     # Closed-loop transfer function
     sys = ctrl.feedback(L, 1)
-    # # Get the step response of the closed-loop system T(s)
-    # T_out, T_time = ctrl.step_response(sys)
-    # # print(T_out)
-    # T = 50000
-
-    info = ctrl.step_info(sys)
+    # Settling time of the closed-loop system T(s)
+    settling_time = closed_loop_step_metrics(sys)[1]
     # Gain margin and phase margin
     gm, pm, wg, wp = ctrl.margin(L)
     # Steady-state error (assuming unit step input)
     ess = 1 / (1 + np.abs(ctrl.dcgain(L)))
     # SettlingTime = compute_settling_time(sys)
-    return gm, pm, info['SettlingTime']
+    return gm, pm, settling_time
 
 
 
@@ -148,43 +125,72 @@ def loop_shaping_pid(omega_L, beta_b, beta_l, num, den):
     L = G * K
     # Closed-loop transfer function
     sys = ctrl.feedback(L, 1)
-    # Get the step response of the closed-loop system T(s)
-    T_out, T_time = ctrl.step_response(sys)
-    info = ctrl.step_info(sys, 200)
+    # Step metrics of the closed-loop system T(s)
+    rise_time, settling_time, overshoot = closed_loop_step_metrics(sys)
     # Gain margin and phase margin
     gm, pm, wg, wp = ctrl.margin(L)
     # Steady-state error (assuming unit step input)
     ess = 1 / (1 + np.abs(ctrl.dcgain(L)))
-    return gm, pm, info['RiseTime'], info['SettlingTime'], info['Overshoot'], ess
+    return gm, pm, rise_time, settling_time, overshoot, ess
+
+
+def meets_thresholds(performance, thresholds):
+    # True when no metric of a stable design violates its min/max threshold; a NaN metric never meets one
+    return threshold_violation(performance, thresholds) == 0
+
+
+def threshold_violation(performance, thresholds):
+    # total relative distance of a stable design to its thresholds, 0 when all are met
+    violation = 0.0
+    for metric, specs in thresholds.items():
+        value = performance.get(metric)
+        if value is None:
+            continue
+        if value != value:  # NaN, e.g. a response that never settles
+            return float('inf')
+        if 'min' in specs and value < specs['min']:
+            violation += (specs['min'] - value) / max(abs(specs['min']), 1e-12)
+        elif 'max' in specs and value > specs['max']:
+            violation += (value - specs['max']) / max(abs(specs['max']), 1e-12)
+    return violation
+
+
+FEEDBACK_HEADER = "Here are the designs and their performances:\n"
+FEEDBACK_QUESTION = "Based on the above designs, what improvements would you suggest for the next iteration?"
+
+
+def design_feedback_block(i, design, thresholds):
+    """
+    Rendered "### Design i" entry of feedback_prompt: parameters, performance and threshold feedback of one design.
+    """
+    parameters = ', '.join(f"{key}={value}" for key, value in design['parameters'].items())
+    performance = ', '.join(f"{key}={value}" if value != "unstable" else "unstable" for key, value in design['performance'].items())
+
+    # Check against thresholds and generate feedback
+    feedback = []
+    if "unstable" in design['performance'].values():
+        feedback.append("Your design is unstable, there are unstable poles. Please redesign!")
+    else:
+        for metric, specs in thresholds.items():
+            value = design['performance'].get(metric)
+            if value is not None:
+                if 'min' in specs and value < specs['min']:
+                    feedback.append(specs['message'])
+                elif 'max' in specs and value > specs['max']:
+                    feedback.append(specs['message'])
+
+    block = f"### Design {i}\nParameters: {parameters}\nPerformance: {performance}\n"
+    if feedback:
+        block += "Feedback: " + " ".join(feedback) + "\n"
+    return block + "\n"
 
 
 def feedback_prompt(design_memory, thresholds):
     designs = design_memory.get_all_designs()
-    prompt = "Here are the designs and their performances:\n"
-    
+    prompt = FEEDBACK_HEADER
     for i, design in enumerate(designs, 1):
-        parameters = ', '.join(f"{key}={value}" for key, value in design['parameters'].items())
-        performance = ', '.join(f"{key}={value}" if value != "unstable" else "unstable" for key, value in design['performance'].items())
-        
-        # Check against thresholds and generate feedback
-        feedback = []
-        if "unstable" in design['performance'].values():
-            feedback.append("Your design is unstable, there are unstable poles. Please redesign!")
-        else:
-            for metric, specs in thresholds.items():
-                value = design['performance'].get(metric)
-                if value is not None:
-                    if 'min' in specs and value < specs['min']:
-                        feedback.append(specs['message'])
-                    elif 'max' in specs and value > specs['max']:
-                        feedback.append(specs['message'])
-
-        prompt += f"### Design {i}\nParameters: {parameters}\nPerformance: {performance}\n"
-        if feedback:
-            prompt += "Feedback: " + " ".join(feedback) + "\n"
-        prompt += "\n"
-        
-    prompt += "Based on the above designs, what improvements would you suggest for the next iteration?"
+        prompt += design_feedback_block(i, design, thresholds)
+    prompt += FEEDBACK_QUESTION
     return prompt
 
 
@@ -247,86 +253,26 @@ def feedback_prompt_wo_feedback(design_memory, thresholds):
 
 
 def loop_shaping_w_delay(omega_L, beta_b, num, den, tau):
-    # Define the transfer function G(s)
-    G = ctrl.TransferFunction(num, den)
-    
-    # Use Pade approximation for the time delay
-    pade_num, pade_den = ctrl.pade(tau, 5)  # 5th-order Pade approximation
-    delay_approx = ctrl.TransferFunction(pade_num, pade_den)
-    
-    # Incorporate the delay into the transfer function G(s)
-    G_delayed = G * delay_approx
-    
-    # Calculate |G(jω_L)| with the delay included
-    mag_c, phase_c, _ = ctrl.frequency_response(G_delayed, omega_L)
-    
-    # Compute proportional gain controller
-    K_p = 1 / np.abs(mag_c)[0]
-    
-    # Integral boost Ki(s)
-    Ki = ctrl.TransferFunction([beta_b, omega_L], [math.sqrt(beta_b * beta_b + 1), 0])
-
-    # if beta_l != "NA":
-    #     Kl = ctrl.TransferFunction([beta_l, omega_L], [1, beta_l * omega_L])
-    # else:
-    #     Kl = 1
-    
-    # Final controller
-    K = K_p * Ki 
-    
-    # Performance Check
-    L = G_delayed * K
-    
-    # Closed-loop transfer function
-    sys = ctrl.feedback(L, 1)
-    
-
-    # Step response information
-    info = ctrl.step_info(sys)
-    
-    # Gain margin and phase margin
-    gm, pm, wg, wp = ctrl.margin(L)
-    
-    # Steady-state error (assuming unit step input)
-    ess = 1 / (1 + np.abs(ctrl.dcgain(L)))
-    
-    return gm, pm, info['RiseTime'], info['SettlingTime'], info['Overshoot'], ess
+    # Exact delay exp(-tau s) for the margins and the step response; the cached Pade model only gates stability
+    evaluation = DelayLoopShapingEvaluator(num, den, tau).evaluate(omega_L, beta_b)
+    return (evaluation.gain_margin, evaluation.phase_margin, evaluation.rise_time, evaluation.settling_time,
+            evaluation.overshoot, evaluation.steadystate_error)
 
 
 
 
 def performance_eval_w_delay(K_num, K_den, num, den, tau):
-    # Define the transfer function G(s)
-    G = ctrl.TransferFunction(num, den)
-
-    # Use Pade approximation for the time delay
-    pade_num, pade_den = ctrl.pade(tau, 5)  # 5th-order Pade approximation
-    delay_approx = ctrl.TransferFunction(pade_num, pade_den)
-
-    G = G * delay_approx
-    # Define the transfer function K(s)
-    K = ctrl.TransferFunction(K_num, K_den)
-    # Performance Check
-    L = G * K
-    # Closed-loop transfer function
-    sys = ctrl.feedback(L, 1)
-    # # Get the step response of the closed-loop system T(s)
-    # T_out, T_time = ctrl.step_response(sys)
-    # # print(T_out)
-    # T = 50000
-
-    try:
-        # Try to compute the step info
-        info = ctrl.step_info(sys, 200)
-        settling_time = info['SettlingTime']
-    except Exception as e:
-        # If an error occurs, print the error message and return None or a default value
-        print(f"An error occurred while calculating step info: {e}")
+    # Loop L = G * K without the delay, which is applied exactly by the margins and the step simulation
+    num_L = np.polymul(num, K_num)
+    den_L = np.polymul(den, K_den)
+    # Stability and the simulation horizon use the cached 5th-order Pade approximation of the delay
+    pade_num, pade_den = pade_factors(float(tau))
+    char = np.polyadd(np.polymul(den_L, pade_den), np.polymul(num_L, pade_num))
+    if is_stable(char):
+        settling_time = delayed_step_metrics(num_L, den_L, tau, np.roots(char))[1]
+    else:
+        # An unstable loop never settles
         settling_time = 10e5
-
     # Gain margin and phase margin
-    gm, pm, wg, wp = ctrl.margin(L)
-    # Steady-state error (assuming unit step input)
-    ess = 1 / (1 + np.abs(ctrl.dcgain(L)))
-    # SettlingTime = compute_settling_time(sys)
+    gm, pm, wg, wp = margins(num_L, den_L, tau=tau)
     return gm, pm, settling_time
\ No newline at end of file